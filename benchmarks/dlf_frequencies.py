@@ -0,0 +1,42 @@
+"""
+Lagged convolution and splined Hankel DLF for many frequencies.
+
+Compares the former behaviour (looping over frequencies, ``loop='freq'``) with
+the vectorized computation over all frequencies (default).
+
+Run it with ``python benchmarks/dlf_frequencies.py``.
+
+"""
+import timeit
+
+import numpy as np
+
+import empymod
+
+
+def main(nfreq=100, number=5):
+    inp = {
+        'src': [0, 0, 250],
+        'rec': [np.arange(1, 21)*500, np.zeros(20), 300],
+        'depth': [0, 300, 1000, 1050],
+        'res': [1e20, 0.3, 1, 50, 1],
+        'freqtime': np.logspace(-3, 2, nfreq),
+        'verb': 1,
+    }
+
+    print(f"  {nfreq} frequencies, 20 offsets; best of {number} runs\n")
+    print("  pts_per_dec     loop='freq'   vectorized   speed-up")
+    for pts_per_dec in [-1, 10]:
+        htarg = {'pts_per_dec': pts_per_dec}
+        times = []
+        for loop in ['freq', None]:
+            def run():
+                empymod.dipole(htarg=htarg, loop=loop, **inp)
+            run()  # Warm-up (numba compilation)
+            times.append(min(timeit.repeat(run, number=1, repeat=number)))
+        print(f"  {pts_per_dec:>11}   {times[0]*1e3:>9.1f} ms  "
+              f"{times[1]*1e3:>8.1f} ms   {times[0]/times[1]:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
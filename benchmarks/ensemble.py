@@ -0,0 +1,51 @@
+"""
+Runtime of an ensemble of models versus one ``dipole`` call per model.
+
+Monte Carlo type study: the same layered geometry with random resistivities.
+The ensemble, ``dipole(res=res)`` with ``res`` of shape ``(nmodel, nlayer)``,
+checks the input once and stacks the models along the frequency axis of the
+wavenumber-domain kernel, in chunks of bounded memory. The saving is the
+per-call overhead; it is therefore largest for small surveys, whereas large
+surveys are dominated by the kernel itself.
+
+Run it with ``python benchmarks/ensemble.py``.
+
+"""
+import timeit
+
+import numpy as np
+
+import empymod
+
+
+def main(number=3):
+    nmodel = 200
+    rng = np.random.default_rng(1)
+    res = np.c_[np.full(nmodel, 2e14), 10**rng.uniform(0, 2, (nmodel, 5))]
+
+    print(f"  {nmodel} models of 6 layers; best of {number} runs\n")
+    print("  offsets  frequencies      one by one        ensemble   speed-up")
+    for noff, nfreq in [(1, 1), (5, 3), (20, 10)]:
+        inp = {
+            'src': [0, 0, 1],
+            'rec': [np.linspace(100, 2000, noff), np.zeros(noff), 2],
+            'depth': [0, 20, 50, 100, 200],
+            'freqtime': np.logspace(-1, 3, nfreq),
+            'verb': 1,
+        }
+
+        def single():
+            return [empymod.dipole(res=r, **inp) for r in res]
+
+        def ensemble():
+            return empymod.dipole(res=res, **inp)
+
+        assert np.allclose(single(), ensemble(), rtol=1e-12, atol=0)
+        tsingle = min(timeit.repeat(single, number=1, repeat=number))
+        tensemble = min(timeit.repeat(ensemble, number=1, repeat=number))
+        print(f"  {noff:>7}  {nfreq:>11}   {tsingle*1e3:>10.1f} ms   "
+              f"{tensemble*1e3:>10.1f} ms   {tsingle/tensemble:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
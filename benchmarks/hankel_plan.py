@@ -0,0 +1,65 @@
+"""
+Repeated DLF calls with the same geometry, with and without a HankelPlan.
+
+An inversion-like loop of successive ``dipole`` calls where only the
+resistivities change, with and without
+``htarg={'plan': empymod.transform.HankelPlan(htarg)}``. With the plan, the
+lambdas, interpolation points, unique lambdas, filter weights, and angle
+factors are computed once, in the first call. The saving is largest for small
+models, where this setup is a larger share of each call.
+
+Run it with ``python benchmarks/hankel_plan.py``.
+
+"""
+from timeit import default_timer
+
+import numpy as np
+
+import empymod
+
+
+CASES = [(1, 1, 3), (5, 2, 4), (20, 10, 5)]
+
+
+def main(number=1000):
+    rng = np.random.default_rng(1)
+    print(f"  {number} dipole evaluations with changing resistivities; "
+          "median time per call\n")
+    print("  DLF           offsets  freqs  layers       without"
+          "          with   speed-up")
+    for pts_per_dec in [0, -1]:
+        for noff, nfreq, nlayer in CASES:
+            inp = {
+                'src': [0, 0, 100],
+                'rec': [np.linspace(500, 5000, noff), np.zeros(noff), 200],
+                'depth': np.r_[0, np.arange(1, nlayer-1)*50.],
+                'freqtime': np.logspace(-1, 1, nfreq),
+                'verb': 1,
+            }
+            res = 10**rng.uniform(0, 2, (number, nlayer))
+            res[:, 0] = 2e14
+            htarg = {'pts_per_dec': pts_per_dec}
+
+            times = {}
+            for name in ['without', 'with']:
+                if name == 'with':
+                    thtarg = {'plan': empymod.transform.HankelPlan(htarg)}
+                else:
+                    thtarg = htarg
+                empymod.dipole(res=res[0], htarg=thtarg, **inp)  # Warm-up
+                times[name] = np.zeros(number)
+                for i in range(number):
+                    t0 = default_timer()
+                    empymod.dipole(res=res[i], htarg=thtarg, **inp)
+                    times[name][i] = default_timer() - t0
+                times[name] = np.median(times[name])
+
+            kind = 'standard' if pts_per_dec == 0 else 'lagged'
+            print(f"  {kind:<10}   {noff:>8}  {nfreq:>5}  {nlayer:>6}   "
+                  f"{times['without']*1e3:>8.2f} ms  "
+                  f"{times['with']*1e3:>8.2f} ms   "
+                  f"{times['without']/times['with']:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Import time of empymod, measured with ``python -X importtime``.
+
+``import empymod`` only defines the version; modules and heavy dependencies
+(numpy, scipy, numba, libdlf, scooby) are imported on first use. Shown is the
+cumulative import time of the imported empymod modules (and their
+dependencies) for some typical first statements, and the wall time of the
+CLI call ``python -m empymod --version``; best of `number` fresh processes.
+
+Run it with ``python benchmarks/import_time.py``.
+
+"""
+import sys
+import subprocess
+from timeit import default_timer
+
+STATEMENTS = [
+    "import empymod",
+    "import empymod; empymod.__version__",
+    "from empymod import dipole",
+    "import empymod; empymod.Report",
+    "import empymod; empymod.tmtemod",
+]
+
+
+def import_time(statement):
+    """Return the cumulative import time (s) of `statement`."""
+    out = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', statement],
+            capture_output=True, check=True)
+    # Sum the cumulative times of the top-level imports
+    total = 0
+    for line in out.stderr.decode().splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line.split('|')
+        if cumulative.strip().isdigit() and not name.startswith('  '):
+            total += int(cumulative)
+    return total/1e6
+
+
+def main(number=5):
+    # Ignore the imports of the interpreter start-up (site etc.)
+    base = min(import_time("pass") for _ in range(number))
+
+    print(f"  Cumulative import time, best of {number}\n")
+    for statement in STATEMENTS:
+        time = min(import_time(statement) for _ in range(number)) - base
+        print(f"  {statement:<40} {time*1e3:>8.1f} ms")
+
+    times = []
+    for _ in range(number):
+        t0 = default_timer()
+        subprocess.run([sys.executable, '-m', 'empymod', '--version'],
+                       capture_output=True, check=True)
+        times.append(default_timer() - t0)
+    print(f"\n  {'python -m empymod --version':<40} "
+          f"{min(times)*1e3:>8.1f} ms (wall time)")
+
+
+if __name__ == '__main__':
+    main()
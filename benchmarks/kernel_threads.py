@@ -0,0 +1,51 @@
+"""
+Scaling of the multi-threaded wavenumber-domain kernels.
+
+Runs the default and the fused (low-memory) kernel with 1 to N threads, where N
+is the number of threads available to numba (``NUMBA_NUM_THREADS``).
+
+Run it with ``python benchmarks/kernel_threads.py``.
+
+"""
+import timeit
+
+import numba as nb
+import numpy as np
+
+import empymod
+
+
+def main(number=3):
+    inp = {
+        'src': [0, 0, 250],
+        'rec': [np.linspace(500, 10000, 100), np.zeros(100), 300],
+        'depth': np.r_[0, np.arange(1, 30)*50],
+        'res': np.r_[1e20, np.linspace(1, 100, 30)],
+        'freqtime': np.logspace(-3, 2, 50),
+        'verb': 1,
+    }
+
+    nmax = nb.config.NUMBA_NUM_THREADS
+    nthreads = sorted({1, *[2**i for i in range(1, 8) if 2**i < nmax], nmax})
+
+    print(f"  30 layers, 50 frequencies, 100 offsets; best of {number} runs\n")
+    print("  threads        default     speed-up        fused     speed-up")
+    ref = {}
+    for n in nthreads:
+        times = {}
+        for kernel in ['default', 'fused']:
+            def run():
+                empymod.dipole(htarg={'kernel': kernel}, **inp)
+            with empymod.num_threads(n):
+                run()  # Warm-up (numba compilation)
+                times[kernel] = min(
+                        timeit.repeat(run, number=1, repeat=number))
+            ref.setdefault(kernel, times[kernel])
+        print(f"  {n:>7}   {times['default']*1e3:>9.1f} ms   "
+              f"{ref['default']/times['default']:>7.1f}x   "
+              f"{times['fused']*1e3:>9.1f} ms   "
+              f"{ref['fused']/times['fused']:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
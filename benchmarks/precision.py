@@ -0,0 +1,51 @@
+"""
+Single (complex64) versus double (complex128) precision.
+
+Runs the 1836 regression cases of ``tests/data/regression.npz`` (18 models, 34
+source-receiver configurations, 3 frequencies, 49 receivers each) in double
+and in single precision, and reports the runtimes and the error of the single
+precision results. The error of each case is the maximum absolute difference
+normalized by the maximum amplitude of the double-precision result.
+
+Run it with ``python benchmarks/precision.py``.
+
+"""
+import time
+from os.path import join, dirname
+
+import numpy as np
+
+import empymod
+
+
+def main():
+    fname = join(dirname(__file__), '..', 'tests', 'data', 'regression.npz')
+    cases = np.load(fname, allow_pickle=True)['res'][()]
+
+    # Warm-up (numba compilation for complex64 and complex128)
+    for precision in ['double', 'single']:
+        empymod.dipole(precision=precision, **next(iter(cases.values()))[0])
+
+    runtime = {}
+    out = {}
+    for precision in ['double', 'single']:
+        t0 = time.perf_counter()
+        out[precision] = [empymod.dipole(precision=precision, **val[0])
+                          for val in cases.values()]
+        runtime[precision] = time.perf_counter() - t0
+
+    error = np.array([
+        np.max(abs(s - d))/np.max(abs(d))
+        for d, s in zip(out['double'], out['single']) if np.any(d != 0)
+    ])
+
+    print(f"  {len(cases)} regression cases\n")
+    print(f"  runtime double  : {runtime['double']:8.2f} s")
+    print(f"  runtime single  : {runtime['single']:8.2f} s")
+    print("\n  relative error of single precision (normalized by max. amp.)")
+    for pc in [50, 90, 99, 100]:
+        print(f"  {pc:>3}th percentile: {np.percentile(error, pc):8.1e}")
+
+
+if __name__ == '__main__':
+    main()
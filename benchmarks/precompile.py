@@ -0,0 +1,67 @@
+"""
+Startup latency of a worker process with cold and warm numba caches.
+
+Each case runs in a fresh process: import empymod, optionally
+``empymod.kernel.precompile(cache_dir)``, then the first and the second call
+of ``dipole``. Cold means an empty cache directory, warm a second process
+with the cache filled by the first. Without ``precompile`` the cache
+directory is set with ``NUMBA_CACHE_DIR``.
+
+Run it with ``python benchmarks/precompile.py``.
+
+"""
+import os
+import sys
+import json
+import tempfile
+import subprocess
+
+SCRIPT = """if True:
+    import json
+    from timeit import default_timer
+    t0 = default_timer()
+    import numpy as np
+    import empymod
+    out = {{'import': default_timer() - t0}}
+    if {cache_dir!r}:
+        t0 = default_timer()
+        empymod.kernel.precompile({cache_dir!r})
+        out['precompile'] = default_timer() - t0
+    inp = {{'src': [0, 0, 200], 'rec': [np.arange(1, 21)*100, 0, 250],
+           'depth': [0, 300, 500], 'res': [2e14, 1, 10, 100],
+           'freqtime': np.logspace(-1, 1, 10), 'verb': 1}}
+    for name in ['first', 'second']:
+        t0 = default_timer()
+        empymod.dipole(**inp)
+        out[name] = default_timer() - t0
+    print(json.dumps(out))
+"""
+
+
+def run(cache_dir, precompile):
+    """Run the worker in a fresh process; return its timings."""
+    env = {k: v for k, v in os.environ.items() if k != 'NUMBA_CACHE_DIR'}
+    if not precompile:
+        env['NUMBA_CACHE_DIR'] = cache_dir
+    script = SCRIPT.format(cache_dir=cache_dir if precompile else '')
+    out = subprocess.run([sys.executable, '-c', script], env=env,
+                         capture_output=True, check=True)
+    return json.loads(out.stdout.decode().split('\n')[-2])
+
+
+def main():
+    print("  Fresh process; dipole: 10 frequencies, 20 offsets\n")
+    print("  cache   precompile     import   precompile   first call   "
+          "second call")
+    for precompile in [False, True]:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for state in ['cold', 'warm']:
+                t = run(cache_dir, precompile)
+                ptxt = f"{t['precompile']:>9.2f} s" if precompile else ' '*11
+                print(f"  {state:<5}   {str(precompile):<10} "
+                      f"{t['import']:>8.2f} s  {ptxt}  {t['first']:>9.3f} s"
+                      f"  {t['second']:>10.3f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Incremental reflections with a ReflectionCache versus the number of layers.
+
+Successive calls where a single layer changes (as in an inversion with
+coordinate-wise updates, or a time-lapse study), with and without
+``htarg={'cache': empymod.kernel.ReflectionCache()}``. Only the recursion from
+the changed layer towards the source and receiver layers is recomputed; the
+saving is therefore largest for changes close to source and receiver (here at
+the top of the model), and for many layers.
+
+Run it with ``python benchmarks/reflection_cache.py``.
+
+"""
+import timeit
+
+import numpy as np
+
+import empymod
+
+
+def main(number=5):
+    print("  20 frequencies, 50 offsets; changing one layer at the given "
+          f"relative depth;\n  dipole time, best of {number} runs\n")
+    print("  layers  changed        without           with   speed-up")
+    for nlayer in [10, 50, 100]:
+        inp = {
+            'src': [0, 0, 1],
+            'rec': [np.linspace(500, 5000, 50), np.zeros(50), 2],
+            'depth': np.r_[0, np.arange(1, nlayer-1)*20.],
+            'freqtime': np.logspace(-2, 2, 20),
+            'verb': 1,
+        }
+        res = np.r_[1e20, np.ones(nlayer-1)]
+
+        for frac in [0.1, 0.5, 0.9]:
+            ilayer = max(2, int(frac*nlayer))
+            times = {}
+            for name, htarg in [('without', {}), ('with', {'cache': None})]:
+                if 'cache' in htarg:
+                    htarg['cache'] = empymod.kernel.ReflectionCache()
+
+                def run():
+                    res[ilayer] = 1.5 if res[ilayer] == 1 else 1
+                    empymod.dipole(res=res, htarg=htarg, **inp)
+
+                run()  # Warm-up (numba compilation, filling the cache)
+                times[name] = min(timeit.repeat(run, number=1, repeat=number))
+
+            print(f"  {nlayer:>6}   {frac:>6.0%}   "
+                  f"{times['without']*1e3:>9.1f} ms   "
+                  f"{times['with']*1e3:>9.1f} ms   "
+                  f"{times['without']/times['with']:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Runtime of the TM/TE split of ``empymod.scripts.tmtemod``.
+
+Compares the compiled kernel ``tmtemod.wavenumber`` (all ten contributions in
+one pass, sharing Gamma and the reflections with ``kernel.greenfct``) to the
+NumPy version ``tmtemod.greenfct`` for the same wavenumbers. Then compares
+``tmtemod.dipole`` for many frequencies in one call, with the standard and the
+lagged convolution DLF, to one call per frequency (as required before), and to
+the total field of ``empymod.dipole``.
+
+Run it with ``python benchmarks/tmtemod.py``.
+
+"""
+import timeit
+
+import numpy as np
+
+import empymod
+from empymod.scripts import tmtemod
+
+
+def main(number=5):
+    depth = [0, 150, 300, 500, 600]
+    res = [2e14, .3, 10, 4, 3, 1]
+    src = [0, 0, 200]
+
+    print(f"  Kernel; 6 layers, DLF key_201_2012; best of {number} runs\n")
+    print("  frequencies  offsets           NumPy        compiled   speed-up")
+    filt = empymod.filters.Hankel().key_201_2012
+    for nfreq, noff in [(1, 10), (10, 10), (20, 100)]:
+        freq = np.logspace(-2, 2, nfreq)
+        off = np.linspace(500, 5000, noff)
+        model = empymod.utils.check_model(
+                depth, res, None, None, None, None, None, False, 0)
+        _, etaH, etaV, zetaH, zetaV = empymod.utils.check_frequency(
+                freq, *model[1:7], 0)
+        inp = {'zsrc': 200., 'zrec': 210., 'lsrc': 2, 'lrec': 2,
+               'depth': model[0], 'etaH': etaH, 'etaV': etaV, 'zetaH': zetaH,
+               'zetaV': zetaV, 'lambd': filt.base/off[:, None]}
+        tmtemod.wavenumber(**inp)  # Compilation
+
+        tnumpy = min(timeit.repeat(
+            lambda: tmtemod.greenfct(**inp), number=1, repeat=number))
+        tnumba = min(timeit.repeat(
+            lambda: tmtemod.wavenumber(**inp), number=1, repeat=number))
+        print(f"  {nfreq:>11}  {noff:>7}   {tnumpy*1e3:>10.2f} ms   "
+              f"{tnumba*1e3:>10.2f} ms   {tnumpy/tnumba:>7.1f}x")
+
+    print("\n  Modelling; 20 frequencies, 100 offsets; best of "
+          f"{number} runs\n")
+    rec = [np.linspace(500, 5000, 100), np.zeros(100), 210]
+    freq = np.logspace(-2, 2, 20)
+    runs = {
+        'tmtemod.dipole, one per freq.': lambda: [tmtemod.dipole(
+            src, rec, depth, res, f, verb=0) for f in freq],
+        'tmtemod.dipole, standard DLF': lambda: tmtemod.dipole(
+            src, rec, depth, res, freq, verb=0),
+        'tmtemod.dipole, loop="freq"': lambda: tmtemod.dipole(
+            src, rec, depth, res, freq, verb=0, loop='freq'),
+        'tmtemod.dipole, lagged DLF': lambda: tmtemod.dipole(
+            src, rec, depth, res, freq, verb=0, htarg={'pts_per_dec': -1}),
+        'empymod.dipole (total field)': lambda: empymod.dipole(
+            src, rec, depth, res, freq, xdirect=False, verb=0),
+    }
+    for name, run in runs.items():
+        run()  # Compilation
+        time = min(timeit.repeat(run, number=1, repeat=number))
+        print(f"  {name:<30}  {time*1e3:>10.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
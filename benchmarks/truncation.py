@@ -0,0 +1,62 @@
+"""
+Accuracy and runtime of the skin-depth truncation of deep layers.
+
+Runs ``dipole`` with ``truncate`` for a surface survey over a model of many
+layers, for frequency ranges from low (little truncation) to high (most of
+the layers are removed), and compares it to the untruncated result. The error
+is relative to the maximum amplitude of each receiver.
+
+Run it with ``python benchmarks/truncation.py``.
+
+"""
+import timeit
+
+import numpy as np
+
+import empymod
+
+
+def main(number=3):
+    nlayer = 200
+    rng = np.random.default_rng(1)
+    inp = {
+        'src': [0, 0, 1],
+        'rec': [np.linspace(100, 2000, 20), np.zeros(20), 2],
+        'depth': np.r_[0, np.arange(1, nlayer-1)*10.],
+        'res': np.r_[2e14, 10**rng.uniform(0, 2, nlayer-1)],
+        'verb': 1,
+    }
+
+    print(f"  {nlayer} layers of 10 m, 20 offsets, 20 frequencies; best of "
+          f"{number} runs\n")
+    print("  frequencies       truncate   layers [min-max]     rel. error"
+          "       time   speed-up")
+    for fmin, fmax in [(1e-2, 1e1), (1e0, 1e3), (1e2, 1e5)]:
+        freq = np.logspace(np.log10(fmin), np.log10(fmax), 20)
+        ref = empymod.dipole(freqtime=freq, **inp)
+        tref = min(timeit.repeat(
+            lambda: empymod.dipole(freqtime=freq, **inp),
+            number=1, repeat=number))
+
+        # Number of layers after truncation (for information)
+        depth = np.r_[-np.inf, inp['depth']]
+        _, etaH, _, zetaH, _ = empymod.utils.check_frequency(
+                freq, inp['res'], np.ones(nlayer), np.ones(nlayer),
+                np.ones(nlayer), np.ones(nlayer), np.ones(nlayer), 0)
+
+        for truncate in [1e-8, 1e-12, 1e-15]:
+            out = empymod.dipole(freqtime=freq, truncate=truncate, **inp)
+            time = min(timeit.repeat(
+                lambda: empymod.dipole(
+                    freqtime=freq, truncate=truncate, **inp),
+                number=1, repeat=number))
+            error = np.max(abs(out-ref)/abs(ref).max(axis=0))
+            nl = empymod.utils.get_nlayer_truncated(
+                    depth, 1, 2, etaH, zetaH, truncate)
+            print(f"  {fmin:>5.0e}-{fmax:<5.0e}    {truncate:>7.0e}   "
+                  f"{nl.min():>6} - {nl.max():<6}    {error:>10.1e}   "
+                  f"{time*1e3:>6.0f} ms   {tref/time:>6.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -14,27 +14,59 @@
 # License for the specific language governing permissions and limitations under
 # the License.
 
-# Import all modules
-from empymod import io
-from empymod import model
-from empymod import utils
-from empymod import kernel
-from empymod import filters
-from empymod import scripts
-from empymod import transform
-
-# Import most important functions
-from empymod.filters import DigitalFilter
-from empymod.model import bipole, dipole, loop, ip_and_q
-from empymod.utils import EMArray, set_minimum, get_minimum, Report
-
-# For top-namespace
-from empymod.scripts import fdesign, tmtemod
-from empymod.model import analytical, gpr, dipole_k, fem, tem
+
+import importlib
+
+# Version: Defined here, as it is required without importing anything else
+# (e.g., `empymod --version`); utils re-exports it for use within the package.
+try:
+    # - Released versions just tags:       1.10.0
+    # - GitHub commits add .dev#+hash:     1.10.1.dev3+g973038c
+    # - Uncommitted changes add timestamp: 1.10.1.dev3+g973038c.d20191022
+    from empymod.version import version as __version__
+except ImportError:
+    # If it was not installed, then we don't know the version. We could throw a
+    # warning here, but this case *should* be rare. empymod should be installed
+    # properly!
+    from datetime import datetime
+    __version__ = 'unknown-'+datetime.today().strftime('%Y%m%d')
+
+# All modules and functions are imported on first use (module-level
+# __getattr__), so `import empymod` does not import numba, scipy, libdlf, or
+# scooby.
+_modules = ['io', 'model', 'utils', 'kernel', 'filters', 'scripts',
+            'transform']
+
+# Most important functions, and for top-namespace
+_functions = {
+    'DigitalFilter': 'filters',
+    'bipole': 'model', 'dipole': 'model', 'loop': 'model',
+    'ip_and_q': 'model', 'analytical': 'model', 'gpr': 'model',
+    'dipole_k': 'model', 'dipole_jacobian': 'model', 'fem': 'model',
+    'tem': 'model',
+    'EMArray': 'utils', 'set_minimum': 'utils', 'get_minimum': 'utils',
+    'Report': 'utils',
+    'set_num_threads': 'kernel', 'get_num_threads': 'kernel',
+    'num_threads': 'kernel', 'profile': 'kernel',
+    'fdesign': 'scripts', 'tmtemod': 'scripts',
+}
 
 __all__ = ['model', 'utils', 'filters', 'transform', 'kernel', 'scripts', 'io',
            'bipole', 'dipole', 'loop', 'ip_and_q', 'EMArray', 'set_minimum',
-           'get_minimum', 'DigitalFilter', 'Report']
+           'get_minimum', 'set_num_threads', 'get_num_threads', 'num_threads',
+           'profile', 'DigitalFilter', 'Report']
+
+
+def __getattr__(name):
+    """Import modules and functions on first use."""
+    if name in _modules:
+        return importlib.import_module(f"{__name__}.{name}")
+    if name in _functions:
+        module = importlib.import_module(f"{__name__}.{_functions[name]}")
+        globals()[name] = getattr(module, name)
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
-# Version defined in utils, so we can easier use it within the package itself.
-__version__ = utils.__version__
+def __dir__():
+    return sorted([*_modules, *_functions, '__version__'])
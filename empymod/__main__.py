@@ -21,7 +21,7 @@ Entry point for the command-line interface (CLI).
 import sys
 import argparse
 
-from empymod import io, model, utils
+from empymod import __version__
 
 
 def main(args=None):
@@ -83,16 +83,17 @@ def main(args=None):
 
     # empymod version info.
     if args_dict.pop('version'):  # empymod version info.
-        print(f"empymod v{utils.__version__}")
+        print(f"empymod v{__version__}")
 
     # empymod report.
     elif args_dict.pop('report'):
-        print(utils.Report())
+        from empymod.utils import Report
+        print(Report())
 
     # Info if not at list routine and input provided.
     elif len(sys.argv) < 3:
         print(f"{parser.description}\n=> Type `empymod --help` for "
-              f"more info (empymod v{utils.__version__}).")
+              f"more info (empymod v{__version__}).")
 
     # Actually compute.
     else:
@@ -104,6 +105,7 @@ def main(args=None):
 
 def run(args_dict):
     """Run empymod with provided arguments."""
+    from empymod import io, model
 
     # Run empymod, enforce ``squeeze=False``.
     iname = args_dict['input']
@@ -29,17 +29,40 @@ root directory for more information regarding the involved licenses.
 # the License.
 
 
+import os
+import threading
+from timeit import default_timer
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import scipy as sp
 import numba as nb
 
-__all__ = ['wavenumber', 'angle_factor', 'fullspace', 'greenfct',
-           'reflections', 'fields', 'halfspace']
+__all__ = ['wavenumber', 'wavenumber_multi', 'wavenumber_pairs',
+           'wavenumber_fused', 'wavenumber_jacobian', 'call_threaded',
+           'set_num_threads', 'get_num_threads', 'num_threads', 'profile',
+           'Profile', 'precompile', 'angle_factor', 'fullspace', 'greenfct',
+           'reflections', 'ReflectionCache', 'fields', 'halfspace']
 
 # Numba-settings
 _numba_setting = {'nogil': True, 'cache': True}
 _numba_with_fm = {'fastmath': True, **_numba_setting}
 
+# Parallel (prange) functions are not cached, as numba fails to load them
+# reliably from the cache
+_numba_parallel = {'nogil': True, 'parallel': True}
+
+# Maximum number of wavenumbers computed at once by the fused kernel
+_fused_nlambda = 256
+
+# Number of threads of the kernels (set_num_threads; num_threads per thread)
+_num_threads = 1
+_local_threads = threading.local()
+
+# Active profile of the current thread (profile)
+_local_profile = threading.local()
+
 
 def __dir__():
     return __all__
@@ -90,15 +113,333 @@ def wavenumber(zsrc, zrec, lsrc, lrec, depth, etaH, etaV, zetaH, zetaV, lambd,
     are correct, as no checks are carried out here.
 
     """
-    nfreq, _ = etaH.shape
-    noff, nlambda = lambd.shape
-
     # ** CALCULATE GREEN'S FUNCTIONS
     # Shape of PTM, PTE: (nfreq, noffs, nfilt)
     PTM, PTE = greenfct(zsrc, zrec, lsrc, lrec, depth, etaH, etaV, zetaH,
                         zetaV, lambd, ab, xdirect, msrc, mrec)
 
     # ** AB-SPECIFIC COLLECTION OF PJ0, PJ1, AND PJ0b
+    return _collect(PTM, PTE, lambd, ab, mrec)
+
+
+def wavenumber_multi(zsrc, zrec, lsrc, lrec, depth, etaH, etaV, zetaH, zetaV,
+                     lambd, ab_calc, xdirect, msrc, mrec, cache=None):
+    r"""Calculate wavenumber domain solution for several `ab` at once.
+
+    Same as :func:`wavenumber`, but for a list of source-receiver
+    configurations `ab_calc`, which all share the same `msrc` and `mrec`. The
+    parts of the Green's functions which do not depend on `ab` (Gamma,
+    reflection coefficients, and field propagators) are computed only once for
+    TM and TE, and the fields only once for the up- and downgoing plus/minus
+    combinations, instead of once per `ab`.
+
+    This function is called from :func:`empymod.transform.hankel_dlf` if
+    several `ab` are required (rotated sources or receivers). It is
+    :func:`wavenumber_pairs` for a single depth pair.
+
+    If a :class:`ReflectionCache` is provided as `cache`, the reflections are
+    updated incrementally from the ones of the previous call.
+
+
+    Returns
+    -------
+    PJ : list
+        List of tuples `(PJ0, PJ1, PJ0b)`, one for each `ab` in `ab_calc`.
+
+    """
+    return wavenumber_pairs(np.atleast_1d(zsrc), np.atleast_1d(zrec), lsrc,
+                            lrec, depth, etaH, etaV, zetaH, zetaV, lambd,
+                            ab_calc, xdirect, msrc, mrec, cache)[0]
+
+
+def wavenumber_pairs(zsrc, zrec, lsrc, lrec, depth, etaH, etaV, zetaH, zetaV,
+                     lambd, ab_calc, xdirect, msrc, mrec, cache=None):
+    r"""Calculate wavenumber domain solution for several depth pairs at once.
+
+    Same as :func:`wavenumber_multi`, but for arrays of source and receiver
+    depths `zsrc` and `zrec` (same size), where all sources are in layer
+    `lsrc` and all receivers in layer `lrec`. Gamma and the reflection
+    coefficients do not depend on the depths, and are therefore computed only
+    once for all pairs. Only the field propagators (receiver depth), the
+    fields (source depth), and the Green's functions (both) are computed for
+    each pair.
+
+    This function is called from :func:`empymod.transform.hankel_dlf` if
+    several depth pairs are required (e.g., the integration points of a
+    bipole, or receivers at several depths in the same layer).
+
+
+    Returns
+    -------
+    PJ : list
+        List with one entry for each pair `(zsrc[i], zrec[i])`, which is a
+        list of tuples `(PJ0, PJ1, PJ0b)`, one for each `ab` in `ab_calc`.
+
+    """
+    nfreq, nlayer = etaH.shape
+    noff, nlambda = lambd.shape
+
+    # Reciprocity switches for magnetic receivers
+    if mrec:
+        if msrc:  # If src is also magnetic, switch eta and zeta (MM => EE).
+            etaH, zetaH = -zetaH, -etaH
+            etaV, zetaV = -zetaV, -etaV
+        else:  # If src is electric, swap src and rec (ME => EM).
+            zsrc, zrec = zrec, zsrc
+            lsrc, lrec = lrec, lsrc
+
+    # ** AB- AND DEPTH-INDEPENDENT PARTS: GAMMA AND REFLECTIONS
+    # (Gamma is the same for TM and TE if isotropic and non-magnetic)
+    shared = _shared_gamma(etaH, etaV, zetaH, zetaV)
+    modes = {}
+    for TM in [True, False]:
+        if any(_mode_required(ab, TM) for ab in ab_calc):
+            if TM:
+                e_zH, e_zV, z_eH = etaH, etaV, zetaH
+            else:
+                e_zH, e_zV, z_eH = zetaH, zetaV, etaH
+            if nlayer > 1 and cache is not None:  # Incremental update
+                modes[TM] = cache.reflections(depth, e_zH, e_zV, z_eH, lambd,
+                                              lrec, lsrc, TM)
+                continue
+            if not TM and shared and True in modes:
+                Gam = modes[True][0]
+            else:
+                Gam = _gamma(e_zH, e_zV, z_eH, lambd)
+            if nlayer > 1:
+                Rp, Rm = reflections(depth, e_zH, Gam, lrec, lsrc)
+            else:
+                Rp = np.zeros_like(Gam)
+                Rm = np.zeros_like(Gam)
+            modes[TM] = (Gam, Rp, Rm)
+
+    PJ = []
+    for zs, zr in zip(zsrc, zrec):
+
+        # ** AB-INDEPENDENT PARTS OF THIS PAIR: PROPAGATORS
+        props = {TM: _propagators(depth, zr, lrec, Gam)
+                 for TM, (Gam, _, _) in modes.items()}
+
+        # ** AB-DEPENDENT PARTS: FIELDS, GREEN'S FUNCTIONS, AND COLLECTION
+        # The fields depend on `ab` only through the plus/minus switch.
+        pfields = {}
+        PJ.append([])
+        for ab in ab_calc:
+
+            GTM = np.zeros((nfreq, noff, nlambda), etaH.dtype)
+            GTE = np.zeros_like(GTM)
+            gamTM = np.zeros((nfreq, noff, 0, nlambda), etaH.dtype)
+            gamTE = np.zeros_like(gamTM)
+
+            for TM, (Gam, Rp, Rm) in modes.items():
+
+                # Continue if Green's function not required
+                if not _mode_required(ab, TM):
+                    continue
+
+                # Fields at rec level
+                key = (TM, _fields_plus(ab, TM))
+                if key not in pfields:
+                    pfields[key] = fields(depth, Rp, Rm, Gam, lrec, lsrc, zs,
+                                          ab, TM)
+                Pu, Pd = pfields[key]
+
+                # Green's function
+                Wu, Wd = props[TM]
+                green = _green(zs, zr, lsrc, lrec, depth, Gam, Rp, Rm, Wu, Wd,
+                               Pu, Pd, ab, xdirect, TM)
+
+                if TM:
+                    gamTM, GTM = Gam, green
+                else:
+                    gamTE, GTE = Gam, green
+
+            # AB-specific factors and collection of PJ0, PJ1, and PJ0b
+            PTM, PTE = _green_factors(GTM, GTE, gamTM, gamTE, etaH, etaV,
+                                      zetaH, zetaV, lsrc, lrec, ab)
+            PJ[-1].append(_collect(PTM, PTE, lambd, ab, mrec))
+
+    return PJ
+
+
+@nb.njit(**_numba_setting)
+def wavenumber_fused(zsrc, zrec, lsrc, lrec, depth, etaH, etaV, zetaH, zetaV,
+                     lambd, ab, xdirect, msrc, mrec):
+    r"""Calculate wavenumber domain solution, low-memory version.
+
+    Same as :func:`wavenumber`, but looping over each frequency-offset pair
+    and over blocks of at most 256 wavenumbers, writing `PJ0`, `PJ1`, and
+    `PJ0b` directly into the output arrays. The intermediate arrays (Gamma,
+    reflection coefficients, propagators, fields) have therefore at most the
+    size `(nlayer, 256)` of a single block, instead of `(nfreq, noff, nlayer,
+    nlambda)`. The peak memory scales with the output size, not with the
+    number of layers, also for a single row of many wavenumbers (unique or
+    pruned lambdas, see :func:`empymod.transform.hankel_dlf`).
+
+    It is usually slower than :func:`wavenumber`, and should be used if the
+    latter runs out of memory (many layers, frequencies, and offsets). It is
+    selected with ``htarg={'kernel': 'fused'}`` for the DLF.
+
+    """
+    PJ0, PJ1, PJ0b = _fused_alloc(etaH, lambd)
+    _fused_loop(zsrc, zrec, lsrc, lrec, depth, etaH, etaV, zetaH, zetaV,
+                lambd, ab, xdirect, msrc, mrec, PJ0, PJ1, PJ0b)
+    return _fused_select(PJ0, PJ1, PJ0b, ab)
+
+
+@nb.njit(**_numba_parallel)
+def _wavenumber_fused_parallel(zsrc, zrec, lsrc, lrec, depth, etaH, etaV,
+                               zetaH, zetaV, lambd, ab, xdirect, msrc, mrec):
+    r"""Multi-threaded version of :func:`wavenumber_fused`.
+
+    Loops in parallel (numba `prange`) over the frequency-offset-block points;
+    it is called from :func:`call_threaded`.
+
+    """
+    PJ0, PJ1, PJ0b = _fused_alloc(etaH, lambd)
+    _fused_loop_parallel(zsrc, zrec, lsrc, lrec, depth, etaH, etaV, zetaH,
+                         zetaV, lambd, ab, xdirect, msrc, mrec, PJ0, PJ1, PJ0b)
+    return _fused_select(PJ0, PJ1, PJ0b, ab)
+
+
+@nb.njit(**_numba_setting)
+def _fused_alloc(etaH, lambd):
+    r"""Pre-allocate the output of :func:`wavenumber_fused`."""
+    nfreq, _ = etaH.shape
+    noff, nlambda = lambd.shape
+    PJ0 = np.zeros((nfreq, noff, nlambda), etaH.dtype)
+    PJ1 = np.zeros_like(PJ0)
+    PJ0b = np.zeros_like(PJ0)
+    return PJ0, PJ1, PJ0b
+
+
+@nb.njit(**_numba_setting)
+def _fused_select(PJ0, PJ1, PJ0b, ab):
+    r"""Return only the ones required for this ab (as :func:`_collect`)."""
+    oPJ0 = PJ0 if ab in [11, 22, 24, 15, 33] else None
+    oPJ1 = PJ1 if ab not in [33, ] else None
+    oPJ0b = PJ0b if ab in [11, 12, 21, 22, 14, 24, 15, 25] else None
+    return oPJ0, oPJ1, oPJ0b
+
+
+@nb.njit(**_numba_setting)
+def _fused_npoints(PJ0):
+    r"""Return the number of frequency-offset-block points of the output."""
+    nfreq, noff, nlambda = PJ0.shape
+    return nfreq*noff*((nlambda + _fused_nlambda - 1)//_fused_nlambda)
+
+
+@nb.njit(**_numba_setting)
+def _fused_loop(zsrc, zrec, lsrc, lrec, depth, etaH, etaV, zetaH, zetaV,
+                lambd, ab, xdirect, msrc, mrec, PJ0, PJ1, PJ0b):
+    r"""Loop of :func:`wavenumber_fused` over all points."""
+    for k in range(_fused_npoints(PJ0)):
+        _fused_point(k, zsrc, zrec, lsrc, lrec, depth, etaH, etaV, zetaH,
+                     zetaV, lambd, ab, xdirect, msrc, mrec, PJ0, PJ1, PJ0b)
+
+
+@nb.njit(**_numba_parallel)
+def _fused_loop_parallel(zsrc, zrec, lsrc, lrec, depth, etaH, etaV, zetaH,
+                         zetaV, lambd, ab, xdirect, msrc, mrec, PJ0, PJ1,
+                         PJ0b):
+    r"""Parallel loop of :func:`_wavenumber_fused_parallel` over all points.
+
+    The points write into distinct parts of the output arrays.
+
+    """
+    for k in nb.prange(_fused_npoints(PJ0)):
+        _fused_point(k, zsrc, zrec, lsrc, lrec, depth, etaH, etaV, zetaH,
+                     zetaV, lambd, ab, xdirect, msrc, mrec, PJ0, PJ1, PJ0b)
+
+
+@nb.njit(**_numba_setting)
+def _fused_point(k, zsrc, zrec, lsrc, lrec, depth, etaH, etaV, zetaH, zetaV,
+                 lambd, ab, xdirect, msrc, mrec, PJ0, PJ1, PJ0b):
+    r"""Compute the k-th frequency-offset-block point of the fused kernel."""
+    nfreq, noff, nlambda = PJ0.shape
+    nblock = (nlambda + _fused_nlambda - 1)//_fused_nlambda
+
+    # Frequency, offset, and wavenumber-block of this point
+    i = k // (noff*nblock)
+    ii = (k // nblock) % noff
+    iv = (k % nblock)*_fused_nlambda
+    ev = min(iv + _fused_nlambda, nlambda)
+
+    tPJ0, tPJ1, tPJ0b = wavenumber(
+            zsrc, zrec, lsrc, lrec, depth, etaH[i:i+1, :], etaV[i:i+1, :],
+            zetaH[i:i+1, :], zetaV[i:i+1, :], lambd[ii:ii+1, iv:ev].copy(),
+            ab, xdirect, msrc, mrec)
+    if tPJ0 is not None:
+        PJ0[i, ii, iv:ev] = tPJ0[0, 0, :]
+    if tPJ1 is not None:
+        PJ1[i, ii, iv:ev] = tPJ1[0, 0, :]
+    if tPJ0b is not None:
+        PJ0b[i, ii, iv:ev] = tPJ0b[0, 0, :]
+
+
+def call_threaded(wavenumber_fct, *args):
+    r"""Call a wavenumber-domain kernel with the set number of threads.
+
+    If the number of threads (see :func:`set_num_threads`) is one, this simply
+    returns ``wavenumber_fct(*args)``. Else:
+
+    - :func:`wavenumber_fused` is replaced by its multi-threaded version,
+      which loops in parallel (numba `prange`) over the frequency-offset
+      pairs and wavenumber blocks.
+    - Any other kernel (:func:`wavenumber`, :func:`wavenumber_multi`,
+      :func:`wavenumber_pairs`) is called in a thread pool on chunks of the
+      wavenumbers; the numba functions release the GIL (`nogil`), so the
+      chunks run concurrently.
+
+    The arguments `args` are the ones of :func:`wavenumber`.
+
+    This function is called from :func:`empymod.transform.hankel_dlf`.
+
+    """
+    nthreads = get_num_threads()
+    lambd = args[9]
+
+    # Single thread, or not enough wavenumbers to share
+    if nthreads < 2 or lambd.shape[1] < 2*nthreads:
+        return wavenumber_fct(*args)
+
+    # Fused kernel: numba-parallel version
+    if wavenumber_fct is wavenumber_fused:
+        nb.set_num_threads(min(nthreads, nb.config.NUMBA_NUM_THREADS))
+        return _wavenumber_fused_parallel(*args)
+
+    def chunk(ilambd):
+        """Call the kernel for a chunk of the wavenumbers."""
+        tlambd = np.ascontiguousarray(lambd[:, ilambd])
+        return wavenumber_fct(*args[:9], tlambd, *args[10:])
+
+    # Carry out the chunks in a thread pool
+    chunks = np.array_split(np.arange(lambd.shape[1]), nthreads)
+    with ThreadPoolExecutor(max_workers=nthreads) as executor:
+        out = list(executor.map(chunk, chunks))
+
+    def concat(PJ):
+        """Concatenate the (PJ0, PJ1, PJ0b) of all chunks."""
+        # wavenumber_multi returns a list of (PJ0, PJ1, PJ0b), one for each
+        # ab; wavenumber_pairs a list of those, one for each depth pair.
+        if isinstance(PJ[0], list):
+            return [concat([o[i] for o in PJ]) for i in range(len(PJ[0]))]
+        return tuple(None if iPJ is None else
+                     np.concatenate([o[i] for o in PJ], axis=-1)
+                     for i, iPJ in enumerate(PJ[0]))
+
+    return concat(out)
+
+
+@nb.njit(**_numba_setting)
+def _collect(PTM, PTE, lambd, ab, mrec):
+    r"""Collect PJ0, PJ1, and PJ0b from the TM and TE Green's functions.
+
+    This function is called from the functions :func:`wavenumber` and
+    :func:`wavenumber_pairs`.
+
+    """
+    nfreq, noff, nlambda = PTM.shape
 
     # Pre-allocate output
     if ab in [11, 22, 24, 15, 33]:
@@ -212,12 +553,20 @@ def greenfct(zsrc, zrec, lsrc, lrec, depth, etaH, etaV, zetaH, zetaV, lambd,
             zsrc, zrec = zrec, zsrc
             lsrc, lrec = lrec, lsrc
 
+    # Pre-allocate; the Green's function of a mode which is not required stays
+    # zero, and its Gamma is not used.
+    GTM = np.zeros((nfreq, noff, nlambda), etaH.dtype)
+    GTE = np.zeros_like(GTM)
+    gamTM = np.zeros((nfreq, noff, 0, nlambda), etaH.dtype)
+    gamTE = np.zeros_like(gamTM)
+
+    # Gamma is the same for TM and TE if isotropic and non-magnetic
+    shared = _shared_gamma(etaH, etaV, zetaH, zetaV)
+
     for TM in [True, False]:
 
         # Continue if Green's function not required
-        if TM and ab in [16, 26]:
-            continue
-        elif not TM and ab in [13, 23, 31, 32, 33, 34, 35]:
+        if not _mode_required(ab, TM):
             continue
 
         # Define eta/zeta depending if TM or TE
@@ -226,217 +575,1047 @@ def greenfct(zsrc, zrec, lsrc, lrec, depth, etaH, etaV, zetaH, zetaV, lambd,
         else:
             e_zH, e_zV, z_eH = zetaH, zetaV, etaH  # TE: etaV not used
 
-        # Uppercase gamma
-        Gam = np.zeros((nfreq, noff, nlayer, nlambda), etaH.dtype)
+        # Gamma (re-use the one of TM if it is the same)
+        if not TM and shared and gamTM.shape[2] > 0:
+            Gam = gamTM
+        else:
+            Gam = _gamma(e_zH, e_zV, z_eH, lambd)
+
+        # Reflections and field propagators
+        Rp, Rm, Wu, Wd = _refl_prop(depth, zrec, lsrc, lrec, e_zH, Gam)
+
+        # Field at rec level (coming from below (Pu) and above (Pd) rec)
+        Pu, Pd = fields(depth, Rp, Rm, Gam, lrec, lsrc, zsrc, ab, TM)
+
+        # Green's function
+        green = _green(zsrc, zrec, lsrc, lrec, depth, Gam, Rp, Rm, Wu, Wd,
+                       Pu, Pd, ab, xdirect, TM)
+
+        # Store in corresponding variable
+        if TM:
+            gamTM, GTM = Gam, green
+        else:
+            gamTE, GTE = Gam, green
+
+    # ** AB-SPECIFIC FACTORS AND CALCULATION OF PTOT'S
+    return _green_factors(GTM, GTE, gamTM, gamTE, etaH, etaV, zetaH, zetaV,
+                          lsrc, lrec, ab)
+
+
+@nb.njit(**_numba_setting)
+def _mode_required(ab, TM):
+    r"""Return if the TM (or TE) Green's function is required for `ab`."""
+    if TM:
+        return ab not in [16, 26]
+    else:
+        return ab not in [13, 23, 31, 32, 33, 34, 35]
+
+
+@nb.njit(**_numba_setting)
+def _gamma(e_zH, e_zV, z_eH, lambd):
+    r"""Calculate Gamma of TM or TE.
+
+    This function is called from the functions :func:`greenfct` and
+    :func:`wavenumber_pairs`.
+
+    """
+    nfreq, nlayer = e_zH.shape
+    noff, nlambda = lambd.shape
+
+    # Uppercase gamma
+    Gam = np.zeros((nfreq, noff, nlayer, nlambda), e_zH.dtype)
+    for i in range(nfreq):
+        for ii in range(noff):
+            for iii in range(nlayer):
+                h_div_v = e_zH[i, iii]/e_zV[i, iii]
+                h_times_h = z_eH[i, iii]*e_zH[i, iii]
+                for iv in range(nlambda):
+                    l2 = lambd[ii, iv]*lambd[ii, iv]
+                    Gam[i, ii, iii, iv] = np.sqrt(h_div_v*l2 + h_times_h)
+
+    return Gam
+
+
+@nb.njit(**_numba_setting)
+def _shared_gamma(etaH, etaV, zetaH, zetaV):
+    r"""Return if Gamma is the same for TM and TE.
+
+    This is the case for isotropic layers (``etaH=etaV``) which are not
+    magnetically anisotropic (``zetaH=zetaV``): both are then
+    :math:`\sqrt{\lambda^2 + \eta\zeta}`.
+
+    """
+    nfreq, nlayer = etaH.shape
+    for i in range(nfreq):
+        for iii in range(nlayer):
+            if etaH[i, iii] != etaV[i, iii] or zetaH[i, iii] != zetaV[i, iii]:
+                return False
+    return True
+
+
+@nb.njit(**_numba_setting)
+def _refl_prop(depth, zrec, lsrc, lrec, e_zH, Gam):
+    r"""Calculate reflections and field propagators of TM or TE.
+
+    These are, together with Gamma, the parts of the Green's functions which
+    do not depend on `ab`. If there is only one layer, the reflections and
+    propagators are zero.
+
+    This function is called from the function :func:`greenfct`.
+
+    """
+    nfreq, noff, nlayer, nlambda = Gam.shape
+
+    # Reflection (coming from below (Rp) and above (Rm) rec)
+    if nlayer > 1:  # Only if more than 1 layer
+        Rp, Rm = reflections(depth, e_zH, Gam, lrec, lsrc)
+    else:
+        Rp = np.zeros_like(Gam)
+        Rm = np.zeros_like(Gam)
+
+    # Field propagators
+    Wu, Wd = _propagators(depth, zrec, lrec, Gam)
+
+    return Rp, Rm, Wu, Wd
+
+
+@nb.njit(**_numba_setting)
+def _propagators(depth, zrec, lrec, Gam):
+    r"""Calculate the field propagators of TM or TE.
+
+    Up- (Wu) and downgoing (Wd) field propagators in the receiver layer; they
+    are, unlike the reflections, depending on the receiver depth. If there is
+    only one layer, the propagators are zero.
+
+    This function is called from the functions :func:`_refl_prop` and
+    :func:`wavenumber_pairs`.
+
+    """
+    nfreq, noff, nlayer, nlambda = Gam.shape
+
+    # Gamma in receiver layer
+    lrecGam = Gam[:, :, lrec, :]
+
+    # Field propagators
+    # (Up- (Wu) and downgoing (Wd), in rec layer); Eq 74
+    Wu = np.zeros_like(lrecGam)
+    Wd = np.zeros_like(lrecGam)
+
+    if nlayer > 1:  # Only if more than 1 layer
+
+        if lrec != nlayer-1:  # No upgoing field prop. if rec in last
+            ddepth = depth[lrec + 1] - zrec
+            for i in range(nfreq):
+                for ii in range(noff):
+                    for iv in range(nlambda):
+                        Wu[i, ii, iv] = np.exp(-lrecGam[i, ii, iv]*ddepth)
+
+        if lrec != 0:     # No downgoing field propagator if rec in first
+            ddepth = zrec - depth[lrec]
+            for i in range(nfreq):
+                for ii in range(noff):
+                    for iv in range(nlambda):
+                        Wd[i, ii, iv] = np.exp(-lrecGam[i, ii, iv]*ddepth)
+
+    return Wu, Wd
+
+
+@nb.njit(**_numba_setting)
+def _green(zsrc, zrec, lsrc, lrec, depth, Gam, Rp, Rm, Wu, Wd, Pu, Pd, ab,
+           xdirect, TM):
+    r"""Calculate the Green's function of TM or TE for `ab`.
+
+    This function is called from the functions :func:`greenfct` and
+    :func:`wavenumber_pairs`.
+
+    """
+    nfreq, noff, nlayer, nlambda = Gam.shape
+
+    # Gamma in receiver layer
+    lrecGam = Gam[:, :, lrec, :]
+
+    # Green's function
+    green = np.zeros_like(lrecGam)
+    if lsrc == lrec:  # Rec in src layer; Eqs 108, 109, 110, 117, 118, 122
+
+        # Green's function depending on <ab>
+        # (If only one layer, no reflections/fields)
+        if nlayer > 1 and ab in [13, 23, 31, 32, 14, 24, 15, 25]:
+            for i in range(nfreq):
+                for ii in range(noff):
+                    for iv in range(nlambda):
+                        green[i, ii, iv] = Pu[i, ii, iv]*Wu[i, ii, iv]
+                        green[i, ii, iv] -= Pd[i, ii, iv]*Wd[i, ii, iv]
+
+        elif nlayer > 1:
+            for i in range(nfreq):
+                for ii in range(noff):
+                    for iv in range(nlambda):
+                        green[i, ii, iv] = Pu[i, ii, iv]*Wu[i, ii, iv]
+                        green[i, ii, iv] += Pd[i, ii, iv]*Wd[i, ii, iv]
+
+        # Direct field, if it is computed in the wavenumber domain
+        if not xdirect:
+            ddepth = abs(zsrc - zrec)
+
+            # Sign of the direct field, which depends only on <ab> and TM
+            # (hoisted out of the loops)
+            dsign = 1.0
+
+            # Swap TM for certain <ab>
+            if TM and ab in [11, 12, 13, 14, 15, 21, 22, 23, 24, 25]:
+                dsign *= -1
+
+            # Multiply by zrec-zsrc-sign for certain <ab>
+            if ab in [13, 14, 15, 23, 24, 25, 31, 32]:
+                dsign *= np.sign(zrec - zsrc)
+
+            for i in range(nfreq):
+                for ii in range(noff):
+                    for iv in range(nlambda):
+
+                        # Add direct field to Green's function
+                        green[i, ii, iv] += dsign*np.exp(
+                                -lrecGam[i, ii, iv]*ddepth)
+
+    else:
+
+        # Calculate exponential factor
+        if lrec == nlayer-1:
+            ddepth = 0
+        else:
+            ddepth = depth[lrec+1] - depth[lrec]
+
+        fexp = np.zeros_like(lrecGam)
         for i in range(nfreq):
             for ii in range(noff):
-                for iii in range(nlayer):
-                    h_div_v = e_zH[i, iii]/e_zV[i, iii]
-                    h_times_h = z_eH[i, iii]*e_zH[i, iii]
+                for iv in range(nlambda):
+                    fexp[i, ii, iv] = np.exp(-lrecGam[i, ii, iv]*ddepth)
+
+        # Sign-switch for Green calculation
+        if TM and ab in [11, 12, 13, 21, 22, 23, 14, 24, 15, 25]:
+            pmw = -1
+        else:
+            pmw = 1
+
+        if lrec < lsrc:  # Rec above src layer: Pd not used
+            #              Eqs 89-94, A18-A23, B13-B15
+            for i in range(nfreq):
+                for ii in range(noff):
                     for iv in range(nlambda):
-                        l2 = lambd[ii, iv]*lambd[ii, iv]
-                        Gam[i, ii, iii, iv] = np.sqrt(h_div_v*l2 + h_times_h)
+                        green[i, ii, iv] = Pu[i, ii, iv]*(
+                                Wu[i, ii, iv] + pmw*Rm[i, ii, 0, iv] *
+                                fexp[i, ii, iv]*Wd[i, ii, iv])
 
-        # Gamma in receiver layer
-        lrecGam = Gam[:, :, lrec, :]
+        elif lrec > lsrc:  # rec below src layer: Pu not used
+            #                Eqs 97-102 A26-A30, B16-B18
+            for i in range(nfreq):
+                for ii in range(noff):
+                    for iv in range(nlambda):
+                        green[i, ii, iv] = Pd[i, ii, iv]*(
+                                pmw*Wd[i, ii, iv] +
+                                Rp[i, ii, abs(lsrc-lrec), iv] *
+                                fexp[i, ii, iv]*Wu[i, ii, iv])
 
-        # Reflection (coming from below (Rp) and above (Rm) rec)
-        if nlayer > 1:  # Only if more than 1 layer
-            Rp, Rm = reflections(depth, e_zH, Gam, lrec, lsrc)
+    return green
 
-            # Field propagators
-            # (Up- (Wu) and downgoing (Wd), in rec layer); Eq 74
-            Wu = np.zeros_like(lrecGam)
-            Wd = np.zeros_like(lrecGam)
 
-            if lrec != nlayer-1:  # No upgoing field prop. if rec in last
-                ddepth = depth[lrec + 1] - zrec
-                for i in range(nfreq):
-                    for ii in range(noff):
-                        for iv in range(nlambda):
-                            Wu[i, ii, iv] = np.exp(-lrecGam[i, ii, iv]*ddepth)
+@nb.njit(**_numba_setting)
+def _green_factors(GTM, GTE, gamTM, gamTE, etaH, etaV, zetaH, zetaV, lsrc,
+                   lrec, ab):
+    r"""Apply the `ab`-specific factors to the Green's functions.
 
-            if lrec != 0:     # No downgoing field propagator if rec in first
-                ddepth = zrec - depth[lrec]
-                for i in range(nfreq):
-                    for ii in range(noff):
-                        for iv in range(nlambda):
-                            Wd[i, ii, iv] = np.exp(-lrecGam[i, ii, iv]*ddepth)
+    These are the factors inside the integrals, Eqs 105-107, 111-116, 119-121,
+    123-128 in [HuTS15]_.
+
+    This function is called from the functions :func:`greenfct` and
+    :func:`wavenumber_pairs`.
+
+    """
+    nfreq, noff, nlambda = GTM.shape
+
+    if ab in [11, 12, 21, 22]:
+        for i in range(nfreq):
+            for ii in range(noff):
+                for iv in range(nlambda):
+                    GTM[i, ii, iv] *= gamTM[i, ii, lrec, iv]/etaH[i, lrec]
+                    GTE[i, ii, iv] *= zetaH[i, lsrc]/gamTE[i, ii, lsrc, iv]
+
+    elif ab in [14, 15, 24, 25]:
+        for i in range(nfreq):
+            fact = etaH[i, lsrc]/etaH[i, lrec]
+            for ii in range(noff):
+                for iv in range(nlambda):
+                    GTM[i, ii, iv] *= fact*gamTM[i, ii, lrec, iv]
+                    GTM[i, ii, iv] /= gamTM[i, ii, lsrc, iv]
+
+    elif ab in [13, 23]:
+        for i in range(nfreq):
+            fact = etaH[i, lsrc]/etaH[i, lrec]/etaV[i, lsrc]
+            for ii in range(noff):
+                for iv in range(nlambda):
+                    GTM[i, ii, iv] *= -fact*gamTM[i, ii, lrec, iv]
+                    GTM[i, ii, iv] /= gamTM[i, ii, lsrc, iv]
+
+    elif ab in [31, 32]:
+        for i in range(nfreq):
+            for ii in range(noff):
+                for iv in range(nlambda):
+                    GTM[i, ii, iv] /= etaV[i, lrec]
+
+    elif ab in [34, 35]:
+        for i in range(nfreq):
+            fact = etaH[i, lsrc]/etaV[i, lrec]
+            for ii in range(noff):
+                for iv in range(nlambda):
+                    GTM[i, ii, iv] *= fact/gamTM[i, ii, lsrc, iv]
+
+    elif ab in [16, 26]:
+        for i in range(nfreq):
+            fact = zetaH[i, lsrc]/zetaV[i, lsrc]
+            for ii in range(noff):
+                for iv in range(nlambda):
+                    GTE[i, ii, iv] *= fact/gamTE[i, ii, lsrc, iv]
+
+    elif ab in [33, ]:
+        for i in range(nfreq):
+            fact = etaH[i, lsrc]/etaV[i, lsrc]/etaV[i, lrec]
+            for ii in range(noff):
+                for iv in range(nlambda):
+                    GTM[i, ii, iv] *= fact/gamTM[i, ii, lsrc, iv]
+
+    # Return Green's functions
+    return GTM, GTE
+
+
+@nb.njit(**_numba_with_fm)
+def reflections(depth, e_zH, Gam, lrec, lsrc):
+    r"""Calculate Rp, Rm.
+
+    .. math::
+        :label: reflections
+
+        R^\pm_n, \bar{R}^\pm_n
+
+    This function corresponds to equations 64/65 and A-11/A-12 in
+    [HuTS15]_, and loosely to the corresponding files `Rmin.F90` and
+    `Rplus.F90`.
+
+    This function is called from the function :func:`greenfct`.
+
+    """
+
+    # Get numbers and max/min layer.
+    nfreq, noff, nlayer, nlambda = Gam.shape
+    maxl = max([lrec, lsrc])
+    minl = min([lrec, lsrc])
+
+    # Loop over Rp, Rm
+    for plus in [True, False]:
+
+        # Switches depending if plus or minus
+        if plus:
+            pm = 1
+            layer_count = np.arange(nlayer-2, minl-1, -1)
+            izout = abs(lsrc-lrec)
+            minmax = pm*maxl
+        else:
+            pm = -1
+            layer_count = np.arange(1, maxl+1, 1)
+            izout = 0
+            minmax = pm*minl
+
+        # If rec in last  and rec below src (plus) or
+        # if rec in first and rec above src (minus), shift izout
+        shiftplus = lrec < lsrc and lrec == 0 and not plus
+        shiftminus = lrec > lsrc and lrec == nlayer-1 and plus
+        if shiftplus or shiftminus:
+            izout -= pm
+
+        # Pre-allocate Ref and rloc
+        Ref = np.zeros_like(Gam[:, :, :maxl-minl+1, :])
+        rloc = np.zeros_like(Gam[:, :, 0, :])
+
+        # Calculate the reflection
+        for iz in layer_count:
+
+            # Eqs 65, A-12
+            for i in range(nfreq):
+                ra = e_zH[i, iz+pm]
+                rb = e_zH[i, iz]
+                for ii in range(noff):
+                    for iv in range(nlambda):
+                        rloca = ra*Gam[i, ii, iz, iv]
+                        rlocb = rb*Gam[i, ii, iz+pm, iv]
+                        rloc[i, ii, iv] = (rloca - rlocb)/(rloca + rlocb)
+
+            # In first layer tRef = rloc
+            if iz == layer_count[0]:
+                tRef = rloc.copy()
+            else:
+                ddepth = depth[iz+1+pm]-depth[iz+pm]
+
+                # Eqs 64, A-11
+                for i in range(nfreq):
+                    for ii in range(noff):
+                        for iv in range(nlambda):
+                            term = tRef[i, ii, iv]*np.exp(
+                                    -2*Gam[i, ii, iz+pm, iv]*ddepth)
+                            tRef[i, ii, iv] = (rloc[i, ii, iv] + term)/(
+                                    1 + rloc[i, ii, iv]*term)
+
+            # The global reflection coefficient is given back for all layers
+            # between and including src- and rec-layer
+            if lrec != lsrc and pm*iz <= minmax:
+                Ref[:, :, izout, :] = tRef[:]
+                izout -= pm
+
+        # If lsrc = lrec, we just store the last values
+        if lsrc == lrec and layer_count.size > 0:
+            out = np.zeros_like(Ref[:, :, :1, :])
+            out[:, :, 0, :] = tRef
+        else:
+            out = Ref
+
+        # Store Ref in Rm/Rp
+        if plus:
+            Rp = out
+        else:
+            Rm = out
+
+    # Return reflections (minus and plus)
+    return Rp, Rm
+
+
+class ReflectionCache:
+    r"""Stateful cache for the incremental update of Gamma and reflections.
+
+    In time-lapse studies and in inversions with coordinate-wise updates only
+    a few layers change between successive calls. Gamma of each layer depends
+    only on the parameters of this layer. The reflection coefficients are
+    computed by a recursion from the bottom (Rp) and from the top (Rm) of the
+    model towards the source and receiver layers (:func:`reflections`); the
+    partial reflection coefficient after each step of the recursion depends
+    only on the layers below (Rp) or above (Rm) of it. This cache keeps Gamma
+    and the partial reflection coefficients of the previous call, and
+    recomputes only Gamma of the changed layers and the recursion from the
+    changed layers on towards the source and receiver layers.
+
+    Changed layers are detected by comparing `depth`, `e_zH`, `e_zV`, and
+    `z_eH` with the ones of the previous call with the same `key`, `lrec`,
+    `lsrc`, and wavenumbers. Each entry keeps Gamma and the partial
+    coefficients of Rp and Rm, hence three times the memory of Gamma.
+
+    It is used with the DLF through ``htarg={'cache': ReflectionCache()}``;
+    one cache instance should be used for one survey geometry and
+    frequencies, with changing layer parameters. The kernel is then run
+    single-threaded (see :func:`set_num_threads`).
+
+
+    Examples
+    --------
+
+    .. ipython::
+
+       In [1]: import empymod
+          ...: import numpy as np
+          ...: cache = empymod.kernel.ReflectionCache()
+          ...: inp = {'src': [0, 0, 100], 'rec': [1000, 0, 200],
+          ...:        'depth': np.arange(50)*20., 'freqtime': 1, 'verb': 1,
+          ...:        'htarg': {'cache': cache}}
+          ...: res = np.ones(51)
+          ...: EM1 = empymod.dipole(res=res, **inp)
+          ...: res[40] = 10  # Only the recursion from layer 40 up changes
+          ...: EM2 = empymod.dipole(res=res, **inp)
+          ...: cache.nsteps  # Recursion steps (TM, TE of 1st, 2nd call)
+       Out[1]: [55, 55, 36, 36]
+
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self.nsteps = []
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}: {len(self._entries)} entries; "
+                f"computed recursion steps: {self.nsteps}")
+
+    def reflections(self, depth, e_zH, e_zV, z_eH, lambd, lrec, lsrc,
+                    key=None):
+        r"""Return Gam, Rp, Rm, updated incrementally.
+
+        Parameters
+        ----------
+        depth, lrec, lsrc :
+            See :func:`reflections`; there must be more than one layer.
+
+        e_zH, e_zV, z_eH : ndarray
+            Eta and zeta of TM (``etaH, etaV, zetaH``) or TE (``zetaH, zetaV,
+            etaH``), of shape `(nfreq, nlayer)`.
+
+        lambd : ndarray
+            Wavenumbers, of shape `(noff, nlambda)`.
+
+        key : hashable, default: None
+            Distinguishes several entries of the same model, e.g., TM and TE.
+
+
+        Returns
+        -------
+        Gam : ndarray
+            Gamma, of shape `(nfreq, noff, nlayer, nlambda)`. It is the array
+            of the cache, which is updated by the next call of the same entry.
+
+        Rp, Rm : ndarray
+            Reflections, as returned by :func:`reflections`.
+
+        """
+        t0 = _profile_start()
+        nlayer = e_zH.shape[1]
+        lrec, lsrc = int(lrec), int(lsrc)
+        maxl = max(lrec, lsrc)
+        minl = min(lrec, lsrc)
+        layers = np.array([e_zH, e_zV, z_eH])
+
+        # First step of the recursion of Rp (going up) and Rm (going down)
+        ekey = (key, lrec, lsrc, layers.shape, layers.dtype.str, lambd.shape,
+                hash(lambd.tobytes()))
+        entry = self._entries.get(ekey)
+        if entry is None or np.any(entry[2] != lambd):
+            Gam = _gamma(e_zH, e_zV, z_eH, lambd)
+            Rpart = (np.zeros_like(Gam), np.zeros_like(Gam))
+            first = (nlayer-2, 1)
+        else:
+            Gam, Rpart = entry[3], entry[4]
+
+            # Changed layers and interfaces
+            lchange = np.nonzero(np.any(entry[1] != layers, axis=(0, 1)))[0]
+            dchange = np.nonzero(entry[0] != depth)[0]
+
+            # Gamma of changed layers
+            if lchange.size > 0:
+                Gam[:, :, lchange, :] = _gamma(
+                        e_zH[:, lchange], e_zV[:, lchange], z_eH[:, lchange],
+                        lambd)
+
+            # Step iz depends on the layers iz, iz+pm and the interfaces
+            # iz+pm, iz+1+pm (plus: pm=1, minus: pm=-1)
+            if lchange.size + dchange.size == 0:
+                first = (minl-1, maxl+1)  # Nothing changed
+            else:
+                lmax = max(np.r_[lchange, dchange-1].max(), -1)
+                lmin = min(np.r_[lchange, dchange].min(), nlayer)
+                first = (min(nlayer-2, lmax), max(1, lmin))
+
+        # Carry out the required steps of Rp and Rm
+        nsteps = 0
+        for i, plus, last in [(0, True, minl), (1, False, maxl)]:
+            nsteps += max(0, (first[i] - last)*(1 if plus else -1) + 1)
+            _reflections_steps(depth, e_zH, Gam, Rpart[i], plus, first[i],
+                               last)
+        self.nsteps.append(int(nsteps))
+
+        # Store this state
+        self._entries[ekey] = (depth.copy(), layers, lambd.copy(), Gam, Rpart)
+
+        # Return the reflections in the format of :func:`reflections`
+        Rp = _reflections_assemble(Rpart[0], lrec, lsrc, True)
+        Rm = _reflections_assemble(Rpart[1], lrec, lsrc, False)
+        _profile_stop('reflections', t0)
+        return Gam, Rp, Rm
+
+
+@nb.njit(**_numba_with_fm)
+def _reflections_steps(depth, e_zH, Gam, Rpart, plus, first, last):
+    r"""Carry out the steps `first` to `last` of the reflection recursion.
+
+    `Rpart[:, :, iz, :]` is the partial reflection coefficient after step
+    `iz` (Rp if `plus`, else Rm); the recursion continues from the one of the
+    previous step (Eqs 64, 65, A-11, A-12; see :func:`reflections`).
+
+    This function is called from :class:`ReflectionCache`.
+
+    """
+    nfreq, noff, nlayer, nlambda = Gam.shape
+    if plus:
+        pm = 1
+        start = nlayer-2
+    else:
+        pm = -1
+        start = 1
+
+    for iz in range(first, last-pm, -pm):
+        for i in range(nfreq):
+            ra = e_zH[i, iz+pm]
+            rb = e_zH[i, iz]
+            if iz != start:
+                ddepth = depth[iz+1+pm]-depth[iz+pm]
+            for ii in range(noff):
+                for iv in range(nlambda):
+                    rloca = ra*Gam[i, ii, iz, iv]
+                    rlocb = rb*Gam[i, ii, iz+pm, iv]
+                    rloc = (rloca - rlocb)/(rloca + rlocb)
+                    if iz == start:
+                        Rpart[i, ii, iz, iv] = rloc
+                    else:
+                        term = Rpart[i, ii, iz+pm, iv]*np.exp(
+                                -2*Gam[i, ii, iz+pm, iv]*ddepth)
+                        Rpart[i, ii, iz, iv] = (rloc + term)/(1 + rloc*term)
+
+
+@nb.njit(**_numba_setting)
+def _reflections_assemble(Rpart, lrec, lsrc, plus):
+    r"""Collect Rp or Rm of :func:`reflections` from the partial ones.
+
+    This function is called from :class:`ReflectionCache`.
+
+    """
+    nfreq, noff, nlayer, nlambda = Rpart.shape
+    maxl = max([lrec, lsrc])
+    minl = min([lrec, lsrc])
+
+    # Same bookkeeping as in :func:`reflections`
+    if plus:
+        pm = 1
+        layer_count = np.arange(nlayer-2, minl-1, -1)
+        izout = abs(lsrc-lrec)
+        minmax = pm*maxl
+    else:
+        pm = -1
+        layer_count = np.arange(1, maxl+1, 1)
+        izout = 0
+        minmax = pm*minl
+    shiftplus = lrec < lsrc and lrec == 0 and not plus
+    shiftminus = lrec > lsrc and lrec == nlayer-1 and plus
+    if shiftplus or shiftminus:
+        izout -= pm
+
+    Ref = np.zeros((nfreq, noff, maxl-minl+1, nlambda), Rpart.dtype)
+    for iz in layer_count:
+        if lrec != lsrc and pm*iz <= minmax:
+            Ref[:, :, izout, :] = Rpart[:, :, iz, :]
+            izout -= pm
+
+    # If lsrc = lrec, only the last values
+    if lsrc == lrec and layer_count.size > 0:
+        Ref[:, :, 0, :] = Rpart[:, :, layer_count[-1], :]
+
+    return Ref
+
+
+@nb.njit(**_numba_setting)
+def fields(depth, Rp, Rm, Gam, lrec, lsrc, zsrc, ab, TM):
+    r"""Calculate Pu+, Pu-, Pd+, Pd-.
+
+    .. math::
+        :label: fields
+
+        P^{u\pm}_s, P^{d\pm}_s, \bar{P}^{u\pm}_s, \bar{P}^{d\pm}_s;
+        P^{u\pm}_{s-1}, P^{u\pm}_n, \bar{P}^{u\pm}_{s-1}, \bar{P}^{u\pm}_n;
+        P^{d\pm}_{s+1}, P^{d\pm}_n, \bar{P}^{d\pm}_{s+1}, \bar{P}^{d\pm}_n
+
+    This function corresponds to equations 81/82, 95/96, 103/104, A-8/A-9,
+    A-24/A-25, and A-32/A-33 in [HuTS15]_, and loosely to the corresponding
+    files `Pdownmin.F90`, `Pdownplus.F90`, `Pupmin.F90`, and `Pdownmin.F90`.
+
+    This function is called from the function :func:`greenfct`.
+
+    """
+
+    nfreq, noff, nlayer, nlambda = Gam.shape
+
+    # Variables
+    nlsr = abs(lsrc-lrec)+1  # nr of layers btw and incl. src and rec layer
+    rsrcl = 0  # src-layer in reflection (Rp/Rm), first if down
+    izrange = range(2, nlsr)
+    isr = lsrc
+    last = nlayer-1
+
+    # Booleans if src in first or last layer; swapped if up=True
+    first_layer = lsrc == 0
+    last_layer = lsrc == nlayer-1
+
+    # Depths; dp and dm are swapped if up=True
+    if lsrc != nlayer-1:
+        ds = depth[lsrc+1]-depth[lsrc]
+        dp = depth[lsrc+1]-zsrc
+    dm = zsrc-depth[lsrc]
+
+    # Rm and Rp; swapped if up=True
+    Rmp = Rm
+    Rpm = Rp
+
+    # Boolean if plus or minus has to be calculated
+    plus = _fields_plus(ab, TM)
+
+    # Sign-switches
+    pm = 1     # + if plus=True, - if plus=False
+    if not plus:
+        pm = -1
+    pup = -1   # + if up=True,   - if up=False
+    mupm = 1   # + except if up=True and plus=False
+
+    # Gamma of source layer
+    iGam = Gam[:, :, lsrc, :]
+
+    # Calculate down- and up-going fields
+    for up in [False, True]:
+
+        # No upgoing field if rec is in last layer or below src
+        if up and (lrec == nlayer-1 or lrec > lsrc):
+            Pu = np.zeros_like(iGam)
+            continue
+        # No downgoing field if rec is in first layer or above src
+        if not up and (lrec == 0 or lrec < lsrc):
+            Pd = np.zeros_like(iGam)
+            continue
+
+        # Swaps if up=True
+        if up:
+            if not last_layer:
+                dp, dm = dm, dp
+            else:
+                dp = dm
+            Rmp, Rpm = Rpm, Rmp
+            first_layer, last_layer = last_layer, first_layer
+            rsrcl = nlsr-1  # src-layer in refl. (Rp/Rm), last (nlsr-1) if up
+            izrange = range(nlsr-2)
+            isr = lrec
+            last = 0
+            pup = 1
+            if not plus:
+                mupm = -1
+
+        P = np.zeros_like(iGam)
+
+        # Calculate Pu+, Pu-, Pd+, Pd-
+        if lsrc == lrec:  # rec in src layer; Eqs  81/82, A-8/A-9
+            if last_layer:  # If src/rec are in top (up) or bottom (down) layer
+                for i in range(nfreq):
+                    for ii in range(noff):
+                        for iv in range(nlambda):
+                            tRmp = Rmp[i, ii, 0, iv]
+                            tiGam = iGam[i, ii, iv]
+                            P[i, ii, iv] = tRmp*np.exp(-tiGam*dm)
+
+            else:           # If src and rec are in any layer in between
+                for i in range(nfreq):
+                    for ii in range(noff):
+                        for iv in range(nlambda):
+                            tiGam = iGam[i, ii, iv]
+                            tRpm = Rpm[i, ii, 0, iv]
+                            tRmp = Rmp[i, ii, 0, iv]
+                            p1 = np.exp(-tiGam*dm)
+                            p2 = pm*tRpm*np.exp(-tiGam*(ds+dp))
+                            p3 = 1 - tRmp * tRpm * np.exp(-2*tiGam*ds)
+                            P[i, ii, iv] = (p1 + p2) * tRmp/p3
+
+        else:           # rec above (up) / below (down) src layer
+            #           # Eqs  95/96,  A-24/A-25 for rec above src layer
+            #           # Eqs 103/104, A-32/A-33 for rec below src layer
+
+            # First compute P_{s-1} (up) / P_{s+1} (down)
+            iRpm = Rpm[:, :, rsrcl, :]
+            if first_layer:  # If src is in bottom (up) / top (down) layer
+                for i in range(nfreq):
+                    for ii in range(noff):
+                        for iv in range(nlambda):
+                            tiRpm = iRpm[i, ii, iv]
+                            tiGam = iGam[i, ii, iv]
+                            P[i, ii, iv] = (1 + tiRpm)*mupm*np.exp(-tiGam*dp)
+            else:
+                for i in range(nfreq):
+                    for ii in range(noff):
+                        for iv in range(nlambda):
+                            iRmp = Rmp[i, ii, rsrcl, iv]
+                            tiGam = iGam[i, ii, iv]
+                            tRpm = iRpm[i, ii, iv]
+                            p1 = mupm*np.exp(-tiGam*dp)
+                            p2 = pm*mupm*iRmp*np.exp(-tiGam * (ds+dm))
+                            p3 = (1 + tRpm)/(1 - iRmp*tRpm*np.exp(-2*tiGam*ds))
+                            P[i, ii, iv] = (p1 + p2) * p3
+
+            # If up or down and src is in last but one layer
+            if up or (not up and lsrc+1 < nlayer-1):
+                ddepth = depth[lsrc+1-1*pup]-depth[lsrc-1*pup]
+                if np.isfinite(ddepth):
+                    for i in range(nfreq):
+                        for ii in range(noff):
+                            for iv in range(nlambda):
+                                tiRpm = Rpm[i, ii, rsrcl-1*pup, iv]
+                                tiGam = Gam[i, ii, lsrc-1*pup, iv]
+                                fact = tiRpm*np.exp(-2*tiGam*ddepth)
+                                P[i, ii, iv] /= 1 + fact
+
+            # Second compute P for all other layers
+            if nlsr > 2:
+                for iz in izrange:
+                    ddepth = depth[isr+iz+pup+1]-depth[isr+iz+pup]
+                    for i in range(nfreq):
+                        for ii in range(noff):
+                            for iv in range(nlambda):
+                                tiRpm = Rpm[i, ii, iz+pup, iv]
+                                piGam = Gam[i, ii, isr+iz+pup, iv]
+                                p1 = (1+tiRpm)*np.exp(-piGam*ddepth)
+                                P[i, ii, iv] *= p1
+
+                    # If rec/src NOT in first/last layer (up/down)
+                    if isr+iz != last:
+                        ddepth = depth[isr+iz+1] - depth[isr+iz]
+                        for i in range(nfreq):
+                            for ii in range(noff):
+                                for iv in range(nlambda):
+                                    tiRpm = Rpm[i, ii, iz, iv]
+                                    piGam2 = Gam[i, ii, isr+iz, iv]
+                                    p1 = 1 + tiRpm*np.exp(-2*piGam2 * ddepth)
+                                    P[i, ii, iv] /= p1
+
+        # Store P in Pu/Pd
+        if up:
+            Pu = P
+        else:
+            Pd = P
+
+    # Return fields (up- and downgoing)
+    return Pu, Pd
+
+
+@nb.njit(**_numba_setting)
+def _fields_plus(ab, TM):
+    r"""Return if the plus (True) or minus (False) fields are required."""
+    plusset = [13, 23, 33, 14, 24, 34, 15, 25, 35]
+    if TM:
+        return ab in plusset
+    else:
+        return ab not in plusset
+
+
+# Jacobian of the wavenumber-frequency domain kernel
+
+def wavenumber_jacobian(zsrc, zrec, lsrc, lrec, depth, etaH, etaV, zetaH,
+                        zetaV, detaH, detaV, dzetaH, dzetaV, lambd, ab,
+                        xdirect, msrc, mrec):
+    r"""Calculate wavenumber domain solution and its derivatives.
+
+    Same as :func:`wavenumber`, but returns additionally the derivatives of
+    `PJ0`, `PJ1`, and `PJ0b` with respect to a parameter of each layer and
+    with respect to the depths of the layer interfaces. The derivatives are
+    computed analytically in the same pass (forward mode) by differentiating
+    Gamma, the reflection recursion (Eqs 64/65 in [HuTS15]_), the field
+    propagators, and the `ab`-specific factors.
+
+    The layer parameter is implicitly defined by `detaH`, `detaV`, `dzetaH`,
+    and `dzetaV`, which are the derivatives of `etaH`, `etaV`, `zetaH`, and
+    `zetaV` of each layer with respect to the parameter of this layer; e.g.,
+    ``detaH = -1/res**2`` and ``detaV = -1/(res*aniso)**2`` for the horizontal
+    resistivities (with fixed anisotropies). They have the same shape as
+    `etaH`.
+
+    The layer numbers `lsrc` and `lrec` are fixed, hence the derivatives with
+    respect to the interfaces assume that no interface is moved across the
+    source or receiver.
+
+    This function is called from :func:`empymod.model.dipole_jacobian`.
+
+
+    Returns
+    -------
+    PJ0, PJ1, PJ0b : array or None
+        Shape ``(1+nlayer+nlayer-1, nfreq, noff, nlambda)``: the first entry is
+        the response as returned by :func:`wavenumber`, followed by the
+        derivatives with respect to the parameter of each layer, and the
+        derivatives with respect to the interfaces ``depth[1:]``.
+
+    """
+    nfreq, nlayer = etaH.shape
+    noff, nlambda = lambd.shape
+    npar = 2*nlayer-1
+
+    # Reciprocity switches for magnetic receivers
+    if mrec:
+        if msrc:  # If src is also magnetic, switch eta and zeta (MM => EE).
+            etaH, zetaH = -zetaH, -etaH
+            etaV, zetaV = -zetaV, -etaV
+            detaH, dzetaH = -dzetaH, -detaH
+            detaV, dzetaV = -dzetaV, -detaV
+        else:  # If src is electric, swap src and rec (ME => EM).
+            zsrc, zrec = zrec, zsrc
+            lsrc, lrec = lrec, lsrc
 
-            # Field at rec level (coming from below (Pu) and above (Pd) rec)
-            Pu, Pd = fields(depth, Rp, Rm, Gam, lrec, lsrc, zsrc, ab, TM)
+    # Pre-allocate (see greenfct)
+    GTM = np.zeros((nfreq, noff, nlambda), etaH.dtype)
+    GTE = np.zeros_like(GTM)
+    dGTM = np.zeros((nfreq, noff, nlambda, npar), etaH.dtype)
+    dGTE = np.zeros_like(dGTM)
+    gamTM = np.zeros((nfreq, noff, 0, nlambda), etaH.dtype)
+    gamTE = np.zeros_like(gamTM)
+    dgamTM = np.zeros_like(gamTM)
+    dgamTE = np.zeros_like(gamTM)
 
-        # Green's functions
-        green = np.zeros_like(lrecGam)
-        if lsrc == lrec:  # Rec in src layer; Eqs 108, 109, 110, 117, 118, 122
+    for TM in [True, False]:
 
-            # Green's function depending on <ab>
-            # (If only one layer, no reflections/fields)
-            if nlayer > 1 and ab in [13, 23, 31, 32, 14, 24, 15, 25]:
-                for i in range(nfreq):
-                    for ii in range(noff):
-                        for iv in range(nlambda):
-                            green[i, ii, iv] = Pu[i, ii, iv]*Wu[i, ii, iv]
-                            green[i, ii, iv] -= Pd[i, ii, iv]*Wd[i, ii, iv]
+        # Continue if Green's function not required
+        if not _mode_required(ab, TM):
+            continue
 
-            elif nlayer > 1:
-                for i in range(nfreq):
-                    for ii in range(noff):
-                        for iv in range(nlambda):
-                            green[i, ii, iv] = Pu[i, ii, iv]*Wu[i, ii, iv]
-                            green[i, ii, iv] += Pd[i, ii, iv]*Wd[i, ii, iv]
+        # Define eta/zeta depending if TM or TE
+        if TM:
+            e_zH, e_zV, z_eH = etaH, etaV, zetaH
+            de_zH, de_zV, dz_eH = detaH, detaV, dzetaH
+        else:
+            e_zH, e_zV, z_eH = zetaH, zetaV, etaH
+            de_zH, de_zV, dz_eH = dzetaH, dzetaV, detaH
+
+        # Gamma, reflections, propagators, fields, and Green's function
+        Gam, dGam = _gamma_jac(e_zH, e_zV, z_eH, de_zH, de_zV, dz_eH, lambd)
+        out = _refl_prop_jac(depth, zrec, lsrc, lrec, e_zH, Gam, de_zH, dGam)
+        Rp, Rm, Wu, Wd, dRp, dRm, dWu, dWd = out
+        Pu, Pd, dPu, dPd = _fields_jac(depth, Rp, Rm, Gam, dRp, dRm, dGam,
+                                       lrec, lsrc, zsrc, ab, TM)
+        green, dgreen = _green_jac(zsrc, zrec, lsrc, lrec, depth, Gam, dGam,
+                                   Rp, Rm, dRp, dRm, Wu, Wd, dWu, dWd, Pu, Pd,
+                                   dPu, dPd, ab, xdirect, TM)
 
-            # Direct field, if it is computed in the wavenumber domain
-            if not xdirect:
-                ddepth = abs(zsrc - zrec)
-                dsign = np.sign(zrec - zsrc)
-                minus_ab = [11, 12, 13, 14, 15, 21, 22, 23, 24, 25]
+        # Store in corresponding variable
+        if TM:
+            gamTM, dgamTM, GTM, dGTM = Gam, dGam, green, dgreen
+        else:
+            gamTE, dgamTE, GTE, dGTE = Gam, dGam, green, dgreen
 
-                for i in range(nfreq):
-                    for ii in range(noff):
-                        for iv in range(nlambda):
+    # AB-specific factors
+    _green_factors_jac(GTM, GTE, dGTM, dGTE, gamTM, gamTE, dgamTM, dgamTE,
+                       etaH, etaV, zetaH, zetaV, detaH, detaV, dzetaH, dzetaV,
+                       lsrc, lrec, ab)
 
-                            # Direct field
-                            directf = np.exp(-lrecGam[i, ii, iv]*ddepth)
+    # Collection of PJ0, PJ1, and PJ0b; response and derivatives are stacked
+    # along the frequency axis, as the collection is linear.
+    # (The derivatives have the parameters as last dimension in the kernel.)
+    PTM = np.concatenate((GTM[None], np.moveaxis(dGTM, -1, 0)))
+    PTE = np.concatenate((GTE[None], np.moveaxis(dGTE, -1, 0)))
+    PJ = _collect(PTM.reshape((-1, noff, nlambda)),
+                  PTE.reshape((-1, noff, nlambda)), lambd, ab, mrec)
 
-                            # Swap TM for certain <ab>
-                            if TM and ab in minus_ab:
-                                directf *= -1
+    return tuple(None if iPJ is None else
+                 iPJ.reshape((npar+1, nfreq, noff, nlambda)) for iPJ in PJ)
 
-                            # Multiply by zrec-zsrc-sign for certain <ab>
-                            if ab in [13, 14, 15, 23, 24, 25, 31, 32]:
-                                directf *= dsign
 
-                            # Add direct field to Green's function
-                            green[i, ii, iv] += directf
+@nb.njit(**_numba_setting)
+def _ddepth_jac(nlayer, iplus, iminus):
+    r"""Derivative of `depth[iplus]-depth[iminus]` w.r.t. the parameters.
 
-        else:
+    The parameters are the `nlayer` layer parameters followed by the
+    interfaces `depth[1:]`. Indices smaller than one (-inf or, with -1,
+    a source or receiver depth) are not parameters.
 
-            # Calculate exponential factor
-            if lrec == nlayer-1:
-                ddepth = 0
-            else:
-                ddepth = depth[lrec+1] - depth[lrec]
+    """
+    dd = np.zeros(2*nlayer-1)
+    if iplus > 0:
+        dd[nlayer-1+iplus] += 1.0
+    if iminus > 0:
+        dd[nlayer-1+iminus] -= 1.0
+    return dd
 
-            fexp = np.zeros_like(lrecGam)
-            for i in range(nfreq):
-                for ii in range(noff):
-                    for iv in range(nlambda):
-                        fexp[i, ii, iv] = np.exp(-lrecGam[i, ii, iv]*ddepth)
 
-            # Sign-switch for Green calculation
-            if TM and ab in [11, 12, 13, 21, 22, 23, 14, 24, 15, 25]:
-                pmw = -1
-            else:
-                pmw = 1
+@nb.njit(**_numba_setting)
+def _exp_dist(fexp, dist):
+    r"""Return `fexp*dist`, which is zero for `fexp=0` (also if `dist=inf`)."""
+    if fexp == 0:
+        return 0*fexp
+    return fexp*dist
 
-            if lrec < lsrc:  # Rec above src layer: Pd not used
-                #              Eqs 89-94, A18-A23, B13-B15
-                for i in range(nfreq):
-                    for ii in range(noff):
-                        for iv in range(nlambda):
-                            green[i, ii, iv] = Pu[i, ii, iv]*(
-                                    Wu[i, ii, iv] + pmw*Rm[i, ii, 0, iv] *
-                                    fexp[i, ii, iv]*Wd[i, ii, iv])
 
-            elif lrec > lsrc:  # rec below src layer: Pu not used
-                #                Eqs 97-102 A26-A30, B16-B18
-                for i in range(nfreq):
-                    for ii in range(noff):
-                        for iv in range(nlambda):
-                            green[i, ii, iv] = Pd[i, ii, iv]*(
-                                    pmw*Wd[i, ii, iv] +
-                                    Rp[i, ii, abs(lsrc-lrec), iv] *
-                                    fexp[i, ii, iv]*Wu[i, ii, iv])
+@nb.njit(**_numba_setting)
+def _gamma_jac(e_zH, e_zV, z_eH, de_zH, de_zV, dz_eH, lambd):
+    r"""Calculate Gamma of TM or TE and its derivative.
 
-        # Store in corresponding variable
-        if TM:
-            gamTM, GTM = Gam, green
-        else:
-            gamTE, GTE = Gam, green
+    The derivative of the Gamma of each layer is w.r.t. the parameter of this
+    layer.
 
-    # ** AB-SPECIFIC FACTORS AND CALCULATION OF PTOT'S
-    # These are the factors inside the integrals
-    # Eqs 105-107, 111-116, 119-121, 123-128
+    """
+    nfreq, nlayer = e_zH.shape
+    noff, nlambda = lambd.shape
 
-    if ab in [11, 12, 21, 22]:
-        for i in range(nfreq):
-            for ii in range(noff):
+    Gam = np.zeros((nfreq, noff, nlayer, nlambda), e_zH.dtype)
+    dGam = np.zeros_like(Gam)
+    for i in range(nfreq):
+        for ii in range(noff):
+            for iii in range(nlayer):
+                h_div_v = e_zH[i, iii]/e_zV[i, iii]
+                dh_div_v = (de_zH[i, iii] - h_div_v*de_zV[i, iii])/e_zV[i, iii]
+                h_times_h = z_eH[i, iii]*e_zH[i, iii]
+                dh_times_h = dz_eH[i, iii]*e_zH[i, iii]
+                dh_times_h += z_eH[i, iii]*de_zH[i, iii]
                 for iv in range(nlambda):
-                    GTM[i, ii, iv] *= gamTM[i, ii, lrec, iv]/etaH[i, lrec]
-                    GTE[i, ii, iv] *= zetaH[i, lsrc]/gamTE[i, ii, lsrc, iv]
+                    l2 = lambd[ii, iv]*lambd[ii, iv]
+                    tGam = np.sqrt(h_div_v*l2 + h_times_h)
+                    Gam[i, ii, iii, iv] = tGam
+                    dGam[i, ii, iii, iv] = (dh_div_v*l2 + dh_times_h)/(2*tGam)
 
-    elif ab in [14, 15, 24, 25]:
-        for i in range(nfreq):
-            fact = etaH[i, lsrc]/etaH[i, lrec]
-            for ii in range(noff):
-                for iv in range(nlambda):
-                    GTM[i, ii, iv] *= fact*gamTM[i, ii, lrec, iv]
-                    GTM[i, ii, iv] /= gamTM[i, ii, lsrc, iv]
+    return Gam, dGam
 
-    elif ab in [13, 23]:
-        GTE = np.zeros_like(GTM)
-        for i in range(nfreq):
-            fact = etaH[i, lsrc]/etaH[i, lrec]/etaV[i, lsrc]
-            for ii in range(noff):
-                for iv in range(nlambda):
-                    GTM[i, ii, iv] *= -fact*gamTM[i, ii, lrec, iv]
-                    GTM[i, ii, iv] /= gamTM[i, ii, lsrc, iv]
 
-    elif ab in [31, 32]:
-        GTE = np.zeros_like(GTM)
-        for i in range(nfreq):
-            for ii in range(noff):
-                for iv in range(nlambda):
-                    GTM[i, ii, iv] /= etaV[i, lrec]
+@nb.njit(**_numba_setting)
+def _refl_prop_jac(depth, zrec, lsrc, lrec, e_zH, Gam, de_zH, dGam):
+    r"""Calculate reflections and field propagators and their derivatives."""
+    nfreq, noff, nlayer, nlambda = Gam.shape
+    npar = 2*nlayer-1
 
-    elif ab in [34, 35]:
-        GTE = np.zeros_like(GTM)
-        for i in range(nfreq):
-            fact = etaH[i, lsrc]/etaV[i, lrec]
-            for ii in range(noff):
-                for iv in range(nlambda):
-                    GTM[i, ii, iv] *= fact/gamTM[i, ii, lsrc, iv]
+    # Field propagators; Eq 74
+    Wu = np.zeros((nfreq, noff, nlambda), Gam.dtype)
+    Wd = np.zeros_like(Wu)
+    dWu = np.zeros((nfreq, noff, nlambda, npar), Gam.dtype)
+    dWd = np.zeros_like(dWu)
 
-    elif ab in [16, 26]:
-        GTM = np.zeros_like(GTE)
-        for i in range(nfreq):
-            fact = zetaH[i, lsrc]/zetaV[i, lsrc]
-            for ii in range(noff):
-                for iv in range(nlambda):
-                    GTE[i, ii, iv] *= fact/gamTE[i, ii, lsrc, iv]
+    # Reflection (coming from below (Rp) and above (Rm) rec)
+    if nlayer > 1:  # Only if more than 1 layer
+        Rp, Rm, dRp, dRm = _reflections_jac(depth, e_zH, Gam, de_zH, dGam,
+                                            lrec, lsrc)
 
-    elif ab in [33, ]:
-        GTE = np.zeros_like(GTM)
-        for i in range(nfreq):
-            fact = etaH[i, lsrc]/etaV[i, lsrc]/etaV[i, lrec]
-            for ii in range(noff):
-                for iv in range(nlambda):
-                    GTM[i, ii, iv] *= fact/gamTM[i, ii, lsrc, iv]
+        if lrec != nlayer-1:  # No upgoing field prop. if rec in last
+            Wu, dWu = _propagator_jac(Gam, dGam, lrec, depth[lrec+1]-zrec,
+                                      _ddepth_jac(nlayer, lrec+1, -1))
 
-    # Return Green's functions
-    return GTM, GTE
+        if lrec != 0:     # No downgoing field propagator if rec in first
+            Wd, dWd = _propagator_jac(Gam, dGam, lrec, zrec-depth[lrec],
+                                      _ddepth_jac(nlayer, -1, lrec))
 
+    else:
+        Rp = np.zeros_like(Gam)
+        Rm = np.zeros_like(Gam)
+        dRp = np.zeros((nfreq, noff, nlayer, nlambda, npar), Gam.dtype)
+        dRm = np.zeros_like(dRp)
 
-@nb.njit(**_numba_with_fm)
-def reflections(depth, e_zH, Gam, lrec, lsrc):
-    r"""Calculate Rp, Rm.
+    return Rp, Rm, Wu, Wd, dRp, dRm, dWu, dWd
 
-    .. math::
-        :label: reflections
 
-        R^\pm_n, \bar{R}^\pm_n
+@nb.njit(**_numba_setting)
+def _propagator_jac(Gam, dGam, lrec, ddepth, dd):
+    r"""Calculate a field propagator (Wu or Wd) and its derivatives."""
+    nfreq, noff, nlayer, nlambda = Gam.shape
+    npar = dd.size
 
-    This function corresponds to equations 64/65 and A-11/A-12 in
-    [HuTS15]_, and loosely to the corresponding files `Rmin.F90` and
-    `Rplus.F90`.
+    W = np.zeros((nfreq, noff, nlambda), Gam.dtype)
+    dW = np.zeros((nfreq, noff, nlambda, npar), Gam.dtype)
+    for i in range(nfreq):
+        for ii in range(noff):
+            for iv in range(nlambda):
+                tGam = Gam[i, ii, lrec, iv]
+                fexp = np.exp(-tGam*ddepth)
+                W[i, ii, iv] = fexp
+                for p in range(npar):
+                    dW[i, ii, iv, p] = -fexp*tGam*dd[p]
+                dW[i, ii, iv, lrec] -= fexp*ddepth*dGam[i, ii, lrec, iv]
 
-    This function is called from the function :func:`greenfct`.
+    return W, dW
 
-    """
+
+@nb.njit(**_numba_with_fm)
+def _reflections_jac(depth, e_zH, Gam, de_zH, dGam, lrec, lsrc):
+    r"""Calculate Rp, Rm and their derivatives; see :func:`reflections`."""
 
     # Get numbers and max/min layer.
     nfreq, noff, nlayer, nlambda = Gam.shape
+    npar = 2*nlayer-1
     maxl = max([lrec, lsrc])
     minl = min([lrec, lsrc])
 
@@ -462,9 +1641,18 @@ def reflections(depth, e_zH, Gam, lrec, lsrc):
         if shiftplus or shiftminus:
             izout -= pm
 
-        # Pre-allocate Ref and rloc
+        # Pre-allocate Ref and rloc, and their derivatives; the derivatives of
+        # rloc are w.r.t. the parameters of layer iz (a) and iz+pm (b).
         Ref = np.zeros_like(Gam[:, :, :maxl-minl+1, :])
+        dRef = np.zeros((nfreq, noff, maxl-minl+1, nlambda, npar), Gam.dtype)
         rloc = np.zeros_like(Gam[:, :, 0, :])
+        drloca = np.zeros_like(rloc)
+        drlocb = np.zeros_like(rloc)
+        tRef = np.zeros_like(rloc)
+        dtRef = np.zeros((nfreq, noff, nlambda, npar), Gam.dtype)
+
+        # Parameters on which tRef depends (the others have zero derivative)
+        used = np.zeros(npar, np.bool_)
 
         # Calculate the reflection
         for iz in layer_count:
@@ -473,70 +1661,95 @@ def reflections(depth, e_zH, Gam, lrec, lsrc):
             for i in range(nfreq):
                 ra = e_zH[i, iz+pm]
                 rb = e_zH[i, iz]
+                dra = de_zH[i, iz+pm]
+                drb = de_zH[i, iz]
                 for ii in range(noff):
                     for iv in range(nlambda):
-                        rloca = ra*Gam[i, ii, iz, iv]
-                        rlocb = rb*Gam[i, ii, iz+pm, iv]
+                        ga = Gam[i, ii, iz, iv]
+                        gb = Gam[i, ii, iz+pm, iv]
+                        rloca = ra*ga
+                        rlocb = rb*gb
                         rloc[i, ii, iv] = (rloca - rlocb)/(rloca + rlocb)
+                        fact = 2/((rloca + rlocb)*(rloca + rlocb))
+                        drloca[i, ii, iv] = fact*(
+                                rlocb*ra*dGam[i, ii, iz, iv] - rloca*drb*gb)
+                        drlocb[i, ii, iv] = fact*(
+                                rlocb*dra*ga - rloca*rb*dGam[i, ii, iz+pm, iv])
 
             # In first layer tRef = rloc
             if iz == layer_count[0]:
                 tRef = rloc.copy()
+                dtRef[:] = 0
+                dtRef[:, :, :, iz] += drloca
+                dtRef[:, :, :, iz+pm] += drlocb
+                used[:] = False
+                used[iz] = True
+                used[iz+pm] = True
             else:
                 ddepth = depth[iz+1+pm]-depth[iz+pm]
+                dd = _ddepth_jac(nlayer, iz+1+pm, iz+pm)
+                used[iz] = True
+                used[iz+pm] = True
+                used |= dd != 0
+                iused = np.nonzero(used)[0]
 
                 # Eqs 64, A-11
                 for i in range(nfreq):
                     for ii in range(noff):
                         for iv in range(nlambda):
-                            term = tRef[i, ii, iv]*np.exp(
-                                    -2*Gam[i, ii, iz+pm, iv]*ddepth)
-                            tRef[i, ii, iv] = (rloc[i, ii, iv] + term)/(
-                                    1 + rloc[i, ii, iv]*term)
+                            tGam = Gam[i, ii, iz+pm, iv]
+                            fexp = np.exp(-2*tGam*ddepth)
+                            term = tRef[i, ii, iv]*fexp
+                            trloc = rloc[i, ii, iv]
+                            den = 1 + trloc*term
+                            tRef[i, ii, iv] = (trloc + term)/den
+
+                            # Derivatives w.r.t. rloc and term
+                            dr = (1 - term*term)/(den*den)
+                            dt = (1 - trloc*trloc)/(den*den)
+                            for p in iused:
+                                dterm = dtRef[i, ii, iv, p]*fexp
+                                dterm -= 2*term*tGam*dd[p]
+                                dtRef[i, ii, iv, p] = dt*dterm
+                            dtRef[i, ii, iv, iz+pm] -= dt*2*term*ddepth*dGam[
+                                    i, ii, iz+pm, iv]
+                            dtRef[i, ii, iv, iz] += dr*drloca[i, ii, iv]
+                            dtRef[i, ii, iv, iz+pm] += dr*drlocb[i, ii, iv]
 
             # The global reflection coefficient is given back for all layers
             # between and including src- and rec-layer
             if lrec != lsrc and pm*iz <= minmax:
                 Ref[:, :, izout, :] = tRef[:]
+                dRef[:, :, izout, :, :] = dtRef[:]
                 izout -= pm
 
         # If lsrc = lrec, we just store the last values
         if lsrc == lrec and layer_count.size > 0:
             out = np.zeros_like(Ref[:, :, :1, :])
             out[:, :, 0, :] = tRef
+            dout = np.zeros_like(dRef[:, :, :1, :, :])
+            dout[:, :, 0, :, :] = dtRef
         else:
             out = Ref
+            dout = dRef
 
         # Store Ref in Rm/Rp
         if plus:
-            Rp = out
+            Rp, dRp = out, dout
         else:
-            Rm = out
+            Rm, dRm = out, dout
 
     # Return reflections (minus and plus)
-    return Rp, Rm
+    return Rp, Rm, dRp, dRm
 
 
 @nb.njit(**_numba_setting)
-def fields(depth, Rp, Rm, Gam, lrec, lsrc, zsrc, ab, TM):
-    r"""Calculate Pu+, Pu-, Pd+, Pd-.
-
-    .. math::
-        :label: fields
-
-        P^{u\pm}_s, P^{d\pm}_s, \bar{P}^{u\pm}_s, \bar{P}^{d\pm}_s;
-        P^{u\pm}_{s-1}, P^{u\pm}_n, \bar{P}^{u\pm}_{s-1}, \bar{P}^{u\pm}_n;
-        P^{d\pm}_{s+1}, P^{d\pm}_n, \bar{P}^{d\pm}_{s+1}, \bar{P}^{d\pm}_n
-
-    This function corresponds to equations 81/82, 95/96, 103/104, A-8/A-9,
-    A-24/A-25, and A-32/A-33 in [HuTS15]_, and loosely to the corresponding
-    files `Pdownmin.F90`, `Pdownplus.F90`, `Pupmin.F90`, and `Pdownmin.F90`.
-
-    This function is called from the function :func:`greenfct`.
+def _fields_jac(depth, Rp, Rm, Gam, dRp, dRm, dGam, lrec, lsrc, zsrc, ab, TM):
+    r"""Calculate Pu+, Pu-, Pd+, Pd- and their derivatives; see :func:`fields`.
 
     """
-
     nfreq, noff, nlayer, nlambda = Gam.shape
+    npar = 2*nlayer-1
 
     # Variables
     nlsr = abs(lsrc-lrec)+1  # nr of layers btw and incl. src and rec layer
@@ -549,22 +1762,25 @@ def fields(depth, Rp, Rm, Gam, lrec, lsrc, zsrc, ab, TM):
     first_layer = lsrc == 0
     last_layer = lsrc == nlayer-1
 
-    # Depths; dp and dm are swapped if up=True
+    # Depths and their derivatives; dp and dm are swapped if up=True
+    ds = 0.0
+    dp = 0.0
+    dds = np.zeros(npar)
+    ddp = np.zeros(npar)
     if lsrc != nlayer-1:
         ds = depth[lsrc+1]-depth[lsrc]
         dp = depth[lsrc+1]-zsrc
+        dds = _ddepth_jac(nlayer, lsrc+1, lsrc)
+        ddp = _ddepth_jac(nlayer, lsrc+1, -1)
     dm = zsrc-depth[lsrc]
+    ddm = _ddepth_jac(nlayer, -1, lsrc)
 
     # Rm and Rp; swapped if up=True
-    Rmp = Rm
-    Rpm = Rp
+    Rmp, dRmp = Rm, dRm
+    Rpm, dRpm = Rp, dRp
 
     # Boolean if plus or minus has to be calculated
-    plusset = [13, 23, 33, 14, 24, 34, 15, 25, 35]
-    if TM:
-        plus = ab in plusset
-    else:
-        plus = ab not in plusset
+    plus = _fields_plus(ab, TM)
 
     # Sign-switches
     pm = 1     # + if plus=True, - if plus=False
@@ -573,28 +1789,31 @@ def fields(depth, Rp, Rm, Gam, lrec, lsrc, zsrc, ab, TM):
     pup = -1   # + if up=True,   - if up=False
     mupm = 1   # + except if up=True and plus=False
 
-    # Gamma of source layer
-    iGam = Gam[:, :, lsrc, :]
-
     # Calculate down- and up-going fields
     for up in [False, True]:
 
+        P = np.zeros((nfreq, noff, nlambda), Gam.dtype)
+        dP = np.zeros((nfreq, noff, nlambda, npar), Gam.dtype)
+
         # No upgoing field if rec is in last layer or below src
         if up and (lrec == nlayer-1 or lrec > lsrc):
-            Pu = np.zeros_like(iGam)
+            Pu, dPu = P, dP
             continue
         # No downgoing field if rec is in first layer or above src
         if not up and (lrec == 0 or lrec < lsrc):
-            Pd = np.zeros_like(iGam)
+            Pd, dPd = P, dP
             continue
 
         # Swaps if up=True
         if up:
             if not last_layer:
                 dp, dm = dm, dp
+                ddp, ddm = ddm, ddp
             else:
                 dp = dm
+                ddp = ddm
             Rmp, Rpm = Rpm, Rmp
+            dRmp, dRpm = dRpm, dRmp
             first_layer, last_layer = last_layer, first_layer
             rsrcl = nlsr-1  # src-layer in refl. (Rp/Rm), last (nlsr-1) if up
             izrange = range(nlsr-2)
@@ -604,8 +1823,6 @@ def fields(depth, Rp, Rm, Gam, lrec, lsrc, zsrc, ab, TM):
             if not plus:
                 mupm = -1
 
-        P = np.zeros_like(iGam)
-
         # Calculate Pu+, Pu-, Pd+, Pd-
         if lsrc == lrec:  # rec in src layer; Eqs  81/82, A-8/A-9
             if last_layer:  # If src/rec are in top (up) or bottom (down) layer
@@ -613,89 +1830,411 @@ def fields(depth, Rp, Rm, Gam, lrec, lsrc, zsrc, ab, TM):
                     for ii in range(noff):
                         for iv in range(nlambda):
                             tRmp = Rmp[i, ii, 0, iv]
-                            tiGam = iGam[i, ii, iv]
-                            P[i, ii, iv] = tRmp*np.exp(-tiGam*dm)
+                            tiGam = Gam[i, ii, lsrc, iv]
+                            p1 = np.exp(-tiGam*dm)
+                            P[i, ii, iv] = tRmp*p1
+                            for p in range(npar):
+                                dP[i, ii, iv, p] = dRmp[i, ii, 0, iv, p]*p1
+                                dP[i, ii, iv, p] -= tRmp*p1*tiGam*ddm[p]
+                            dP[i, ii, iv, lsrc] -= tRmp*_exp_dist(
+                                    p1, dm)*dGam[i, ii, lsrc, iv]
 
             else:           # If src and rec are in any layer in between
                 for i in range(nfreq):
                     for ii in range(noff):
                         for iv in range(nlambda):
-                            tiGam = iGam[i, ii, iv]
+                            tiGam = Gam[i, ii, lsrc, iv]
                             tRpm = Rpm[i, ii, 0, iv]
                             tRmp = Rmp[i, ii, 0, iv]
                             p1 = np.exp(-tiGam*dm)
-                            p2 = pm*tRpm*np.exp(-tiGam*(ds+dp))
-                            p3 = 1 - tRmp * tRpm * np.exp(-2*tiGam*ds)
-                            P[i, ii, iv] = (p1 + p2) * tRmp/p3
+                            e2 = np.exp(-tiGam*(ds+dp))
+                            p2 = pm*tRpm*e2
+                            e3 = np.exp(-2*tiGam*ds)
+                            p3 = 1 - tRmp * tRpm * e3
+                            tP = (p1 + p2) * tRmp/p3
+                            P[i, ii, iv] = tP
+                            for p in range(npar):
+                                tdRpm = dRpm[i, ii, 0, iv, p]
+                                tdRmp = dRmp[i, ii, 0, iv, p]
+                                dp1 = -p1*tiGam*ddm[p]
+                                dp2 = pm*(tdRpm - tRpm*tiGam*(dds[p]+ddp[p]))
+                                dp2 *= e2
+                                dp3 = 2*tRmp*tRpm*tiGam*dds[p]
+                                dp3 -= tdRmp*tRpm + tRmp*tdRpm
+                                dp3 *= e3
+                                dP[i, ii, iv, p] = (
+                                        (dp1 + dp2)*tRmp + (p1 + p2)*tdRmp -
+                                        tP*dp3)/p3
+
+                            # Derivative of Gamma of the src layer
+                            tdGam = dGam[i, ii, lsrc, iv]
+                            dp1 = -_exp_dist(p1, dm)*tdGam
+                            dp2 = -pm*tRpm*_exp_dist(e2, ds+dp)*tdGam
+                            dp3 = 2*tRmp*tRpm*_exp_dist(e3, ds)*tdGam
+                            dP[i, ii, iv, lsrc] += (
+                                    (dp1 + dp2)*tRmp - tP*dp3)/p3
 
         else:           # rec above (up) / below (down) src layer
             #           # Eqs  95/96,  A-24/A-25 for rec above src layer
             #           # Eqs 103/104, A-32/A-33 for rec below src layer
 
             # First compute P_{s-1} (up) / P_{s+1} (down)
-            iRpm = Rpm[:, :, rsrcl, :]
             if first_layer:  # If src is in bottom (up) / top (down) layer
                 for i in range(nfreq):
                     for ii in range(noff):
                         for iv in range(nlambda):
-                            tiRpm = iRpm[i, ii, iv]
-                            tiGam = iGam[i, ii, iv]
-                            P[i, ii, iv] = (1 + tiRpm)*mupm*np.exp(-tiGam*dp)
+                            tiRpm = Rpm[i, ii, rsrcl, iv]
+                            tiGam = Gam[i, ii, lsrc, iv]
+                            p1 = mupm*np.exp(-tiGam*dp)
+                            P[i, ii, iv] = (1 + tiRpm)*p1
+                            for p in range(npar):
+                                dP[i, ii, iv, p] = dRpm[i, ii, rsrcl, iv, p]*p1
+                                dP[i, ii, iv, p] -= (
+                                        (1 + tiRpm)*p1*tiGam*ddp[p])
+                            dP[i, ii, iv, lsrc] -= (1 + tiRpm)*_exp_dist(
+                                    p1, dp)*dGam[i, ii, lsrc, iv]
             else:
                 for i in range(nfreq):
                     for ii in range(noff):
                         for iv in range(nlambda):
                             iRmp = Rmp[i, ii, rsrcl, iv]
-                            tiGam = iGam[i, ii, iv]
-                            tRpm = iRpm[i, ii, iv]
+                            tiGam = Gam[i, ii, lsrc, iv]
+                            tRpm = Rpm[i, ii, rsrcl, iv]
                             p1 = mupm*np.exp(-tiGam*dp)
-                            p2 = pm*mupm*iRmp*np.exp(-tiGam * (ds+dm))
-                            p3 = (1 + tRpm)/(1 - iRmp*tRpm*np.exp(-2*tiGam*ds))
+                            e2 = np.exp(-tiGam * (ds+dm))
+                            p2 = pm*mupm*iRmp*e2
+                            e3 = np.exp(-2*tiGam*ds)
+                            q3 = 1 - iRmp*tRpm*e3
+                            p3 = (1 + tRpm)/q3
                             P[i, ii, iv] = (p1 + p2) * p3
+                            for p in range(npar):
+                                tdRpm = dRpm[i, ii, rsrcl, iv, p]
+                                tdRmp = dRmp[i, ii, rsrcl, iv, p]
+                                dp1 = -p1*tiGam*ddp[p]
+                                dp2 = tdRmp - iRmp*tiGam*(dds[p]+ddm[p])
+                                dp2 *= pm*mupm*e2
+                                dq3 = 2*iRmp*tRpm*tiGam*dds[p]
+                                dq3 -= tdRmp*tRpm + iRmp*tdRpm
+                                dq3 *= e3
+                                dp3 = (tdRpm - p3*dq3)/q3
+                                dP[i, ii, iv, p] = (
+                                        (dp1 + dp2)*p3 + (p1 + p2)*dp3)
+
+                            # Derivative of Gamma of the src layer
+                            tdGam = dGam[i, ii, lsrc, iv]
+                            dp1 = -_exp_dist(p1, dp)*tdGam
+                            dp2 = -pm*mupm*iRmp*_exp_dist(e2, ds+dm)*tdGam
+                            dq3 = 2*iRmp*tRpm*_exp_dist(e3, ds)*tdGam
+                            dp3 = -p3*dq3/q3
+                            dP[i, ii, iv, lsrc] += (
+                                    (dp1 + dp2)*p3 + (p1 + p2)*dp3)
 
             # If up or down and src is in last but one layer
             if up or (not up and lsrc+1 < nlayer-1):
                 ddepth = depth[lsrc+1-1*pup]-depth[lsrc-1*pup]
                 if np.isfinite(ddepth):
+                    il = lsrc-1*pup
+                    dd = _ddepth_jac(nlayer, il+1, il)
                     for i in range(nfreq):
                         for ii in range(noff):
                             for iv in range(nlambda):
                                 tiRpm = Rpm[i, ii, rsrcl-1*pup, iv]
-                                tiGam = Gam[i, ii, lsrc-1*pup, iv]
-                                fact = tiRpm*np.exp(-2*tiGam*ddepth)
-                                P[i, ii, iv] /= 1 + fact
+                                tiGam = Gam[i, ii, il, iv]
+                                fexp = np.exp(-2*tiGam*ddepth)
+                                fact = 1 + tiRpm*fexp
+                                P[i, ii, iv] /= fact
+                                tP = P[i, ii, iv]
+                                for p in range(npar):
+                                    dfact = dRpm[i, ii, rsrcl-1*pup, iv, p]
+                                    dfact -= 2*tiRpm*tiGam*dd[p]
+                                    dfact *= fexp
+                                    dP[i, ii, iv, p] -= tP*dfact
+                                dfact = -2*tiRpm*fexp*ddepth
+                                dfact *= dGam[i, ii, il, iv]
+                                dP[i, ii, iv, il] -= tP*dfact
+                                for p in range(npar):
+                                    dP[i, ii, iv, p] /= fact
 
             # Second compute P for all other layers
             if nlsr > 2:
                 for iz in izrange:
-                    ddepth = depth[isr+iz+pup+1]-depth[isr+iz+pup]
+                    il = isr+iz+pup
+                    ddepth = depth[il+1]-depth[il]
+                    dd = _ddepth_jac(nlayer, il+1, il)
                     for i in range(nfreq):
                         for ii in range(noff):
                             for iv in range(nlambda):
                                 tiRpm = Rpm[i, ii, iz+pup, iv]
-                                piGam = Gam[i, ii, isr+iz+pup, iv]
-                                p1 = (1+tiRpm)*np.exp(-piGam*ddepth)
+                                piGam = Gam[i, ii, il, iv]
+                                fexp = np.exp(-piGam*ddepth)
+                                p1 = (1+tiRpm)*fexp
+                                tP = P[i, ii, iv]
                                 P[i, ii, iv] *= p1
+                                for p in range(npar):
+                                    dp1 = dRpm[i, ii, iz+pup, iv, p]
+                                    dp1 -= (1+tiRpm)*piGam*dd[p]
+                                    dp1 *= fexp
+                                    dP[i, ii, iv, p] *= p1
+                                    dP[i, ii, iv, p] += tP*dp1
+                                dp1 = -p1*ddepth*dGam[i, ii, il, iv]
+                                dP[i, ii, iv, il] += tP*dp1
 
                     # If rec/src NOT in first/last layer (up/down)
                     if isr+iz != last:
-                        ddepth = depth[isr+iz+1] - depth[isr+iz]
+                        il = isr+iz
+                        ddepth = depth[il+1] - depth[il]
+                        dd = _ddepth_jac(nlayer, il+1, il)
                         for i in range(nfreq):
                             for ii in range(noff):
                                 for iv in range(nlambda):
                                     tiRpm = Rpm[i, ii, iz, iv]
-                                    piGam2 = Gam[i, ii, isr+iz, iv]
-                                    p1 = 1 + tiRpm*np.exp(-2*piGam2 * ddepth)
+                                    piGam2 = Gam[i, ii, il, iv]
+                                    fexp = np.exp(-2*piGam2 * ddepth)
+                                    p1 = 1 + tiRpm*fexp
                                     P[i, ii, iv] /= p1
+                                    tP = P[i, ii, iv]
+                                    for p in range(npar):
+                                        dp1 = dRpm[i, ii, iz, iv, p]
+                                        dp1 -= 2*tiRpm*piGam2*dd[p]
+                                        dp1 *= fexp
+                                        dP[i, ii, iv, p] -= tP*dp1
+                                    dp1 = -2*tiRpm*fexp*ddepth
+                                    dp1 *= dGam[i, ii, il, iv]
+                                    dP[i, ii, iv, il] -= tP*dp1
+                                    for p in range(npar):
+                                        dP[i, ii, iv, p] /= p1
 
         # Store P in Pu/Pd
         if up:
-            Pu = P
+            Pu, dPu = P, dP
         else:
-            Pd = P
+            Pd, dPd = P, dP
 
     # Return fields (up- and downgoing)
-    return Pu, Pd
+    return Pu, Pd, dPu, dPd
+
+
+@nb.njit(**_numba_setting)
+def _green_jac(zsrc, zrec, lsrc, lrec, depth, Gam, dGam, Rp, Rm, dRp, dRm, Wu,
+               Wd, dWu, dWd, Pu, Pd, dPu, dPd, ab, xdirect, TM):
+    r"""Calculate the Green's function of TM or TE and its derivatives.
+
+    See :func:`_green`.
+
+    """
+    nfreq, noff, nlayer, nlambda = Gam.shape
+    npar = 2*nlayer-1
+
+    # Green's function
+    green = np.zeros((nfreq, noff, nlambda), Gam.dtype)
+    dgreen = np.zeros((nfreq, noff, nlambda, npar), Gam.dtype)
+    if lsrc == lrec:  # Rec in src layer; Eqs 108, 109, 110, 117, 118, 122
+
+        # Green's function depending on <ab>
+        # (If only one layer, no reflections/fields)
+        if nlayer > 1:
+            if ab in [13, 23, 31, 32, 14, 24, 15, 25]:
+                pmd = -1
+            else:
+                pmd = 1
+            for i in range(nfreq):
+                for ii in range(noff):
+                    for iv in range(nlambda):
+                        green[i, ii, iv] = Pu[i, ii, iv]*Wu[i, ii, iv]
+                        green[i, ii, iv] += pmd*Pd[i, ii, iv]*Wd[i, ii, iv]
+                        for p in range(npar):
+                            dgreen[i, ii, iv, p] = (
+                                    dPu[i, ii, iv, p]*Wu[i, ii, iv] +
+                                    Pu[i, ii, iv]*dWu[i, ii, iv, p] +
+                                    pmd*dPd[i, ii, iv, p]*Wd[i, ii, iv] +
+                                    pmd*Pd[i, ii, iv]*dWd[i, ii, iv, p])
+
+        # Direct field, if it is computed in the wavenumber domain
+        if not xdirect:
+            ddepth = abs(zsrc - zrec)
+
+            # Sign of the direct field, which depends only on <ab> and TM
+            dsign = 1.0
+            if TM and ab in [11, 12, 13, 14, 15, 21, 22, 23, 24, 25]:
+                dsign *= -1
+            if ab in [13, 14, 15, 23, 24, 25, 31, 32]:
+                dsign *= np.sign(zrec - zsrc)
+
+            for i in range(nfreq):
+                for ii in range(noff):
+                    for iv in range(nlambda):
+                        fexp = dsign*np.exp(-Gam[i, ii, lrec, iv]*ddepth)
+                        green[i, ii, iv] += fexp
+                        dgreen[i, ii, iv, lrec] -= fexp*ddepth*dGam[
+                                i, ii, lrec, iv]
+
+    else:
+
+        # Calculate exponential factor
+        if lrec == nlayer-1:
+            ddepth = 0
+            dd = np.zeros(npar)
+        else:
+            ddepth = depth[lrec+1] - depth[lrec]
+            dd = _ddepth_jac(nlayer, lrec+1, lrec)
+
+        # Sign-switch for Green calculation
+        if TM and ab in [11, 12, 13, 21, 22, 23, 14, 24, 15, 25]:
+            pmw = -1
+        else:
+            pmw = 1
+
+        for i in range(nfreq):
+            for ii in range(noff):
+                for iv in range(nlambda):
+                    tGam = Gam[i, ii, lrec, iv]
+                    fexp = np.exp(-tGam*ddepth)
+                    dfexpl = -_exp_dist(fexp, ddepth)*dGam[i, ii, lrec, iv]
+
+                    if lrec < lsrc:  # Rec above src layer: Pd not used
+                        #              Eqs 89-94, A18-A23, B13-B15
+                        tP = Pu[i, ii, iv]
+                        tR = pmw*Rm[i, ii, 0, iv]
+                        tW = Wd[i, ii, iv]
+                        fact = Wu[i, ii, iv] + tR*fexp*tW
+                        for p in range(npar):
+                            dfexp = -fexp*tGam*dd[p]
+                            dfact = dWu[i, ii, iv, p] + tR*(
+                                    dfexp*tW + fexp*dWd[i, ii, iv, p])
+                            dfact += pmw*dRm[i, ii, 0, iv, p]*fexp*tW
+                            dgreen[i, ii, iv, p] = dPu[i, ii, iv, p]*fact
+                            dgreen[i, ii, iv, p] += tP*dfact
+
+                    else:  # rec below src layer: Pu not used
+                        #    Eqs 97-102 A26-A30, B16-B18
+                        tP = Pd[i, ii, iv]
+                        tR = Rp[i, ii, abs(lsrc-lrec), iv]
+                        tW = Wu[i, ii, iv]
+                        fact = pmw*Wd[i, ii, iv] + tR*fexp*tW
+                        for p in range(npar):
+                            dfexp = -fexp*tGam*dd[p]
+                            dfact = pmw*dWd[i, ii, iv, p] + tR*(
+                                    dfexp*tW + fexp*dWu[i, ii, iv, p])
+                            dfact += dRp[i, ii, abs(lsrc-lrec), iv, p]*fexp*tW
+                            dgreen[i, ii, iv, p] = dPd[i, ii, iv, p]*fact
+                            dgreen[i, ii, iv, p] += tP*dfact
+
+                    green[i, ii, iv] = tP*fact
+                    dgreen[i, ii, iv, lrec] += tP*tR*dfexpl*tW
+
+    return green, dgreen
+
+
+@nb.njit(**_numba_setting)
+def _green_factors_jac(GTM, GTE, dGTM, dGTE, gamTM, gamTE, dgamTM, dgamTE,
+                       etaH, etaV, zetaH, zetaV, detaH, detaV, dzetaH, dzetaV,
+                       lsrc, lrec, ab):
+    r"""Apply the `ab`-specific factors and their derivatives (in-place).
+
+    See :func:`_green_factors`. The factors are written as
+    :math:`f = \prod x_k^{\pm 1}`, hence their derivatives as
+    :math:`\mathrm{d}f = f \sum \pm \mathrm{d}x_k/x_k`, separated into the
+    derivative w.r.t. the parameters of the source and the receiver layer.
+
+    """
+    nfreq, noff, nlambda = GTM.shape
+
+    for i in range(nfreq):
+        for ii in range(noff):
+            for iv in range(nlambda):
+
+                # Factors and logarithmic derivatives for TM
+                if ab in [11, 12, 21, 22]:
+                    grec = gamTM[i, ii, lrec, iv]
+                    fact = grec/etaH[i, lrec]
+                    dfs = 0.0
+                    dfr = dgamTM[i, ii, lrec, iv]/grec
+                    dfr -= detaH[i, lrec]/etaH[i, lrec]
+
+                elif ab in [14, 15, 24, 25]:
+                    gsrc = gamTM[i, ii, lsrc, iv]
+                    grec = gamTM[i, ii, lrec, iv]
+                    fact = etaH[i, lsrc]/etaH[i, lrec]*grec/gsrc
+                    dfs = detaH[i, lsrc]/etaH[i, lsrc]
+                    dfs -= dgamTM[i, ii, lsrc, iv]/gsrc
+                    dfr = dgamTM[i, ii, lrec, iv]/grec
+                    dfr -= detaH[i, lrec]/etaH[i, lrec]
+
+                elif ab in [13, 23]:
+                    gsrc = gamTM[i, ii, lsrc, iv]
+                    grec = gamTM[i, ii, lrec, iv]
+                    fact = etaH[i, lsrc]/etaH[i, lrec]/etaV[i, lsrc]
+                    fact *= -grec/gsrc
+                    dfs = detaH[i, lsrc]/etaH[i, lsrc]
+                    dfs -= detaV[i, lsrc]/etaV[i, lsrc]
+                    dfs -= dgamTM[i, ii, lsrc, iv]/gsrc
+                    dfr = dgamTM[i, ii, lrec, iv]/grec
+                    dfr -= detaH[i, lrec]/etaH[i, lrec]
+
+                elif ab in [31, 32]:
+                    fact = 1/etaV[i, lrec]
+                    dfs = 0.0
+                    dfr = -detaV[i, lrec]/etaV[i, lrec]
+
+                elif ab in [34, 35]:
+                    gsrc = gamTM[i, ii, lsrc, iv]
+                    fact = etaH[i, lsrc]/etaV[i, lrec]/gsrc
+                    dfs = detaH[i, lsrc]/etaH[i, lsrc]
+                    dfs -= dgamTM[i, ii, lsrc, iv]/gsrc
+                    dfr = -detaV[i, lrec]/etaV[i, lrec]
+
+                elif ab in [33, ]:
+                    gsrc = gamTM[i, ii, lsrc, iv]
+                    fact = etaH[i, lsrc]/etaV[i, lsrc]/etaV[i, lrec]/gsrc
+                    dfs = detaH[i, lsrc]/etaH[i, lsrc]
+                    dfs -= detaV[i, lsrc]/etaV[i, lsrc]
+                    dfs -= dgamTM[i, ii, lsrc, iv]/gsrc
+                    dfr = -detaV[i, lrec]/etaV[i, lrec]
+
+                else:  # [16, 26]: TM not used
+                    fact = 1.0
+                    dfs = 0.0
+                    dfr = 0.0
+
+                _scale_jac(GTM, dGTM, i, ii, iv, fact, fact*dfs, fact*dfr,
+                           lsrc, lrec)
+
+                # Factors and logarithmic derivatives for TE
+                if ab in [11, 12, 21, 22]:
+                    gsrc = gamTE[i, ii, lsrc, iv]
+                    fact = zetaH[i, lsrc]/gsrc
+                    dfs = dzetaH[i, lsrc]/zetaH[i, lsrc]
+                    dfs -= dgamTE[i, ii, lsrc, iv]/gsrc
+
+                elif ab in [16, 26]:
+                    gsrc = gamTE[i, ii, lsrc, iv]
+                    fact = zetaH[i, lsrc]/zetaV[i, lsrc]/gsrc
+                    dfs = dzetaH[i, lsrc]/zetaH[i, lsrc]
+                    dfs -= dzetaV[i, lsrc]/zetaV[i, lsrc]
+                    dfs -= dgamTE[i, ii, lsrc, iv]/gsrc
+
+                else:  # TE not used or without factor
+                    fact = 1.0
+                    dfs = 0.0
+
+                _scale_jac(GTE, dGTE, i, ii, iv, fact, fact*dfs, 0.0, lsrc,
+                           lrec)
+
+
+@nb.njit(**_numba_setting)
+def _scale_jac(G, dG, i, ii, iv, fact, dfs, dfr, lsrc, lrec):
+    r"""Multiply `G` at (i, ii, iv) by `fact`, updating its derivatives.
+
+    `dfs` and `dfr` are the derivatives of `fact` w.r.t. the parameters of the
+    source and the receiver layer, respectively.
+
+    """
+    tG = G[i, ii, iv]
+    G[i, ii, iv] = tG*fact
+    for p in range(dG.shape[3]):
+        dG[i, ii, iv, p] *= fact
+    dG[i, ii, iv, lsrc] += tG*dfs
+    dG[i, ii, iv, lrec] += tG*dfr
 
 
 # Angle Factor
@@ -1238,3 +2777,302 @@ def halfspace(off, angle, zsrc, zrec, etaH, etaV, freqtime, ab, signal,
         return direct_TE, direct_TM, reflect_TE, reflect_TM, air
     else:
         return direct + reflect + air
+
+
+# Number of threads
+
+def set_num_threads(n=None):
+    r"""Set the number of threads used by the wavenumber-domain kernels.
+
+    The default is one thread. The setting applies to the DLF (see
+    :func:`call_threaded`). Use :func:`num_threads` to set the number of
+    threads temporarily, e.g., per request within a service.
+
+    Parameters
+    ----------
+    n : int, optional
+        Number of threads; default is the number of threads available to
+        numba (``numba.config.NUMBA_NUM_THREADS``).
+
+    """
+    global _num_threads
+    _num_threads = _check_num_threads(n)
+
+
+def get_num_threads():
+    r"""Return the number of threads used by the wavenumber-domain kernels.
+
+    This is the number set within a :func:`num_threads` context in the current
+    thread, else the one set by :func:`set_num_threads` (default: 1).
+
+    """
+    return getattr(_local_threads, 'n', _num_threads)
+
+
+@contextmanager
+def num_threads(n=None):
+    r"""Context manager to temporarily set the number of threads.
+
+    The number of threads is only changed in the current thread, so
+    concurrent requests of a service can each use their own number.
+
+    .. code-block:: python
+
+        with empymod.num_threads(4):
+            out = empymod.dipole(...)
+
+    Parameters
+    ----------
+    n : int, optional
+        Number of threads; see :func:`set_num_threads`.
+
+    """
+    old = getattr(_local_threads, 'n', None)
+    _local_threads.n = _check_num_threads(n)
+    try:
+        yield
+    finally:
+        if old is None:
+            del _local_threads.n
+        else:
+            _local_threads.n = old
+
+
+def _check_num_threads(n):
+    r"""Check the number of threads; None means all available to numba."""
+    if n is None:
+        n = nb.config.NUMBA_NUM_THREADS
+    if int(n) != n or n < 1:
+        raise ValueError("<n> must be a positive integer; "
+                         f"<n> provided: {n}.")
+    return int(n)
+
+
+# Profiling
+
+class Profile:
+    r"""Wall times per stage and work counters of empymod calls.
+
+    Created by the context manager :func:`profile`, which records all empymod
+    calls within its context (in the current thread).
+
+    Attributes
+    ----------
+    times : dict
+        Wall time (s) per stage, summed over all calls. Stages are nested; the
+        time spent in the loops of the modelling routines is, e.g., 'total'
+        minus 'check', 'fem', and 'fourier'. Recorded stages:
+
+        - 'total': modelling routines (:func:`empymod.model.bipole`,
+          :func:`empymod.model.dipole`, ...);
+        - 'check': input checks of the modelling routines;
+        - 'fem': frequency-domain responses (:func:`empymod.model.fem`);
+        - 'fourier': Fourier transforms (:func:`empymod.model.tem`);
+        - 'kernel': wavenumber-domain kernels of the Hankel transforms,
+          including the reflections;
+        - 'reflections': incremental reflections (:class:`ReflectionCache`;
+          the reflections within the compiled kernels are not timed
+          separately);
+        - 'dlf': digital linear filters (:func:`empymod.transform.dlf`),
+          including their splines;
+        - 'spline': construction of splines.
+
+    calls : dict
+        Number of calls per stage.
+
+    counts : dict
+        Work counters, summed over all calls (except where noted):
+
+        - 'kernel_calls': kernel calls (kernel count of the modelling
+          routines);
+        - 'lambdas': wavenumbers for which the kernel was evaluated, times the
+          number of frequencies (and of depth pairs);
+        - 'kernel_size_max': maximum size (elements) of the kernel arrays,
+          `nfreq x noff x nlayer x nlambda`;
+        - 'splines': constructed splines;
+        - 'qwe_intervals': intervals of QWE, summed over all offsets (Hankel)
+          or times (Fourier).
+
+    qwe : list of dict
+        For each QWE call (Hankel: per frequency; Fourier: per offset) the
+        number of carried out 'intervals' and whether it 'converged', both
+        arrays of the offsets (Hankel) or times (Fourier) carried out with QWE
+        (the others are carried out with QUAD).
+
+    """
+
+    def __init__(self):
+        """Initiate an empty profile."""
+        self.times = {}
+        self.calls = {}
+        self.counts = {}
+        self.qwe = []
+
+    def __repr__(self):
+        """Print the stages and counters."""
+        out = [f"{self.__class__.__name__}:"]
+        for stage, time in self.times.items():
+            out.append(f"  {stage:<16}: {time:10.4f} s  "
+                       f"({self.calls[stage]} call(s))")
+        for name, value in self.counts.items():
+            out.append(f"  {name:<16}: {value}")
+        return "\n".join(out)
+
+    def to_dict(self):
+        """Return the profile as a (JSON-serializable) dictionary."""
+        return {
+            'times': dict(self.times),
+            'calls': dict(self.calls),
+            'counts': dict(self.counts),
+            'qwe': [{'intervals': q['intervals'].tolist(),
+                     'converged': q['converged'].tolist()}
+                    for q in self.qwe],
+        }
+
+
+@contextmanager
+def profile():
+    r"""Context manager to profile empymod calls.
+
+    Records the wall times per stage and work counters of all empymod calls
+    within the context in the current thread, into the yielded
+    :class:`Profile`. Without it, the instrumentation costs a check per stage.
+
+    .. code-block:: python
+
+        with empymod.profile() as prof:
+            out = empymod.dipole(...)
+        metrics = prof.to_dict()
+
+    """
+    old = getattr(_local_profile, 'prof', None)
+    _local_profile.prof = Profile()
+    try:
+        yield _local_profile.prof
+    finally:
+        if old is None:
+            del _local_profile.prof
+        else:
+            _local_profile.prof = old
+
+
+def _profile_start():
+    r"""Return the start time of a stage, None if not profiling."""
+    if getattr(_local_profile, 'prof', None) is None:
+        return None
+    return default_timer()
+
+
+def _profile_stop(stage, t0):
+    r"""Add the time since `t0` (if not None) to `stage`, if profiling."""
+    prof = getattr(_local_profile, 'prof', None)
+    if prof is None or t0 is None:
+        return
+    prof.times[stage] = prof.times.get(stage, 0.0) + default_timer() - t0
+    prof.calls[stage] = prof.calls.get(stage, 0) + 1
+
+
+def _profile_count(name, value, maximum=False):
+    r"""Add `value` to counter `name` (or take the maximum), if profiling."""
+    prof = getattr(_local_profile, 'prof', None)
+    if prof is None:
+        return
+    value = int(value)
+    if maximum:
+        prof.counts[name] = max(prof.counts.get(name, 0), value)
+    else:
+        prof.counts[name] = prof.counts.get(name, 0) + value
+
+
+def _profile_qwe(intervals, converged):
+    r"""Record intervals and convergence per offset of QWE, if profiling."""
+    prof = getattr(_local_profile, 'prof', None)
+    if prof is None:
+        return
+    prof.qwe.append({'intervals': np.array(intervals),
+                     'converged': np.array(converged)})
+    _profile_count('qwe_intervals', np.sum(intervals))
+
+
+# Precompilation
+
+def precompile(cache_dir=None, precision=('double', 'single')):
+    r"""Compile the numba functions eagerly.
+
+    Compiles (or, with a warm cache, loads) the numba functions for the
+    signatures used by :func:`empymod.model.fem` (DLF with the standard,
+    several-`ab`, depth-pair, and fused kernels, and with a
+    :class:`ReflectionCache`; QWE and QUAD), :func:`empymod.model.dipole_k`,
+    :func:`empymod.model.dipole_jacobian`, and
+    :func:`empymod.scripts.tmtemod.dipole`, by carrying out small
+    representative calls. Call it at the start of a worker process, so that
+    its first request does not pay for the compilation.
+
+    The parallel kernels (:func:`num_threads` > 1) are not cached by numba,
+    and are therefore not precompiled.
+
+    Parameters
+    ----------
+    cache_dir : str, default: None
+        Writable directory for the numba cache; it is created if it does not
+        exist. By default, numba caches in the ``__pycache__`` directories of
+        empymod, or, if these are not writable (e.g., a read-only
+        site-packages), in a user-wide directory; the environment variable
+        ``NUMBA_CACHE_DIR`` has to be set before numba is imported. Providing
+        `cache_dir` sets ``numba.config.CACHE_DIR``, which applies to all numba
+        functions cached afterwards in this process.
+
+    precision : str or list of str, default: ('double', 'single')
+        Precision(s) of the DLF kernels to compile: 'double' (complex128)
+        and/or 'single' (complex64).
+
+    Returns
+    -------
+    nsig : int
+        Number of compiled or loaded signatures of the numba functions of
+        empymod. (From a warm cache only the functions called from Python are
+        loaded, as the compiled code of their callees is part of them.)
+
+    """
+    # Imported here, as model and tmtemod import kernel
+    from numba.core.caching import NullCache
+    from empymod import model
+    from empymod.scripts import tmtemod
+
+    # All numba functions of empymod (tmtemod imports some from kernel)
+    dispatchers = {
+        fct for module in [globals(), vars(tmtemod)]
+        for fct in module.values()
+        if isinstance(fct, nb.core.dispatcher.Dispatcher)
+    }
+
+    # Re-locate the cache of the cached functions
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        nb.config.CACHE_DIR = str(cache_dir)
+        for fct in dispatchers:
+            if not isinstance(fct._cache, NullCache):
+                fct.enable_caching()
+
+    # Small survey: two offsets, source and receivers in the same layer
+    inp = {'src': [0, 0, 150], 'rec': [[200, 400], [0, 0], 200],
+           'depth': [0, 100, 300], 'res': [2e14, 1, 10, 100], 'verb': 0}
+
+    for prec in np.atleast_1d(precision):
+        dlf = {'freqtime': 1, 'precision': prec, **inp}
+        model.dipole(**dlf)                              # Standard
+        model.dipole(ab='all', **dlf)                    # Several ab's
+        model.dipole(htarg={'kernel': 'fused'}, **dlf)   # Fused
+        cache = ReflectionCache()
+        for res in [inp['res'], [2e14, 1, 20, 100]]:     # Incremental
+            model.dipole(**{**dlf, 'res': res}, htarg={'cache': cache})
+        model.bipole(**{**dlf, 'src': [0, 0, 0, 0, 150, 160],
+                        'rec': [200, 0, 0, 90, 0]})      # Depth pairs
+
+    model.dipole(freqtime=1, ht='qwe', **inp)
+    model.dipole(freqtime=1, ht='quad', **inp)
+    model.dipole_k(freq=1, wavenumber=np.logspace(-3, 0, 5), **inp)
+    model.dipole_jacobian(freqtime=1, **inp)
+    tmtemod.dipole(freqtime=1, **inp)
+
+    return sum(len(fct.signatures) for fct in dispatchers)
@@ -20,6 +20,8 @@ Further routines are:
 
 - :func:`analytical`: Calculate analytical fullspace and halfspace solutions.
 - :func:`dipole_k`: Calculate the electromagnetic wavenumber-domain solution.
+- :func:`dipole_jacobian`: Calculate :func:`dipole` and its derivatives w.r.t.
+  the layer resistivities and interfaces.
 - :func:`gpr`: Calculate the Ground-Penetrating Radar (GPR) response.
 - :func:`ip_and_q`: Calculate in-phase and quadrature responses.
 
@@ -53,6 +55,7 @@ The modelling routines make use of the following two core routines:
 # License for the specific language governing permissions and limitations under
 # the License.
 import copy
+from itertools import product
 
 import numpy as np
 
@@ -60,11 +63,16 @@ from empymod import kernel, transform
 from empymod.utils import (
         check_time, check_time_only, check_model, check_frequency,
         check_hankel, check_loop, check_dipole, check_bipole, check_ab,
-        check_solution, get_abs, get_geo_fact, get_azm_dip, get_off_ang,
-        get_layer_nr, get_kwargs, printstartfinish, conv_warning, EMArray)
+        check_precision, check_solution, get_abs, get_geo_fact, get_azm_dip,
+        get_depth_groups, get_nlayer_truncated, get_off_ang, get_layer_nr,
+        get_kwargs, printstartfinish, conv_warning, EMArray)
 
 __all__ = ['bipole', 'dipole', 'loop', 'analytical', 'gpr', 'dipole_k',
-           'ip_and_q', 'fem', 'tem']
+           'dipole_jacobian', 'ip_and_q', 'fem', 'tem']
+
+# Approximate memory (bytes) of the wavenumber-domain arrays per chunk of an
+# ensemble of models in :func:`dipole`.
+_ensemble_memory = 2**24
 
 
 def __dir__():
@@ -195,6 +203,32 @@ def bipole(src, rec, depth, res, freqtime, signal=None, aniso=None,
             - If < 0: Lagged Convolution DLF.
             - If > 0: Splined DLF
 
+          - `kernel`: wavenumber-domain kernel, 'default' or 'fused'
+            (default: 'default'). The fused kernel loops over each
+            frequency-offset pair; it is slower, but requires much less memory
+            for many layers, frequencies, and offsets.
+          - `prune`: relative tolerance to skip negligible lambdas (default:
+            0, no pruning). The decay of the wavenumber-domain kernel is
+            estimated from the attenuation between source and receiver (see
+            :func:`empymod.transform.get_dlf_pruned`), and the kernel is not
+            computed for large lambdas with an estimated magnitude below
+            `prune` times its maximum. This saves most for large offsets and
+            high frequencies (e.g., GPR, HEM). `dipole` prints the number of
+            skipped lambdas if ``verb>2``.
+          - `cache`: an instance of :class:`empymod.kernel.ReflectionCache`
+            (default: None). Gamma and the reflection coefficients are then
+            updated incrementally from the ones of the previous call with the
+            same cache, recomputing only Gamma of the changed layers and the
+            reflection recursion from them towards the source and receiver
+            layers (e.g., in inversions or time-lapse studies). Only for the
+            default kernel; the kernel is run single-threaded.
+          - `plan`: an instance of :class:`empymod.transform.HankelPlan`
+            (default: None), which holds the other DLF arguments (only
+            `cache` can be provided with it). The lambdas, interpolation
+            points, filter weights, and angle factors are then computed only
+            once per geometry, and reused by subsequent calls with the same
+            plan (e.g., in inversions).
+
         - If `ht='qwe'`:
 
           - `rtol`: relative tolerance (default: 1e-12)
@@ -291,7 +325,7 @@ def bipole(src, rec, depth, res, freqtime, signal=None, aniso=None,
     loop : {None, 'freq', 'off'}, default: None
         Define if to calculate everything vectorized or if to loop over
         frequencies ('freq') or over offsets ('off'). It always loops over
-        frequencies if `ht='qwe'` or if `pts_per_dec=-1`. Calculating
+        frequencies if `ht='qwe'` or `ht='quad'`. Calculating
         everything vectorized is fast for few offsets OR for few frequencies.
         However, if you calculate many frequencies for many offsets, it might
         be faster to loop over frequencies. Only comparing the different
@@ -301,6 +335,42 @@ def bipole(src, rec, depth, res, freqtime, signal=None, aniso=None,
         If True, the output is squeezed. If False, the output will always be of
         ``ndim=3``, (nfreqtime, nrec, nsrc).
 
+    precision : {'double', 'single'}, default: 'double'
+        Floating-point precision of the wavenumber-domain kernel and of the
+        DLF Hankel and Fourier transforms. Single precision (complex64; float32
+        in the Laplace and time domains) halves the memory of the
+        wavenumber-domain arrays, at the cost of accuracy. Relative to the
+        maximum amplitude of the response the error is typically 1e-6 to 1e-4
+        (median 1.5e-6, 90th percentile 1.3e-4 for the regression cases of
+        the test suite, see ``benchmarks/precision.py``). It can be of the
+        order of the response itself where the result relies on strong
+        cancellations, e.g., for receivers at offsets much smaller than their
+        vertical distance to the source, or for responses many orders of
+        magnitude below the maximum. The analytical direct field
+        (``xdirect=True``) is always computed in double precision.
+
+    merge : bool, default: False
+        If True, adjacent layers with identical `res`, `aniso`, `epermH`,
+        `epermV`, `mpermH`, and `mpermV` are merged into one layer, except for
+        layers which contain a source or receiver (pole). This reduces the
+        cost of the wavenumber-domain kernel, which scales linearly with the
+        number of layers, for models with many thin layers of which neighbours
+        share the same parameters (e.g., inversion or geostatistical models).
+        The results are unchanged. The reduced number of layers is printed if
+        ``verb>2``. It is not done for user-provided models (`res` as dict).
+
+    truncate : float, default: 0.0
+        Attenuation threshold for the skin-depth truncation of deep layers
+        (default: 0, no truncation). For each frequency, the layers are
+        removed below the first interface where the two-way attenuation from
+        the deepest source or receiver is smaller than `truncate` (e.g.,
+        1e-15), and the last remaining layer becomes a terminating
+        half-space (see :func:`empymod.utils.get_nlayer_truncated`). This
+        saves the cost of the deep layers for high frequencies or early
+        times; frequencies with the same number of remaining layers are
+        computed together. The range of the number of layers is printed by
+        `dipole` if ``verb>2``.
+
 
     Returns
     -------
@@ -379,10 +449,13 @@ def bipole(src, rec, depth, res, freqtime, signal=None, aniso=None,
     """
     # Get kwargs with defaults.
     out = get_kwargs(
-        ['verb', 'ht', 'htarg', 'ft', 'ftarg', 'xdirect', 'loop', 'squeeze'],
-        [2, 'dlf', {}, 'dlf', {}, False, None, True], kwargs,
+        ['verb', 'ht', 'htarg', 'ft', 'ftarg', 'xdirect', 'loop', 'squeeze',
+         'precision', 'merge', 'truncate'],
+        [2, 'dlf', {}, 'dlf', {}, False, None, True, 'double', False, 0.0],
+        kwargs,
     )
-    verb, ht, htarg, ft, ftarg, xdirect, loop, squeeze = out
+    (verb, ht, htarg, ft, ftarg, xdirect, loop, squeeze, precision, merge,
+     truncate) = out
 
     # === 1.  LET'S START ============
     t0 = printstartfinish(verb)
@@ -395,9 +468,12 @@ def bipole(src, rec, depth, res, freqtime, signal=None, aniso=None,
     else:
         time, freq, ft, ftarg = check_time(freqtime, signal, ft, ftarg, verb)
 
-    # Check layer parameters
+    # Check layer parameters (optionally merge identical layers, except the
+    # ones containing the source or receiver depths)
+    zkeep = [z for inp in [src, rec]
+             for z in (inp[4:6] if len(inp) == 6 else inp[2:3])]
     model = check_model(depth, res, aniso, epermH, epermV, mpermH, mpermV,
-                        xdirect, verb)
+                        xdirect, verb, merge, zkeep)
     depth, res, aniso, epermH, epermV, mpermH, mpermV, isfullspace = model
 
     # Check frequency => get etaH, etaV, zetaH, and zetaV
@@ -411,6 +487,10 @@ def bipole(src, rec, depth, res, freqtime, signal=None, aniso=None,
     if isinstance(res, dict) and 'func_zeta' in res:
         zetaH, zetaV = res['func_zeta'](res, locals())
 
+    # Check precision => cast etaH/etaV/zetaH/zetaV if single precision
+    etaH, etaV, zetaH, zetaV = check_precision(
+            precision, etaH, etaV, zetaH, zetaV, verb)
+
     # Check Hankel transform parameters
     ht, htarg = check_hankel(ht, htarg, verb)
 
@@ -430,6 +510,7 @@ def bipole(src, rec, depth, res, freqtime, signal=None, aniso=None,
         rec_j = False
 
     # === 3. EM-FIELD CALCULATION ============
+    kernel._profile_stop('check', t0)
 
     # Pre-allocate output EM array
     EM = np.zeros((freq.size, nrec*nsrc), dtype=etaH.dtype)
@@ -439,33 +520,55 @@ def bipole(src, rec, depth, res, freqtime, signal=None, aniso=None,
     kcount = 0
     conv = True
 
-    # Define some indices
-    isrc = int(nsrc/nsrcz)  # this is either 1 or nsrc
-    irec = int(nrec/nrecz)  # this is either 1 or nrec
-    isrz = int(isrc*irec)   # this is either 1, nsrc, nrec, or nsrc*nrec
-
-    # The kernel handles only 1 ab with one srcz-recz combination at once.
-    # Hence we have to loop over every different depth of src or rec, and
-    # over all required ab's.
-    for isz in range(nsrcz):  # Loop over source depths
-
-        # Get this source
-        srcazmdip = get_azm_dip(src, isz, nsrcz, srcpts, srcdipole, strength,
-                                'src', verb)
+    # Group src and rec by their unique depths
+    src_groups = get_depth_groups(src, nsrcz, srcdipole)
+    rec_groups = get_depth_groups(rec, nrecz, recdipole)
+
+    # We have to loop over every different depth of src or rec, and over the
+    # integration points; all poles at the same depth are computed at once.
+    # The required calculations are collected first: all depth pairs which
+    # share the layers of src and rec, the required ab's, and the offsets and
+    # angles (e.g., the integration points of vertical bipoles, or receivers
+    # at several depths of the same position) are computed at once, sharing
+    # the reflection coefficients (DLF). All required ab's are computed at
+    # once, sharing the Green's functions (DLF).
+    batches = {}
+    for sgroup in src_groups:  # Loop over source depths
+
+        # Get these sources
+        srcazmdip = get_azm_dip(src, sgroup, nsrcz, srcpts, srcdipole,
+                                strength, 'src', verb)
         tsrc, srcazm, srcdip, srcg_w, srcpts, src_w = srcazmdip
 
-        for irz in range(nrecz):  # Loop over receiver depths
+        for rgroup in rec_groups:  # Loop over receiver depths
 
-            # Get this receiver
-            recazmdip = get_azm_dip(rec, irz, nrecz, recpts, recdipole,
+            # Get these receivers
+            recazmdip = get_azm_dip(rec, rgroup, nrecz, recpts, recdipole,
                                     strength, 'rec', verb)
             trec, recazm, recdip, recg_w, recpts, rec_w = recazmdip
 
+            # Number of sources and receivers in this group
+            isrc = sgroup.size
+            irec = rgroup.size
+
             # Get required ab's
             ab_calc = get_abs(msrc, mrec, srcazm, srcdip, recazm, recdip, verb)
 
-            # Pre-allocate temporary source-EM array for integration loop
-            sEM = np.zeros((freq.size, isrz), dtype=etaH.dtype)
+            # Get geometrical scaling factors, broadcast to (irec, isrc)
+            geo_fact = np.array([
+                (np.ones((irec, isrc))*get_geo_fact(
+                    iab, srcazm, srcdip, recazm, recdip, msrc, mrec
+                )).ravel('F') for iab in ab_calc
+            ])
+
+            # Scale signal for src-strength and src/rec-lengths
+            src_rec_w = 1
+            if strength > 0:
+                src_rec_w *= np.repeat(src_w, irec)
+                src_rec_w *= np.tile(rec_w, isrc)
+
+            # Indices of this src-rec group in EM
+            iEM = (sgroup[:, None]*nrec + rgroup).ravel()
 
             for isg in range(srcpts):  # Loop over src integration points
 
@@ -476,9 +579,6 @@ def bipole(src, rec, depth, res, freqtime, signal=None, aniso=None,
                 # Get layer number in which src resides
                 lsrc, zsrc = get_layer_nr(tisrc, depth)
 
-                # Pre-allocate temporary receiver EM arrays for integr. loop
-                rEM = np.zeros((freq.size, isrz), dtype=etaH.dtype)
-
                 for irg in range(recpts):  # Loop over rec integration pts
                     # Note, if source or receiver is a bipole, but horizontal
                     # (dip=0), then calculation could be sped up by not looping
@@ -499,62 +599,52 @@ def bipole(src, rec, depth, res, freqtime, signal=None, aniso=None,
                         print("* WARNING :: `etaH != etaV` at receiver level, "
                               "only `etaH` considered for e-current density.")
 
-                    # Gather variables
-                    finp = (off, angle, zsrc, zrec, lsrc, lrec, depth, freq,
-                            etaH, etaV, zetaH, zetaV, xdirect, isfullspace, ht,
-                            htarg, msrc, mrec, loop_freq, loop_off, conv)
-
-                    # Pre-allocate temporary EM array for ab-loop
-                    abEM = np.zeros((freq.size, isrz), dtype=etaH.dtype)
+                    # Weights of the ab's with geometrical factor, weights
+                    # from integration, and src-strength and src/rec-lengths
+                    weight = geo_fact*src_rec_w*srcg_w[isg]*recg_w[irg]
 
-                    for iab in ab_calc:  # Loop over required ab's
+                    # Add this depth pair to its batch
+                    key = (int(lsrc), int(lrec), ab_calc.tobytes(),
+                           off.tobytes(), angle.tobytes())
+                    if key not in batches:
+                        batches[key] = (lsrc, lrec, ab_calc, off, angle, [])
+                    batches[key][5].append((zsrc, zrec, iEM, weight))
 
-                        # Carry-out the frequency-domain calculation
-                        out = fem(iab, *finp)
+    for lsrc, lrec, ab_calc, off, angle, pairs in batches.values():
 
-                        # Get geometrical scaling factor,
-                        # broadcast to (irec, isrc)
-                        tfact = np.ones((irec, isrc))*get_geo_fact(
-                            iab, srcazm, srcdip, recazm, recdip, msrc, mrec
-                        )
+        # Depth pairs of this batch (scalars if there is only one)
+        if len(pairs) > 1:
+            zsrc = np.array([p[0] for p in pairs])
+            zrec = np.array([p[1] for p in pairs])
+        else:
+            zsrc, zrec = pairs[0][:2]
 
-                        # Add field to EM with geometrical factor
-                        abEM += out[0]*tfact.ravel('F')
+        # Gather variables
+        finp = (off, angle, zsrc, zrec, lsrc, lrec, depth, freq, etaH, etaV,
+                zetaH, zetaV, xdirect, isfullspace, ht, htarg, msrc, mrec,
+                loop_freq, loop_off, conv)
 
-                        # Update kernel count
-                        kcount += out[1]
+        # Carry-out the frequency-domain calculation for all depth pairs and
+        # all required ab's at once
+        out = fem(ab_calc, *finp, truncate)
 
-                        # Update conv (QWE convergence)
-                        conv *= out[2]
+        # Update kernel count
+        kcount += out[1]
 
-                    # Add this receiver element, with weight from integration
-                    rEM += abEM*recg_w[irg]
+        # Update conv (QWE convergence)
+        conv *= out[2]
 
-                # Add this source element, with weight from integration
-                sEM += rEM*srcg_w[isg]
-
-            # Scale signal for src-strength and src/rec-lengths
-            src_rec_w = 1
-            if strength > 0:
-                src_rec_w *= np.repeat(src_w, irec)
-                src_rec_w *= np.tile(rec_w, isrc)
-            sEM *= src_rec_w
+        # Add each depth pair with its weights
+        fEM = out[0] if len(pairs) > 1 else out[0][None, ...]
+        for pEM, (_, _, iEM, weight) in zip(fEM, pairs):
+            tEM = np.sum(pEM*weight[:, None, :], axis=0)
 
             # Multiply with eta of the rec-layer if ecurrent.
             if rec_j:
-                sEM *= etaH[:, lrec, None]
+                tEM *= etaH[:, lrec, None]
 
             # Add this src-rec signal
-            if nrec == nrecz:
-                if nsrc == nsrcz:  # Case 1: Looped over each src and each rec
-                    EM[:, isz*nrec+irz:isz*nrec+irz+1] = sEM
-                else:              # Case 2: Looped over each rec
-                    EM[:, irz:nsrc*nrec:nrec] = sEM
-            else:
-                if nsrc == nsrcz:  # Case 3: Looped over each src
-                    EM[:, isz*nrec:nrec*(isz+1)] = sEM
-                else:              # Case 4: All in one go
-                    EM = sEM
+            EM[:, iEM] += tEM
 
     # In case of QWE/QUAD, print Warning if not converged
     conv_warning(conv, htarg, 'Hankel', verb)
@@ -628,6 +718,12 @@ def dipole(src, rec, depth, res, freqtime, signal=None, ab=11, aniso=None,
         zetaV, which can be used to, for instance, use the Cole-Cole model for
         IP.
 
+        For an ensemble of `nmodel` models with the same depths (e.g., for
+        Monte Carlo studies), res can be of shape (nmodel, #depth + 1); aniso,
+        epermH, epermV, mpermH, and mpermV can then be of shape (#res, ) or
+        of the same shape as res. The models are stacked along the frequency
+        axis of the wavenumber-domain kernel, in chunks of bounded memory.
+
     freqtime : array_like
         Frequencies f (Hz) if `signal==None`, else times t (s); (f, t > 0).
 
@@ -639,8 +735,11 @@ def dipole(src, rec, depth, res, freqtime, signal=None, ab=11, aniso=None,
         - 0 : Impulse time-domain response
         - +1 : Switch-on time-domain response
 
-    ab : int, default: 11
-        Source-receiver configuration.
+    ab : int or 'all', default: 11
+        Source-receiver configuration. If `ab='all'`, the full tensor is
+        returned (all 36 configurations); the Green's functions are then shared
+        by all configurations with the same type (electric or magnetic) of
+        source and receiver.
 
         +---------------+-------+------+------+------+------+------+------+
         |                       | electric  source   | magnetic source    |
@@ -682,7 +781,7 @@ def dipole(src, rec, depth, res, freqtime, signal=None, ab=11, aniso=None,
         - 3: Print additional start/stop, condensed parameter information.
         - 4: Print additional full parameter information
 
-    ht, htarg, ft, ftarg, xdirect, loop : settings, optinal
+    ht, htarg, ft, ftarg, xdirect, loop, precision, merge, truncate : settings
         See docstring of :func:`bipole` for a description.
 
     squeeze : bool, default: True
@@ -698,6 +797,15 @@ def dipole(src, rec, depth, res, freqtime, signal=None, ab=11, aniso=None,
         - If rec is electric, returns E [V/m].
         - If rec is magnetic, returns H [A/m].
 
+        If `ab='all'`, EM has two additional leading dimensions,
+        (6, 6, nfreqtime, nrec, nsrc), for the receiver (Ex, Ey, Ez, Hx, Hy,
+        Hz) and source (x, y, z electric; x, y, z magnetic) components; only
+        the last three dimensions are squeezed.
+
+        For an ensemble of models, EM has an additional leading dimension,
+        (nmodel, nfreqtime, nrec, nsrc) or (nmodel, 6, 6, nfreqtime, nrec,
+        nsrc); again, only the last three dimensions are squeezed.
+
         EMArray is a subclassed ndarray with `.pha` and `.amp` attributes
         (only relevant for frequency-domain data).
 
@@ -724,10 +832,13 @@ def dipole(src, rec, depth, res, freqtime, signal=None, ab=11, aniso=None,
     """
     # Get kwargs with defaults.
     out = get_kwargs(
-        ['verb', 'ht', 'htarg', 'ft', 'ftarg', 'xdirect', 'loop', 'squeeze'],
-        [2, 'dlf', {}, 'dlf', {}, False, None, True], kwargs,
+        ['verb', 'ht', 'htarg', 'ft', 'ftarg', 'xdirect', 'loop', 'squeeze',
+         'precision', 'merge', 'truncate'],
+        [2, 'dlf', {}, 'dlf', {}, False, None, True, 'double', False, 0.0],
+        kwargs,
     )
-    verb, ht, htarg, ft, ftarg, xdirect, loop, squeeze = out
+    (verb, ht, htarg, ft, ftarg, xdirect, loop, squeeze, precision, merge,
+     truncate) = out
 
     # === 1.  LET'S START ============
     t0 = printstartfinish(verb)
@@ -741,9 +852,10 @@ def dipole(src, rec, depth, res, freqtime, signal=None, ab=11, aniso=None,
     else:
         freq = freqtime
 
-    # Check layer parameters
+    # Check layer parameters (optionally merge identical layers, except the
+    # ones containing the source or receiver depths)
     model = check_model(depth, res, aniso, epermH, epermV, mpermH, mpermV,
-                        xdirect, verb)
+                        xdirect, verb, merge, [*src[2:3], *rec[2:3]], True)
     depth, res, aniso, epermH, epermV, mpermH, mpermV, isfullspace = model
 
     # Check frequency => get etaH, etaV, zetaH, and zetaV
@@ -751,12 +863,23 @@ def dipole(src, rec, depth, res, freqtime, signal=None, ab=11, aniso=None,
                                 mpermV, verb)
     freq, etaH, etaV, zetaH, zetaV = frequency
 
+    # Ensemble of models: stack the models along the frequency axis,
+    # (nmodel*nfreq, nlayer)
+    ensemble = etaH.ndim > 2
+    nmodel = etaH.shape[0] if ensemble else 1
+    etaH, etaV, zetaH, zetaV = [
+        v.reshape(-1, depth.size) for v in (etaH, etaV, zetaH, zetaV)]
+
     # Update etaH/etaV and zetaH/zetaV according to user-provided model
     if isinstance(res, dict) and 'func_eta' in res:
         etaH, etaV = res['func_eta'](res, locals())
     if isinstance(res, dict) and 'func_zeta' in res:
         zetaH, zetaV = res['func_zeta'](res, locals())
 
+    # Check precision => cast etaH/etaV/zetaH/zetaV if single precision
+    etaH, etaV, zetaH, zetaV = check_precision(
+            precision, etaH, etaV, zetaH, zetaV, verb)
+
     # Check Hankel transform parameters
     ht, htarg = check_hankel(ht, htarg, verb)
 
@@ -774,32 +897,119 @@ def dipole(src, rec, depth, res, freqtime, signal=None, ab=11, aniso=None,
     # Get offsets and angles (off, angle)
     off, angle = get_off_ang(src, rec, nsrc, nrec, verb)
 
+    # Print the reduction of kernel evaluations by unique lambdas (std. DLF)
+    if verb > 2 and ht == 'dlf' and htarg['pts_per_dec'] == 0 and not loop_off:
+        lambd, _ = transform.get_dlf_points(htarg['dlf'], off, 0)
+        nlambd = transform.get_dlf_unique(lambd)[0].size
+        print(f"   Unique lambdas  :  {nlambd} of {lambd.size} "
+              f"(reduction factor {lambd.size/nlambd:.1f})")
+
     # Get layer number in which src and rec reside (lsrc/lrec)
     lsrc, zsrc = get_layer_nr(src, depth)
     lrec, zrec = get_layer_nr(rec, depth)
 
+    # Print the number of lambdas skipped by pruning (DLF)
+    if verb > 2 and ht == 'dlf' and htarg['prune'] > 0:
+        lambd, _ = transform.get_dlf_points(
+                htarg['dlf'], off, htarg['pts_per_dec'])
+        lambd = transform.get_dlf_unique(lambd)[0]
+        keep = transform.get_dlf_pruned(
+                lambd, zsrc, zrec, lsrc, lrec, depth, etaH, etaV, zetaH,
+                zetaV, xdirect is not False, htarg['prune'])
+        print(f"   Pruned lambdas  :  {keep.size-keep.sum()} of {keep.size} "
+              "skipped")
+
+    # Print the number of layers after skin-depth truncation
+    if verb > 2 and truncate > 0:
+        nlayer = get_nlayer_truncated(depth, zsrc, zrec, etaH, zetaH, truncate)
+        print(f"   Truncated model :  {nlayer.min()} - {nlayer.max()} of "
+              f"{depth.size} layers [min-max]")
+
     # === 3. EM-FIELD CALCULATION ============
+    kernel._profile_stop('check', t0)
+
+    # Full tensor if ab='all'
+    tensor = np.ndim(ab_calc) > 0
+    ncomp = 36 if tensor else 1
+
+    # Number of models per chunk, such that the wavenumber-domain arrays
+    # (about four of shape (nfreq, noff, nfilter, nlayer)) stay below
+    # _ensemble_memory.
+    if ht == 'dlf':
+        nfilt = htarg['dlf'].base.size
+    else:  # QWE: points per interval; QUAD: points per decade
+        nfilt = htarg.get('nquad', htarg['pts_per_dec'])
+    nbytes = 4*freq.size*off.size*nfilt*depth.size*etaH.itemsize
+    nchunk = int(min(nmodel, max(1, _ensemble_memory//nbytes)))
+    if verb > 2 and ensemble:
+        print(f"   Ensemble chunks :  {-(-nmodel//nchunk)} of up to {nchunk} "
+              "models")
+
+    EM = np.zeros((nmodel, freq.size, ncomp*off.size), dtype=etaH.dtype)
+    kcount = 0
+    conv = True
+    for i in range(0, nmodel, nchunk):
+
+        # Frequencies and eta/zeta of the models of this chunk
+        nc = min(nchunk, nmodel-i)
+        rows = slice(i*freq.size, (i+nc)*freq.size)
+        inp = (off, angle, zsrc, zrec, lsrc, lrec, depth,
+               np.tile(freq, nc), etaH[rows], etaV[rows], zetaH[rows],
+               zetaV[rows], xdirect, isfullspace, ht, htarg)
+
+        if tensor:
+            # Compute all ab's with the same type of src and rec at once;
+            # the 36 components are stacked along the offset-axis.
+            cEM = np.zeros((nc*freq.size, 36, off.size), dtype=etaH.dtype)
+            for tmsrc in [False, True]:
+                for tmrec in [False, True]:
+                    iab = np.nonzero((msrc.ravel() == tmsrc) &
+                                     (mrec.ravel() == tmrec))[0]
+                    out = fem(ab_calc.ravel()[iab], *inp, tmsrc, tmrec,
+                              loop_freq, loop_off, truncate=truncate)
+                    cEM[:, iab, :] = out[0].transpose(1, 0, 2)
+                    kcount += out[1]
+                    conv *= out[2]
+
+        else:
+            cEM, ckcount, cconv = fem(ab_calc, *inp, msrc, mrec, loop_freq,
+                                      loop_off, truncate=truncate)
+            kcount += ckcount
+            conv *= cconv
+
+        EM[i:i+nc] = cEM.reshape((nc, freq.size, -1))
 
-    # Collect variables for fem
-    inp = (ab_calc, off, angle, zsrc, zrec, lsrc, lrec, depth, freq, etaH,
-           etaV, zetaH, zetaV, xdirect, isfullspace, ht, htarg, msrc, mrec,
-           loop_freq, loop_off)
-    EM, kcount, conv = fem(*inp)
+    off = np.tile(off, ncomp)
 
     # In case of QWE/QUAD, print Warning if not converged
     conv_warning(conv, htarg, 'Hankel', verb)
 
-    # Do f->t transform if required
+    # Do f->t transform if required (model by model)
     if signal is not None:
-        EM, conv = tem(EM, off, freq, time, signal, ft, ftarg)
+        tEM = np.zeros((nmodel, time.size, off.size), dtype=EM.real.dtype)
+        conv = True
+        for i in range(nmodel):
+            tEM[i], tconv = tem(EM[i], off, freq, time, signal, ft, ftarg)
+            conv *= tconv
+        EM = tEM
 
         # In case of QWE/QUAD, print Warning if not converged
         conv_warning(conv, ftarg, 'Fourier', verb)
 
     # Reshape for number of sources
-    EM = EM.reshape((-1, nrec, nsrc), order='F')
+    if tensor:
+        EM = EM.reshape((nmodel, -1, 36, nsrc, nrec)).transpose(0, 2, 1, 4, 3)
+        EM = EM.reshape((nmodel, 6, 6, -1, nrec, nsrc))
+    else:
+        EM = EM.reshape((nmodel, -1, nsrc, nrec)).transpose(0, 1, 3, 2)
+
+    # Remove the model dimension if not an ensemble; squeeze only the last
+    # three dimensions
+    if not ensemble:
+        EM = EM[0]
     if squeeze:
-        EM = np.squeeze(EM)
+        EM = np.squeeze(EM, axis=tuple(
+            i for i in range(EM.ndim-3, EM.ndim) if EM.shape[i] == 1))
 
     # === 4.  FINISHED ============
     printstartfinish(verb, t0, kcount)
@@ -807,6 +1017,210 @@ def dipole(src, rec, depth, res, freqtime, signal=None, ab=11, aniso=None,
     return EMArray(EM)
 
 
+def dipole_jacobian(src, rec, depth, res, freqtime, signal=None, ab=11,
+                    aniso=None, epermH=None, epermV=None, mpermH=None,
+                    mpermV=None, **kwargs):
+    r"""Return EM fields and their derivatives w.r.t. the layer model.
+
+    Calculate the same electromagnetic frequency- or time-domain field as
+    :func:`dipole`, and additionally its derivatives (Jacobian) with respect
+    to the horizontal resistivity of each layer (with fixed anisotropy) and
+    with respect to the depth of each layer interface.
+
+    The derivatives are computed analytically in the wavenumber domain,
+    together with the response (see
+    :func:`empymod.kernel.wavenumber_jacobian`), and carried through the same
+    Hankel and Fourier transforms. This is much cheaper than finite
+    differences, which require `#res+#depth+1` calls to :func:`dipole`.
+
+    The derivative with respect to the thickness of a layer (keeping the
+    interfaces above fixed) is the sum of the derivatives with respect to all
+    interfaces below it, e.g., ``np.cumsum(ddepth[::-1], axis=0)[::-1]``.
+
+    The layers in which the source and the receivers reside are fixed, hence
+    the derivative with respect to an interface assumes that it is not moved
+    across the source or the receivers.
+
+
+    See Also
+    --------
+    :func:`dipole` : EM fields due to infinitesimal small EM dipoles.
+
+
+    Parameters
+    ----------
+    src, rec, depth, res, freqtime, signal, aniso, epermH, epermV, mpermH, \
+    mpermV, verb, ft, ftarg, squeeze : settings
+        See docstring of :func:`dipole` for a description; `res` cannot be a
+        dictionary.
+
+    ab : int, default: 11
+        Source-receiver configuration (see :func:`dipole`); `ab='all'` is not
+        supported.
+
+    ht, htarg : settings
+        See docstring of :func:`bipole`; only the DLF (``ht='dlf'``) is
+        implemented.
+
+    xdirect : {False, None}, default: False
+        See docstring of :func:`bipole`; the direct field cannot be computed
+        analytically in the frequency domain (``xdirect=True``).
+
+
+    Returns
+    -------
+    EM : EMArray, (nfreqtime, nrec, nsrc)
+        Frequency- or time-domain EM field, as returned by :func:`dipole`.
+
+    dres : ndarray, (nres, nfreqtime, nrec, nsrc)
+        Derivatives of EM with respect to the horizontal resistivities `res`.
+
+    ddepth : ndarray, (ndepth, nfreqtime, nrec, nsrc)
+        Derivatives of EM with respect to the interfaces `depth` (excluding
+        +/- infinity).
+
+        The trailing dimensions of `dres` and `ddepth` are squeezed as the
+        ones of EM.
+
+
+    Examples
+    --------
+
+    .. ipython::
+
+       In [1]: import empymod
+          ...: import numpy as np
+          ...: src = [0, 0, 100]
+          ...: rec = [np.arange(1, 11)*500, np.zeros(10), 200]
+          ...: depth = [0, 300, 1000, 1050]
+          ...: res = [1e20, .3, 1, 50, 1]
+          ...: EM, dres, ddepth = empymod.dipole_jacobian(
+          ...:         src, rec, depth, res, freqtime=1, verb=1)
+          ...: dres[3, 0]  # Derivative w.r.t. res[3] at the first receiver
+       Out[1]: (9.23711813011419e-15-7.024701497017066e-16j)
+
+    """
+    # Get kwargs with defaults.
+    out = get_kwargs(
+        ['verb', 'ht', 'htarg', 'ft', 'ftarg', 'xdirect', 'squeeze'],
+        [2, 'dlf', {}, 'dlf', {}, False, True], kwargs,
+    )
+    verb, ht, htarg, ft, ftarg, xdirect, squeeze = out
+
+    # === 1.  LET'S START ============
+    t0 = printstartfinish(verb)
+
+    # === 2.  CHECK INPUT ============
+
+    # Check the settings for which the Jacobian is implemented
+    if ht != 'dlf':
+        raise ValueError(f"The Jacobian is only implemented for ht='dlf'; "
+                         f"<ht> provided: {ht}.")
+    if xdirect:
+        raise ValueError("The Jacobian is not implemented for the analytical "
+                         "direct field; <xdirect> must be False or None.")
+    if isinstance(res, dict):
+        raise ValueError("The Jacobian is not implemented for user-provided "
+                         "eta/zeta-models; <res> cannot be a dict.")
+
+    # Check times and Fourier Transform arguments, get required frequencies
+    # (freq = freqtime if `signal=None`)
+    if signal is not None:
+        time, freq, ft, ftarg = check_time(freqtime, signal, ft, ftarg, verb)
+    else:
+        freq = freqtime
+
+    # Check layer parameters; check_model swaps them if depth is decreasing
+    idepth = np.array([] if depth is None else depth, dtype=float, ndmin=1)
+    idepth = idepth[np.isfinite(idepth)]
+    swap = -1 if idepth.size > 1 and np.all(np.diff(idepth) < 0) else 1
+    model = check_model(depth, res, aniso, epermH, epermV, mpermH, mpermV,
+                        xdirect, verb)
+    depth, res, aniso, epermH, epermV, mpermH, mpermV, isfullspace = model
+
+    # Check frequency => get etaH, etaV, zetaH, and zetaV
+    frequency = check_frequency(freq, res, aniso, epermH, epermV, mpermH,
+                                mpermV, verb)
+    freq, etaH, etaV, zetaH, zetaV = frequency
+
+    # Derivatives of etaH/etaV/zetaH/zetaV w.r.t. the resistivity of the layer
+    detaH = np.ones_like(etaH)*(-1/res**2)
+    detaV = np.ones_like(etaV)*(-1/(res*aniso)**2)
+    dzeta = np.zeros_like(zetaH)
+
+    # Check Hankel transform parameters
+    ht, htarg = check_hankel(ht, htarg, verb)
+
+    # Check src-rec configuration
+    # => Get flags if src or rec or both are magnetic (msrc, mrec)
+    ab_calc, msrc, mrec = check_ab(ab, verb)
+    if np.ndim(ab_calc) > 0:
+        raise ValueError("The Jacobian is not implemented for <ab>='all'.")
+
+    # Check src and rec
+    src, nsrc = check_dipole(src, 'src', verb)
+    rec, nrec = check_dipole(rec, 'rec', verb)
+
+    # Get offsets and angles (off, angle)
+    off, angle = get_off_ang(src, rec, nsrc, nrec, verb)
+
+    # Get layer number in which src and rec reside (lsrc/lrec)
+    lsrc, zsrc = get_layer_nr(src, depth)
+    lrec, zrec = get_layer_nr(rec, depth)
+
+    # === 3. EM-FIELD CALCULATION ============
+    kernel._profile_stop('check', t0)
+
+    # Response and derivatives are stacked along the first dimension:
+    # (response, nlayer resistivities, nlayer-1 interfaces)
+    npar = 2*depth.size
+    EM = np.zeros((npar, freq.size, off.size), dtype=etaH.dtype)
+    if ab_calc != 36:
+
+        # Wavenumber-domain response and its derivatives
+        lambd, int_pts = transform.get_dlf_points(
+                htarg['dlf'], off, htarg['pts_per_dec'])
+        # If `xdirect = None` the direct field is NOT calculated in the
+        # wavenumber domain (only reflected fields are returned; see fem).
+        xdir = True if xdirect is None else xdirect
+        PJ = kernel.wavenumber_jacobian(
+                zsrc, zrec, lsrc, lrec, depth, etaH, etaV, zetaH, zetaV,
+                detaH, detaV, dzeta, dzeta, lambd, ab_calc, xdir, msrc, mrec)
+
+        # The Hankel transform is linear: carry it out for the response and
+        # all derivatives at once, stacked along the frequency dimension.
+        PJ = tuple(None if iPJ is None else iPJ.reshape((-1, *lambd.shape))
+                   for iPJ in PJ)
+        ang_fact = kernel.angle_factor(angle, ab_calc, msrc, mrec)
+        EM = transform.dlf(PJ, lambd, off, htarg['dlf'], htarg['pts_per_dec'],
+                           ang_fact=ang_fact, ab=ab_calc, int_pts=int_pts)
+        EM = EM.reshape((npar, freq.size, off.size))
+
+    # Do f->t transform if required
+    if signal is not None:
+        out = [tem(iEM, off, freq, time, signal, ft, ftarg) for iEM in EM]
+        EM = np.array([o[0] for o in out])
+
+        # In case of QWE/QUAD, print Warning if not converged
+        conv_warning(all(o[1] for o in out), ftarg, 'Fourier', verb)
+
+    # Reshape for number of sources
+    EM = EM.reshape((npar, -1, nrec, nsrc), order='F')
+    if squeeze:
+        EM = np.squeeze(EM, axis=tuple(
+            i for i in range(1, 4) if EM.shape[i] == 1))
+
+    # Split into response and derivatives (in the order of the input)
+    nlayer = depth.size
+    dres = EM[1:nlayer+1][::swap]
+    ddepth = EM[nlayer+1:][::swap]
+
+    # === 4.  FINISHED ============
+    printstartfinish(verb, t0, 1)
+
+    return EMArray(EM[0]), dres, ddepth
+
+
 def loop(src, rec, depth, res, freqtime, signal=None, aniso=None, epermH=None,
          epermV=None, mpermH=None, mpermV=None, mrec=True, recpts=1,
          strength=0, **kwargs):
@@ -939,7 +1353,7 @@ def loop(src, rec, depth, res, freqtime, signal=None, aniso=None, epermH=None,
         - 3: Print additional start/stop, condensed parameter information.
         - 4: Print additional full parameter information
 
-    ht, htarg, ft, ftarg, xdirect, loop : settings, optinal
+    ht, htarg, ft, ftarg, xdirect, loop, precision, merge, truncate : settings
         See docstring of :func:`bipole` for a description.
 
     squeeze : bool, default: True
@@ -1017,10 +1431,13 @@ def loop(src, rec, depth, res, freqtime, signal=None, aniso=None, epermH=None,
     """
     # Get kwargs with defaults.
     out = get_kwargs(
-        ['verb', 'ht', 'htarg', 'ft', 'ftarg', 'xdirect', 'loop', 'squeeze'],
-        [2, 'dlf', {}, 'dlf', {}, False, None, True], kwargs,
+        ['verb', 'ht', 'htarg', 'ft', 'ftarg', 'xdirect', 'loop', 'squeeze',
+         'precision', 'merge', 'truncate'],
+        [2, 'dlf', {}, 'dlf', {}, False, None, True, 'double', False, 0.0],
+        kwargs,
     )
-    verb, ht, htarg, ft, ftarg, xdirect, loop, squeeze = out
+    (verb, ht, htarg, ft, ftarg, xdirect, loop, squeeze, precision, merge,
+     truncate) = out
 
     # === 1.  LET'S START ============
     t0 = printstartfinish(verb)
@@ -1033,9 +1450,12 @@ def loop(src, rec, depth, res, freqtime, signal=None, aniso=None, epermH=None,
     else:
         time, freq, ft, ftarg = check_time(freqtime, signal, ft, ftarg, verb)
 
-    # Check layer parameters
+    # Check layer parameters (optionally merge identical layers, except the
+    # ones containing the source or receiver depths)
+    zkeep = [z for inp in [src, rec]
+             for z in (inp[4:6] if len(inp) == 6 else inp[2:3])]
     model = check_model(depth, res, aniso, epermH, epermV, mpermH, mpermV,
-                        xdirect, verb)
+                        xdirect, verb, merge, zkeep)
     depth, res, aniso, epermH, epermV, mpermH, mpermV, isfullspace = model
 
     # Check frequency => get etaH, etaV, zetaH, and zetaV
@@ -1049,6 +1469,10 @@ def loop(src, rec, depth, res, freqtime, signal=None, aniso=None, epermH=None,
     if isinstance(res, dict) and 'func_zeta' in res:
         zetaH, zetaV = res['func_zeta'](res, locals())
 
+    # Check precision => cast etaH/etaV/zetaH/zetaV if single precision
+    etaH, etaV, zetaH, zetaV = check_precision(
+            precision, etaH, etaV, zetaH, zetaV, verb)
+
     # Check Hankel transform parameters
     ht, htarg = check_hankel(ht, htarg, verb)
 
@@ -1069,6 +1493,7 @@ def loop(src, rec, depth, res, freqtime, signal=None, aniso=None, epermH=None,
         rec_loop = False
 
     # === 3. EM-FIELD CALCULATION ============
+    kernel._profile_stop('check', t0)
 
     # Pre-allocate output EM array
     EM = np.zeros((freq.size, nrec*nsrc), dtype=etaH.dtype)
@@ -1078,33 +1503,38 @@ def loop(src, rec, depth, res, freqtime, signal=None, aniso=None, epermH=None,
     kcount = 0
     conv = True
 
-    # Define some indices
-    isrc = int(nsrc/nsrcz)  # this is either 1 or nsrc
-    irec = int(nrec/nrecz)  # this is either 1 or nrec
-    isrz = int(isrc*irec)   # this is either 1, nsrc, nrec, or nsrc*nrec
+    # Group src and rec by their unique depths
+    src_groups = get_depth_groups(src, nsrcz, srcdipole)
+    rec_groups = get_depth_groups(rec, nrecz, recdipole)
 
-    # The kernel handles only 1 ab with one srcz-recz combination at once.
-    # Hence we have to loop over every different depth of src or rec, and
-    # over all required ab's.
-    for isz in range(nsrcz):  # Loop over source depths
+    # The kernel handles only one srcz-recz combination at once. Hence we have
+    # to loop over every different depth of src or rec; all poles at the same
+    # depth are computed at once. All required ab's are computed at once,
+    # sharing the Green's functions (DLF).
+    for sgroup in src_groups:  # Loop over source depths
 
-        # Get this source
-        srcazmdip = get_azm_dip(src, isz, nsrcz, 1, srcdipole, strength,
+        # Get these sources
+        srcazmdip = get_azm_dip(src, sgroup, nsrcz, 1, srcdipole, strength,
                                 'src', verb)
         tsrc, srcazm, srcdip, _, _, src_w = srcazmdip
 
-        for irz in range(nrecz):  # Loop over receiver depths
+        for rgroup in rec_groups:  # Loop over receiver depths
 
-            # Get this receiver
-            recazmdip = get_azm_dip(rec, irz, nrecz, recpts, recdipole,
+            # Get these receivers
+            recazmdip = get_azm_dip(rec, rgroup, nrecz, recpts, recdipole,
                                     strength, 'rec', verb)
             trec, recazm, recdip, recg_w, recpts, rec_w = recazmdip
 
+            # Number of sources, receivers, and src-rec pairs in this group
+            isrc = sgroup.size
+            irec = rgroup.size
+            isrz = isrc*irec
+
             # Get required ab's
             ab_calc = get_abs(True, mrec, srcazm, srcdip, recazm, recdip, verb)
 
-            # Get layer number in which src resides
-            lsrc, zsrc = get_layer_nr(tsrc, depth)
+            # Get layer number in which src resides (same for the group)
+            lsrc, zsrc = get_layer_nr([tsrc[0], tsrc[1], tsrc[2][0]], depth)
 
             # Check mu at source level.
             if verb > 0 and mpermH[lsrc] != mpermV[lsrc]:
@@ -1139,13 +1569,20 @@ def loop(src, rec, depth, res, freqtime, signal=None, aniso=None, epermH=None,
                         etaH, etaV, zetaH, zetaV, xdirect, isfullspace, ht,
                         htarg, True, mrec, loop_freq, loop_off, conv)
 
+                # Carry-out the frequency-domain calculation for all required
+                # ab's at once
+                out = fem(ab_calc, *finp, truncate)
+
+                # Update kernel count
+                kcount += out[1]
+
+                # Update conv (QWE convergence)
+                conv *= out[2]
+
                 # Pre-allocate temporary EM array for ab-loop
                 abEM = np.zeros((freq.size, isrz), dtype=etaH.dtype)
 
-                for iab in ab_calc:  # Loop over required ab's
-
-                    # Carry-out the frequency-domain calculation
-                    out = fem(iab, *finp)
+                for i, iab in enumerate(ab_calc):  # Loop over required ab's
 
                     # Get geometrical scaling factor, broadcast to (irec, isrc)
                     tfact = np.ones((irec, isrc))*get_geo_fact(
@@ -1153,13 +1590,7 @@ def loop(src, rec, depth, res, freqtime, signal=None, aniso=None, epermH=None,
                     )
 
                     # Add field to EM with geometrical factor
-                    abEM += out[0]*tfact.ravel('F')
-
-                    # Update kernel count
-                    kcount += out[1]
-
-                    # Update conv (QWE convergence)
-                    conv *= out[2]
+                    abEM += out[0][i]*tfact.ravel('F')
 
                 # Add this receiver element, with weight from integration
                 rEM += abEM*recg_w[irg]
@@ -1171,26 +1602,18 @@ def loop(src, rec, depth, res, freqtime, signal=None, aniso=None, epermH=None,
                 src_rec_w *= np.tile(rec_w, isrc)
             rEM *= src_rec_w
 
+            # Multiplication with frequency-dependent loop factors of the
+            # layers in which this src and rec reside.
+            rEM *= zetaH[:, lsrc, None]
+            if rec_loop:
+                rEM *= zetaH[:, lrec, None]
+
             # Add this src-rec signal
-            if nrec == nrecz:
-                if nsrc == nsrcz:  # Case 1: Looped over each src and each rec
-                    EM[:, isz*nrec+irz:isz*nrec+irz+1] = rEM
-                else:              # Case 2: Looped over each rec
-                    EM[:, irz:nsrc*nrec:nrec] = rEM
-            else:
-                if nsrc == nsrcz:  # Case 3: Looped over each src
-                    EM[:, isz*nrec:nrec*(isz+1)] = rEM
-                else:              # Case 4: All in one go
-                    EM = rEM
+            EM[:, (sgroup[:, None]*nrec + rgroup).ravel()] = rEM
 
     # In case of QWE/QUAD, print Warning if not converged
     conv_warning(conv, htarg, 'Hankel', verb)
 
-    # Multiplication with frequency-dependent loop factors.
-    EM *= zetaH[:, lsrc, None]
-    if rec_loop:
-        EM *= zetaH[:, lrec, None]
-
     # Do f->t transform if required
     if signal is not None:
         EM, conv = tem(EM, EM[0, :], freq, time, signal, ft, ftarg)
@@ -1419,6 +1842,7 @@ def analytical(src, rec, res, freqtime, solution='fs', signal=None, ab=11,
     check_solution(solution, signal, ab, msrc, mrec)
 
     # === 3. EM-FIELD CALCULATION ============
+    kernel._profile_stop('check', t0)
 
     if solution[0] == 'd':
         # To make it work with Laplace domain calculations.
@@ -1712,6 +2136,7 @@ def dipole_k(src, rec, depth, res, freq, wavenumber, ab=11, aniso=None,
     lrec, zrec = get_layer_nr(rec, depth)
 
     # === 3. EM-FIELD CALCULATION ============
+    kernel._profile_stop('check', t0)
 
     # Pre-allocate
     if off.size == 1 and np.ndim(wavenumber) == 2:
@@ -1862,7 +2287,7 @@ def ip_and_q(**kwargs):
 
 def fem(ab, off, angle, zsrc, zrec, lsrc, lrec, depth, freq, etaH, etaV, zetaH,
         zetaV, xdirect, isfullspace, ht, htarg, msrc, mrec, loop_freq,
-        loop_off, conv=True):
+        loop_off, conv=True, truncate=0.0):
     r"""Return electromagnetic frequency-domain response.
 
     This function is called from one of the modelling routines
@@ -1873,24 +2298,62 @@ def fem(ab, off, angle, zsrc, zrec, lsrc, lrec, depth, freq, etaH, etaV, zetaH,
     the correct format. This is useful for inversion routines and similar, as
     it can speed-up the calculation by omitting input-checks.
 
+    `ab` can be a single source-receiver configuration, or a list of several
+    configurations which share `msrc` and `mrec`. In the latter case `fEM` has
+    shape `(nab, nfreq, noff)`, and the DLF computes the Green's functions
+    only once for all of them.
+
+    Similarly, `zsrc` and `zrec` can be a single depth pair, or arrays of
+    several depth pairs, where all sources are in layer `lsrc` and all
+    receivers in layer `lrec`. In the latter case `fEM` has an additional
+    first dimension of the size of the pairs, and the DLF computes the
+    reflection coefficients only once for all of them (see
+    :func:`empymod.kernel.wavenumber_pairs`).
+
+    If `truncate` > 0, the layers many skin depths below both sources and
+    receivers are removed for each frequency (see
+    :func:`empymod.utils.get_nlayer_truncated`); the frequencies with the same
+    number of remaining layers are computed together.
+
     """
+    t0 = kernel._profile_start()
+
+    # <ab> can be a single or a list of several source-receiver
+    # configurations; the latter share `msrc` and `mrec`.
+    ab_calc = np.atleast_1d(ab)
+
+    # <zsrc>, <zrec> can be a single or several depth pairs; the latter share
+    # `lsrc` and `lrec`.
+    pairs = np.ndim(zsrc) > 0 or np.ndim(zrec) > 0
+    if pairs:
+        zsrc, zrec = np.broadcast_arrays(zsrc, zrec)
+        zpairs = list(zip(zsrc, zrec))
+    else:
+        zpairs = [(zsrc, zrec)]
+
     # Preallocate array
-    fEM = np.zeros((freq.size, off.size), dtype=etaH.dtype)
+    fEM = np.zeros((len(zpairs), ab_calc.size, freq.size, off.size),
+                   dtype=etaH.dtype)
 
     # Initialize kernel count
     # (how many times the wavenumber-domain kernel was calld)
     kcount = 0
 
     # If <ab> = 36 (or 63), fEM-field is zero
-    if ab in [36, ]:
-        return fEM, kcount, conv
+    icalc = np.nonzero(ab_calc != 36)[0]
 
     # Get full-space-solution if xdirect=True and model is a full-space or
     # if src and rec are in the same layer.
+    # (Always in double precision, as its terms cancel for small offsets.)
     if xdirect and (isfullspace or lsrc == lrec):
-        fEM += kernel.fullspace(off, angle, zsrc, zrec, etaH[:, lrec],
-                                etaV[:, lrec], zetaH[:, lrec], zetaV[:, lrec],
-                                ab, msrc, mrec)
+        dtype = np.promote_types(etaH.dtype, np.float64)
+        for ip, (tzsrc, tzrec) in enumerate(zpairs):
+            for i in icalc:
+                fEM[ip, i] += kernel.fullspace(
+                    off, angle, tzsrc, tzrec, etaH[:, lrec].astype(dtype),
+                    etaV[:, lrec].astype(dtype), zetaH[:, lrec].astype(dtype),
+                    zetaV[:, lrec].astype(dtype), ab_calc[i], msrc, mrec
+                )
 
     # If `xdirect = None` we set it here to True, so it is NOT calculated in
     # the wavenumber domain. (Only reflected fields are returned.)
@@ -1900,39 +2363,89 @@ def fem(ab, off, angle, zsrc, zrec, lsrc, lrec, depth, freq, etaH, etaV, zetaH,
         xdir = xdirect
 
     # If not full-space with xdirect calculate fEM-field
-    if not isfullspace*xdir:
+    if not isfullspace*xdir and icalc.size > 0:
 
-        # Get angle dependent factors
-        ang_fact = kernel.angle_factor(angle, ab, msrc, mrec)
+        # Get angle dependent factors (precomputed if a plan is provided)
+        if htarg.get('plan', None) is not None:
+            angle_factor = htarg['plan'].angle_factor
+        else:
+            angle_factor = kernel.angle_factor
+        ang_fact = [angle_factor(angle, ab_calc[i], msrc, mrec)
+                    for i in icalc]
+
+        # The DLF computes the kernel once for all <ab>'s (which share the
+        # Green's functions) and all depth pairs (which share the
+        # reflections); QWE and QUAD carry them out one by one.
+        if ht == 'dlf' and (icalc.size > 1 or pairs):
+            groups = [(icalc, ab_calc[icalc], np.array(ang_fact))]
+            zgroups = [(slice(None), zsrc, zrec)]
+        else:
+            groups = [([i], ab_calc[i], iang_fact)
+                      for i, iang_fact in zip(icalc, ang_fact)]
+            zgroups = [(ip, *zpair) for ip, zpair in enumerate(zpairs)]
+
+        # Skin-depth truncation of deep layers: group the frequencies by
+        # their number of remaining layers
+        nlayer = get_nlayer_truncated(depth, zsrc, zrec, etaH, zetaH, truncate)
+        if np.all(nlayer == depth.size):
+            fgroups = [(slice(None), depth.size)]
+        else:
+            fgroups = [(np.nonzero(nlayer == n)[0], n)
+                       for n in np.unique(nlayer)]
 
         calc = getattr(transform, 'hankel_'+ht)
-        if loop_freq:
-
-            for i in range(freq.size):
-                out = calc(zsrc, zrec, lsrc, lrec, off, ang_fact, depth, ab,
-                           etaH[None, i, :], etaV[None, i, :],
-                           zetaH[None, i, :], zetaV[None, i, :], xdir,
-                           htarg, msrc, mrec)
-                fEM[None, i, :] += out[0]
-                kcount += out[1]
-                conv *= out[2]
+        for ifreq, nl in fgroups:
+
+            # Model of this frequency group (truncated: last layer extends to
+            # infinity)
+            tdepth = depth[:nl]
+            tetaH, tetaV = etaH[ifreq, :nl], etaV[ifreq, :nl]
+            tzetaH, tzetaV = zetaH[ifreq, :nl], zetaV[ifreq, :nl]
+            tfEM = fEM[:, :, ifreq]
+
+            for (ip, tzsrc, tzrec), (iab, tab, tang_fact) in product(
+                    zgroups, groups):
+                if loop_freq:
+
+                    for i in range(tetaH.shape[0]):
+                        out = calc(tzsrc, tzrec, lsrc, lrec, off, tang_fact,
+                                   tdepth, tab, tetaH[None, i, :],
+                                   tetaV[None, i, :], tzetaH[None, i, :],
+                                   tzetaV[None, i, :], xdir, htarg, msrc,
+                                   mrec)
+                        tfEM[ip, iab, i:i+1, :] += out[0]
+                        kcount += out[1]
+                        conv *= out[2]
 
-        elif loop_off:
-            for i in range(off.size):
+                elif loop_off:
+                    for i in range(off.size):
 
-                out = calc(zsrc, zrec, lsrc, lrec, off[None, i],
-                           ang_fact[None, i], depth, ab, etaH, etaV, zetaH,
-                           zetaV, xdir, htarg, msrc, mrec)
-                fEM[:, None, i] += out[0]
-                kcount += out[1]
-                conv *= out[2]
-        else:
-            out = calc(zsrc, zrec, lsrc, lrec, off, ang_fact, depth, ab, etaH,
-                       etaV, zetaH, zetaV, xdir, htarg, msrc, mrec)
-            fEM += out[0]
-            kcount += out[1]
-            conv *= out[2]
+                        out = calc(tzsrc, tzrec, lsrc, lrec, off[None, i],
+                                   tang_fact[..., None, i], tdepth, tab,
+                                   tetaH, tetaV, tzetaH, tzetaV, xdir, htarg,
+                                   msrc, mrec)
+                        tfEM[ip, iab, :, i:i+1] += out[0]
+                        kcount += out[1]
+                        conv *= out[2]
+                else:
+                    out = calc(tzsrc, tzrec, lsrc, lrec, off, tang_fact,
+                               tdepth, tab, tetaH, tetaV, tzetaH, tzetaV,
+                               xdir, htarg, msrc, mrec)
+                    tfEM[ip, iab] += out[0]
+                    kcount += out[1]
+                    conv *= out[2]
 
+            # Store this frequency group (tfEM is a copy if truncated)
+            fEM[:, :, ifreq] = tfEM
+
+    # Remove the pair-dimension if a single depth pair was provided, and the
+    # <ab>-dimension if a single <ab> was provided
+    if not pairs:
+        fEM = fEM[0]
+    if np.ndim(ab) == 0:
+        fEM = fEM[..., 0, :, :]
+
+    kernel._profile_stop('fem', t0)
     return fEM, kcount, conv
 
 
@@ -1948,6 +2461,8 @@ def tem(fEM, off, freq, time, signal, ft, ftarg, conv=True):
     it can speed-up the calculation by omitting input-checks.
 
     """
+    t0 = kernel._profile_start()
+
     # 1. Scale frequencies if switch-on/off response
     # Step function for causal times is like a unit fct, therefore an impulse
     # in frequency domain
@@ -1959,10 +2474,11 @@ def tem(fEM, off, freq, time, signal, ft, ftarg, conv=True):
 
     # 2. f->t transform
     calc = getattr(transform, 'fourier_'+ft)
-    tEM = np.zeros((time.size, off.size))
+    tEM = np.zeros((time.size, off.size), dtype=fEM.real.dtype)
     for i in range(off.size):
         out = calc(fEM[:, i]*fact, time, freq, ftarg)
         tEM[:, i] += out[0]
         conv *= out[1]
 
+    kernel._profile_stop('fourier', t0)
     return tEM*2/np.pi, conv  # Scaling from Fourier transform
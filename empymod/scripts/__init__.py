@@ -14,6 +14,17 @@
 # License for the specific language governing permissions and limitations under
 # the License.
 
-from empymod.scripts import tmtemod, fdesign
+import importlib
 
 __all__ = ['tmtemod', 'fdesign']
+
+
+def __getattr__(name):
+    """Import the scripts on first use."""
+    if name in __all__:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return __all__
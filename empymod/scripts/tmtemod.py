@@ -29,13 +29,17 @@ There are important limitations:
 - `ab` == 11                   [=> x-directed el. source & el. receivers]
 - `signal` == None             [=> only frequency domain]
 - `xdirect` == False           [=> direct field calc. in wavenr-domain]
-- `ht` == 'dlf'
-- `htarg` == 'key_201_2012'
-- Options `ft`, `ftarg`, and `loop` are not available.
+- `ht` == 'dlf'                [=> standard, lagged, or splined DLF]
+- Options `ft` and `ftarg` are not available.
 - `lsrc` == `lrec`             [=> src & rec are assumed in same layer!]
 - Model must have more than 1 layer
 - Electric permittivity and magnetic permeability are isotropic.
-- Only one frequency at once.
+
+The wavenumber-domain kernel (:func:`wavenumber`) is compiled with numba; it
+shares Gamma, the reflection coefficients, and the field propagators with
+:func:`empymod.kernel.greenfct`, and computes all ten contributions at once.
+The functions :func:`greenfct` and :func:`fields` are the corresponding
+NumPy-versions of the split Green's functions.
 
 
 Theory
@@ -344,22 +348,31 @@ can use
 # License for the specific language governing permissions and limitations under
 # the License.
 
+from itertools import product
+
+import numba as nb
 import numpy as np
 
-from empymod.filters import Hankel
-from empymod.kernel import reflections, angle_factor
+from empymod.transform import dlf, get_dlf_points
+from empymod.kernel import (reflections, angle_factor, _numba_with_fm, _gamma,
+                            _shared_gamma, _refl_prop)
 from empymod.utils import (check_model, check_frequency, check_dipole, _strvar,
-                           get_off_ang, get_layer_nr, printstartfinish)
+                           check_hankel, check_loop, get_off_ang, get_layer_nr,
+                           printstartfinish)
 
 __all__ = ['dipole']
 
+# Factors of the J0- and J1-parts of the split Green's functions for ab=11
+_fact_j0 = 1/(8*np.pi)
+_fact_j1 = -1/(4*np.pi)
+
 
 def __dir__():
     return __all__
 
 
 def dipole(src, rec, depth, res, freqtime, aniso=None, eperm=None, mperm=None,
-           verb=2):
+           verb=2, htarg=None, loop=None):
     r"""Return the electromagnetic field due to a dipole source.
 
     This is a modified version of :func:`empymod.model.dipole`. It returns the
@@ -385,9 +398,9 @@ def dipole(src, rec, depth, res, freqtime, aniso=None, eperm=None, mperm=None,
     res : array_like
         Horizontal resistivities rho_h (Ohm.m); #res = #depth + 1.
 
-    freqtime : float
-        Frequency f (Hz). (The name `freqtime` is kept for consistency with
-        :func:`empymod.model.dipole`. Only one frequency at once.
+    freqtime : array_like
+        Frequencies f (Hz). (The name `freqtime` is kept for consistency with
+        :func:`empymod.model.dipole`.)
 
     aniso : array_like, optional
         Anisotropies lambda = sqrt(rho_v/rho_h) (-); #aniso = #res.
@@ -410,6 +423,16 @@ def dipole(src, rec, depth, res, freqtime, aniso=None, eperm=None, mperm=None,
         - 3: Print additional start/stop, condensed parameter information.
         - 4: Print additional full parameter information
 
+    htarg : dict, optional
+        Arguments of the DLF Hankel transform, see
+        :func:`empymod.model.bipole`; only `dlf` (default: ``'key_201_2012'``)
+        and `pts_per_dec` (default: 0, standard DLF; <0: lagged convolution
+        DLF; >0: splined DLF) are used.
+
+    loop : {None, 'freq', 'off'}, optional
+        Loop over frequencies or offsets, see :func:`empymod.model.bipole`;
+        default is None (all vectorized).
+
 
     Returns
     -------
@@ -462,52 +485,50 @@ def dipole(src, rec, depth, res, freqtime, aniso=None, eperm=None, mperm=None,
         raise ValueError("model must have more than one layer; "
                          f"<depth> provided: {_strvar(depth[1:])}.")
 
-    if freq.size > 1:                          # only 1 frequency
-        raise ValueError("only one frequency permitted; "
-                         f"<freqtime> provided: {_strvar(freqtime)}.")
+    # Check Hankel transform parameters (DLF; default filter key_201_2012)
+    _, htarg = check_hankel(
+            'dlf', {'dlf': 'key_201_2012', **({} if htarg is None else htarg)},
+            verb)
+
+    # Check loop
+    loop_freq, loop_off = check_loop(loop, 'dlf', htarg, verb)
 
     # === 3. EM-FIELD CALCULATION ============
     # This part is a simplification of:
     # - model.fem()
-    # - transform.dlf()
+    # - transform.hankel_dlf()
     # - kernel.wavenumber()
 
-    # DLF filter we use
-    filt = Hankel().key_201_2012
-
-    # 3.1. COMPUTE REQUIRED LAMBDAS for given hankel-filter-base
-    lambd = filt.base/off[:, None]
-
-    # 3.2. CALL THE KERNEL
-    PTM, PTE = greenfct(zsrc, zrec, lsrc, lrec, depth, etaH, etaV, zetaH,
-                        zetaV, lambd)
-
-    # 3.3. CARRY OUT THE HANKEL TRANSFORM WITH DLF
+    # 3.1. CALL THE KERNEL AND CARRY OUT THE HANKEL TRANSFORM WITH DLF
+    # All ten contributions at once; TM [uu, ud, du, dd, df] and
+    # TE [uu, ud, du, dd, df] stacked along the first dimension.
     ang_fact = angle_factor(ang, 11, False, False)
-    zm_ang_fact = (ang_fact[:, np.newaxis]-1)/2
-    zp_ang_fact = (ang_fact[:, np.newaxis]+1)/2
-    fact = 4*np.pi*off
-
-    # TE [uu, ud, du, dd, df]
-    for i, val in enumerate(PTE):
-        PTE[i] = (ang_fact*np.dot(-val, filt.j1)/off +
-                  np.dot(zm_ang_fact*val*lambd, filt.j0))/fact
-
-    # TM [uu, ud, du, dd, df]
-    for i, val in enumerate(PTM):
-        PTM[i] = (ang_fact*np.dot(-val, filt.j1)/off +
-                  np.dot(zp_ang_fact*val*lambd, filt.j0))/fact
-
-    # 3.4. Remove non-physical contributions
+    PT = np.zeros((10, freq.size, off.size), dtype=etaH.dtype)
+    ifreqs = [slice(i, i+1) for i in range(freq.size)] if loop_freq else [
+            slice(None)]
+    ioffs = [slice(i, i+1) for i in range(off.size)] if loop_off else [
+            slice(None)]
+    for ifreq, ioff in product(ifreqs, ioffs):
+        lambd, int_pts = get_dlf_points(
+                htarg['dlf'], off[ioff], htarg['pts_per_dec'])
+        PJ = wavenumber(zsrc, zrec, lsrc, lrec, depth, etaH[ifreq],
+                        etaV[ifreq], zetaH[ifreq], zetaV[ifreq], lambd)
+        out = dlf(PJ, lambd, off[ioff], htarg['dlf'], htarg['pts_per_dec'],
+                  ang_fact=ang_fact[ioff], ab=11, int_pts=int_pts)
+        PT[:, ifreq, ioff] = out.reshape(PT[:, ifreq, ioff].shape)
+    PTM, PTE = list(PT[:5]), list(PT[5:])
+
+    # 3.2. Remove non-physical contributions
 
     # (Note: The T*dd corrections differ slightly from the equations given in
     # the accompanying pdf, due to the way the direct field is accounted for
     # in the book.)
 
-    # General parameters
+    # General parameters; (frequency, offset)
     Gam = np.sqrt((zetaH*etaH)[:, None, :, None])  # Gam for lambd=0
     iGam = Gam[:, :, lsrc, 0]
-    lgam = np.sqrt(zetaH[:, lsrc]*etaH[:, lsrc])
+    lgam = np.sqrt(zetaH[:, lsrc, None]*etaH[:, lsrc, None])
+    fact = 4*np.pi*off
     ddepth = np.r_[depth, np.inf]
     ds = ddepth[lsrc+1] - ddepth[lsrc]
 
@@ -528,7 +549,7 @@ def dipole(src, rec, depth, res, freqtime, aniso=None, eperm=None, mperm=None,
 
         # Calculate reverberation M and general factor npfct
         Ms = 1 - Rp*Rm*np.exp(-2*iGam*ds)
-        npfct = ang_fact*zetaH[:, lsrc]/(fact*off*lgam*Ms)
+        npfct = ang_fact*zetaH[:, lsrc, None]/(fact*off*lgam*Ms)
 
         return Rp, Rm, npfct
 
@@ -548,7 +569,7 @@ def dipole(src, rec, depth, res, freqtime, aniso=None, eperm=None, mperm=None,
     PTM[2] += npfct*Rm*np.exp(-lgam*(zrec + zsrc))
     PTM[3] -= npfct*Rp*Rm*np.exp(-lgam*(2*ds + zrec - zsrc))
 
-    # 3.5 Reshape for number of sources
+    # 3.3 Reshape for number of sources
     for i, val in enumerate(PTE):
         PTE[i] = np.squeeze(val.reshape((-1, nrec, nsrc), order='F'))
 
@@ -562,11 +583,158 @@ def dipole(src, rec, depth, res, freqtime, aniso=None, eperm=None, mperm=None,
     return PTM, PTE
 
 
+@nb.njit(**_numba_with_fm)
+def wavenumber(zsrc, zrec, lsrc, lrec, depth, etaH, etaV, zetaH, zetaV, lambd):
+    r"""Calculate wavenumber domain solution for TM and TE, split.
+
+    This is a modified version of :func:`empymod.kernel.wavenumber` for
+    `ab=11`, `xdirect=False`, and `lsrc=lrec`, and with at least two layers.
+    Gamma, the reflection coefficients, and the field propagators are computed
+    by the same functions as in :func:`empymod.kernel.greenfct`, once for TM
+    and TE (Gamma is shared by TM and TE if they are the same).
+
+    Returns PJ0, PJ1, and PJ0b of shape (10, nfreq, noff, nlambda), for
+    [TM--, TM-+, TM+-, TM++, TMdirect, TE--, TE-+, TE+-, TE++, TEdirect], to
+    be transformed with :func:`empymod.transform.dlf` with `ab=11`.
+
+    """
+    nfreq, nlayer = etaH.shape
+    noff, nlambda = lambd.shape
+
+    # Pre-allocate
+    PJ0 = np.zeros((10, nfreq, noff, nlambda), etaH.dtype)
+    PJ1 = np.zeros_like(PJ0)
+    PJ0b = np.zeros_like(PJ0)
+    Gam = np.zeros((nfreq, noff, 0, nlambda), etaH.dtype)
+
+    # Gamma is the same for TM and TE if isotropic and non-magnetic
+    shared = _shared_gamma(etaH, etaV, zetaH, zetaV)
+
+    for TM in [True, False]:
+
+        # Define eta/zeta depending if TM or TE
+        if TM:
+            e_zH, e_zV, z_eH = etaH, etaV, zetaH   # TM: zetaV not used
+        else:
+            e_zH, e_zV, z_eH = zetaH, zetaV, etaH  # TE: etaV not used
+
+        # Gamma (re-use the one of TM if it is the same)
+        if TM or not shared:
+            Gam = _gamma(e_zH, e_zV, z_eH, lambd)
+
+        # Reflections and field propagators
+        Rp, Rm, Wu, Wd = _refl_prop(depth, zrec, lsrc, lrec, e_zH, Gam)
+
+        # Field at rec level (coming from below (Pu) and above (Pd) rec)
+        Puu, Pud, Pdu, Pdd = _fields_split(depth, Rp, Rm, Gam, lsrc, zsrc, TM)
+
+        # Green's functions times the factors of TM and TE, split into the
+        # J0-part (PJ0; cos(2phi) independent), and the J0- and J1-parts of
+        # the angle-dependent J2 (PJ0b, PJ1), in the order of ab=11.
+        if TM:
+            i0, sign = 0, 1.0
+        else:
+            i0, sign = 5, -1.0
+        dz = abs(zsrc - zrec)
+        for i in range(nfreq):
+            ietaH = 1/etaH[i, lsrc]
+            for ii in range(noff):
+                for iv in range(nlambda):
+                    iGam = Gam[i, ii, lsrc, iv]
+                    if TM:
+                        fact = iGam*ietaH
+                    else:
+                        fact = zetaH[i, lsrc]/iGam
+                    wu = Wu[i, ii, iv]*fact
+                    wd = Wd[i, ii, iv]*fact
+                    green = (Puu[i, ii, iv]*wu, Pud[i, ii, iv]*wu,
+                             Pdu[i, ii, iv]*wd, Pdd[i, ii, iv]*wd,
+                             -sign*np.exp(-iGam*dz)*fact)
+                    tlambd = lambd[ii, iv]*_fact_j0
+                    for k in range(5):
+                        PJ0b[i0+k, i, ii, iv] = green[k]*tlambd
+                        PJ0[i0+k, i, ii, iv] = sign*PJ0b[i0+k, i, ii, iv]
+                        PJ1[i0+k, i, ii, iv] = green[k]*_fact_j1
+
+    return PJ0, PJ1, PJ0b
+
+
+@nb.njit(**_numba_with_fm)
+def _fields_split(depth, Rp, Rm, Gam, lsrc, zsrc, TM):
+    r"""Calculate Pu+, Pu-, Pd+, Pd-.
+
+    This is the compiled version of :func:`fields`, for :func:`wavenumber`.
+
+    """
+    nfreq, noff, nlayer, nlambda = Gam.shape
+
+    # Pre-allocate
+    Puu = np.zeros((nfreq, noff, nlambda), Gam.dtype)
+    Pud = np.zeros_like(Puu)
+    Pdu = np.zeros_like(Puu)
+    Pdd = np.zeros_like(Puu)
+
+    # Booleans if src in first or last layer
+    first_layer = lsrc == 0
+    last_layer = lsrc == nlayer-1
+
+    # Depths
+    dm = zsrc-depth[lsrc]
+    if last_layer:
+        ds = dp = 0.0
+    else:
+        ds = depth[lsrc+1]-depth[lsrc]
+        dp = depth[lsrc+1]-zsrc
+
+    # Sign-switch: minus for TM, plus for TE
+    pm = -1.0 if TM else 1.0
+
+    # Calculate down- and up-going fields
+    for up in [False, True]:
+
+        # No upgoing field if src/rec in last layer, no downgoing field if
+        # src/rec in first layer.
+        if (up and last_layer) or (not up and first_layer):
+            continue
+
+        # Swaps if up=True
+        if up:
+            tdp, tdm, Rmp, Rpm, tlast = dm, dp, Rp, Rm, first_layer
+        else:
+            tdp, tdm, Rmp, Rpm, tlast = dp, dm, Rm, Rp, last_layer
+
+        # Calculate Pu+, Pu-, Pd+, Pd-; rec in src layer; Eqs  81/82, A-8/A-9
+        for i in range(nfreq):
+            for ii in range(noff):
+                for iv in range(nlambda):
+                    iGam = Gam[i, ii, lsrc, iv]
+                    rmp = Rmp[i, ii, 0, iv]
+                    if tlast:  # If src/rec are in top (up) or bottom (down)
+                        Pd = rmp*np.exp(-iGam*tdm)
+                        Pu = 0.0*Pd
+                    else:      # If src and rec are in any layer in between
+                        rpm = Rpm[i, ii, 0, iv]
+                        rmp /= 1 - rmp*rpm*np.exp(-2*iGam*ds)  # R/Ms
+                        Pd = rmp*np.exp(-iGam*tdm)
+                        Pu = rmp*pm*rpm*np.exp(-iGam*(ds+tdp))
+
+                    # Store P's
+                    if up:
+                        Puu[i, ii, iv] = Pu
+                        Pud[i, ii, iv] = Pd
+                    else:
+                        Pdu[i, ii, iv] = Pd
+                        Pdd[i, ii, iv] = Pu
+
+    return Puu, Pud, Pdu, Pdd
+
+
 def greenfct(zsrc, zrec, lsrc, lrec, depth, etaH, etaV, zetaH, zetaV, lambd):
     r"""Calculate Green's function for TM and TE.
 
     This is a modified version of empymod.kernel.greenfct(). See the original
-    version for more information.
+    version for more information. This NumPy-version is not used by
+    :func:`dipole` (which uses the compiled :func:`wavenumber`).
 
     """
     # GTM/GTE have shape (frequency, offset, lambda).
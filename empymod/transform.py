@@ -35,7 +35,8 @@ from empymod import kernel
 
 __all__ = ['hankel_dlf', 'hankel_qwe', 'hankel_quad', 'fourier_dlf',
            'fourier_qwe', 'fourier_fftlog', 'fourier_fft', 'dlf', 'qwe',
-           'get_dlf_points', 'get_fftlog_input']
+           'get_dlf_points', 'get_dlf_unique', 'get_dlf_pruned',
+           'get_fftlog_input', 'HankelPlan']
 
 
 def __dir__():
@@ -44,7 +45,20 @@ def __dir__():
 
 def iuSpline(x, y, *args, **kwargs):
     """Wrap in function so it does not affect import speed."""
-    return sp.interpolate.InterpolatedUnivariateSpline(x, y, *args, **kwargs)
+    t0 = kernel._profile_start()
+    out = sp.interpolate.InterpolatedUnivariateSpline(x, y, *args, **kwargs)
+    kernel._profile_stop('spline', t0)
+    kernel._profile_count('splines', 1)
+    return out
+
+
+def bSpline(x, y, *args, **kwargs):
+    """Wrap in function so it does not affect import speed."""
+    t0 = kernel._profile_start()
+    out = sp.interpolate.make_interp_spline(x, y, *args, **kwargs)
+    kernel._profile_stop('spline', t0)
+    kernel._profile_count('splines', 1)
+    return out
 
 
 # 1. Hankel transforms (wavenumber -> frequency)
@@ -92,6 +106,35 @@ def hankel_dlf(zsrc, zrec, lsrc, lrec, off, ang_fact, depth, ab, etaH, etaV,
     :mod:`empymod.model`. Consult these modelling routines for a description of
     the input and output parameters.
 
+    For the standard DLF (``pts_per_dec=0``) the wavenumber-domain kernel is
+    only evaluated for the unique lambdas (see :func:`get_dlf_unique`), which
+    reduces the work substantially for repeated offsets or offsets which are
+    related by the filter spacing factor (e.g., receivers on a log grid).
+
+    With ``htarg['kernel']='fused'`` the low-memory kernel
+    :func:`empymod.kernel.wavenumber_fused` is used instead of
+    :func:`empymod.kernel.wavenumber`.
+
+    The kernel is run with the number of threads set by
+    :func:`empymod.kernel.set_num_threads` (default: 1).
+
+    `ab` can also be a list of several source-receiver configurations (with
+    the corresponding list of `ang_fact`), which share `msrc` and `mrec`. The
+    wavenumber-domain kernel is then computed only once for all of them (see
+    :func:`empymod.kernel.wavenumber_multi`), and `fEM` has an additional first
+    dimension of the size of `ab`.
+
+    Similarly, `zsrc` and `zrec` can be arrays of several depth pairs in the
+    same layers `lsrc` and `lrec`. The reflection coefficients are then
+    computed only once for all of them (see
+    :func:`empymod.kernel.wavenumber_pairs`), and `fEM` has an additional
+    first dimension of the size of the pairs (before the one of `ab`).
+
+    With ``htarg['cache']`` (a :class:`empymod.kernel.ReflectionCache`) Gamma
+    and the reflection coefficients are updated incrementally from the ones of
+    the previous call, recomputing only the parts affected by changed layers.
+    The kernel is then run single-threaded, as the cache is stateful.
+
     Returns
     -------
     fEM : array
@@ -105,16 +148,150 @@ def hankel_dlf(zsrc, zrec, lsrc, lrec, off, ang_fact, depth, ab, etaH, etaV,
 
     """
 
-    # Compute required lambdas for given Hankel-filter-base
-    lambd, int_pts = get_dlf_points(htarg['dlf'], off, htarg['pts_per_dec'])
+    # Compute required lambdas for given Hankel-filter-base (precomputed if a
+    # plan is provided)
+    plan = htarg.get('plan', None)
+    if plan is not None:
+        lambd, int_pts, klambd, ilambd = plan.points(off)
+    else:
+        lambd, int_pts, klambd, ilambd = _dlf_points(htarg, off)
+    prune = htarg.get('prune', 0)
+
+    # Several depth pairs, which share lsrc and lrec
+    pairs = np.ndim(zsrc) > 0 or np.ndim(zrec) > 0
+    if pairs:
+        zsrc, zrec = np.broadcast_arrays(zsrc, zrec)
+
+    # Pruning: skip the lambdas where the kernel is negligible (for all pairs)
+    keep = None
+    if prune > 0:
+        keep = np.any([
+            get_dlf_pruned(klambd[0], zs, zr, lsrc, lrec, depth, etaH, etaV,
+                           zetaH, zetaV, xdirect, prune)
+            for zs, zr in zip(np.atleast_1d(zsrc), np.atleast_1d(zrec))
+        ], axis=0)
+        if keep.all():
+            keep = None
+        else:
+            klambd = klambd[:, keep]
+
+    def gather(PJ):
+        """Gather the kernel of the unique lambdas for each offset."""
+        PJ = list(PJ)
+        for i, iPJ in enumerate(PJ):
+            if iPJ is None:
+                continue
+            if keep is not None:  # Skipped lambdas are zero
+                PJ[i] = np.zeros((*iPJ.shape[:-1], keep.size), iPJ.dtype)
+                PJ[i][..., keep] = iPJ
+            if ilambd is not None:
+                PJ[i] = PJ[i][:, 0, ilambd].reshape((-1, *lambd.shape))
+        return tuple(PJ)
+
+    # The kernel computes in the precision of eta/zeta (double or single);
+    # provide lambdas, depths, and src/rec depths in the same precision.
+    rtype = etaH.real.dtype
+    klambd = klambd.astype(rtype, copy=False)
+    depth = depth.astype(rtype, copy=False)
+    zsrc = np.asarray(zsrc, dtype=rtype)
+    zrec = np.asarray(zrec, dtype=rtype)
+
+    # Low-memory kernel, looping over each frequency-offset pair
+    fused = htarg.get('kernel', 'default') == 'fused'
+
+    # Incremental reflections (stateful, hence not threaded)
+    cache = htarg.get('cache', None)
+
+    # Work counters (profile)
+    npairs = zsrc.size
+    kernel._profile_count('lambdas', npairs*etaH.shape[0]*klambd.size)
+    kernel._profile_count('kernel_size_max',
+                          etaH.shape[0]*klambd.size*depth.size, maximum=True)
+    t0 = kernel._profile_start()
+
+    # Several depth pairs: call the kernel once for all of them and all ab's
+    # (the fused kernel once for each of them); carry out the dlf for each ab,
+    # with the pairs stacked along the frequency dimension
+    if pairs:
+        abs_calc = np.atleast_1d(ab)
+        if fused:
+            PJ = [[kernel.call_threaded(
+                kernel.wavenumber_fused, zs, zr, lsrc, lrec, depth, etaH,
+                etaV, zetaH, zetaV, klambd, iab, xdirect, msrc, mrec)
+                for iab in abs_calc] for zs, zr in zip(zsrc, zrec)]
+        elif cache is not None:
+            PJ = kernel.wavenumber_pairs(
+                zsrc, zrec, lsrc, lrec, depth, etaH, etaV, zetaH, zetaV,
+                klambd, list(abs_calc), xdirect, msrc, mrec, cache)
+        else:
+            PJ = kernel.call_threaded(
+                kernel.wavenumber_pairs, zsrc, zrec, lsrc, lrec, depth, etaH,
+                etaV, zetaH, zetaV, klambd, list(abs_calc), xdirect, msrc,
+                mrec)
+        kernel._profile_stop('kernel', t0)
+        ang_facts = ang_fact if np.ndim(ab) > 0 else [ang_fact]
+        fEM = np.zeros((zsrc.size, abs_calc.size, etaH.shape[0], off.size),
+                       dtype=etaH.dtype)
+        for i, (iang_fact, iab) in enumerate(zip(ang_facts, abs_calc)):
+            iPJ = [gather(pPJ[i]) for pPJ in PJ]
+            iPJ = tuple(None if tPJ is None else
+                        np.concatenate([pPJ[ii] for pPJ in iPJ])
+                        for ii, tPJ in enumerate(iPJ[0]))
+            fEM[:, i] = dlf(iPJ, lambd, off, htarg['dlf'],
+                            htarg['pts_per_dec'], ang_fact=iang_fact, ab=iab,
+                            int_pts=int_pts, plan=plan
+                            ).reshape(fEM[:, i].shape)
+
+        if np.ndim(ab) == 0:
+            fEM = fEM[:, 0]
+
+        return fEM, 1, True
+
+    # Several ab's: call the kernel once for all of them (the fused kernel
+    # once for each of them), carry out the dlf for each of them
+    if np.ndim(ab) > 0:
+        if fused:
+            PJ = [kernel.call_threaded(
+                kernel.wavenumber_fused, zsrc, zrec, lsrc, lrec, depth, etaH,
+                etaV, zetaH, zetaV, klambd, iab, xdirect, msrc, mrec)
+                for iab in ab]
+        elif cache is not None:
+            PJ = kernel.wavenumber_multi(
+                zsrc, zrec, lsrc, lrec, depth, etaH, etaV, zetaH, zetaV,
+                klambd, ab, xdirect, msrc, mrec, cache)
+        else:
+            PJ = kernel.call_threaded(
+                kernel.wavenumber_multi, zsrc, zrec, lsrc, lrec, depth, etaH,
+                etaV, zetaH, zetaV, klambd, ab, xdirect, msrc, mrec)
+        kernel._profile_stop('kernel', t0)
+        PJ = [gather(iPJ) for iPJ in PJ]
+        fEM = np.array([
+            dlf(iPJ, lambd, off, htarg['dlf'], htarg['pts_per_dec'],
+                ang_fact=iang_fact, ab=iab, int_pts=int_pts, plan=plan)
+            for iPJ, iang_fact, iab in zip(PJ, ang_fact, ab)
+        ])
+
+        return fEM, 1, True
 
     # Call the kernel
-    PJ = kernel.wavenumber(zsrc, zrec, lsrc, lrec, depth, etaH, etaV, zetaH,
-                           zetaV, lambd, ab, xdirect, msrc, mrec)
+    if fused:
+        wavenumber = kernel.wavenumber_fused
+    else:
+        wavenumber = kernel.wavenumber
+    if cache is not None:
+        PJ = kernel.wavenumber_multi(zsrc, zrec, lsrc, lrec, depth, etaH,
+                                     etaV, zetaH, zetaV, klambd, [ab],
+                                     xdirect, msrc, mrec, cache)[0]
+    else:
+        PJ = kernel.call_threaded(wavenumber, zsrc, zrec, lsrc, lrec, depth,
+                                  etaH, etaV, zetaH, zetaV, klambd, ab,
+                                  xdirect, msrc, mrec)
+    kernel._profile_stop('kernel', t0)
+    PJ = gather(PJ)
 
     # Carry out the dlf
     fEM = dlf(PJ, lambd, off, htarg['dlf'], htarg['pts_per_dec'],
-              ang_fact=ang_fact, ab=ab, int_pts=int_pts)
+              ang_fact=ang_fact, ab=ab, int_pts=int_pts, plan=plan)
 
     return fEM, 1, True
 
@@ -250,11 +427,16 @@ def hankel_qwe(zsrc, zrec, lsrc, lrec, off, ang_fact, depth, ab, etaH, etaV,
         ilambd = np.logspace(start, stop, int((stop-start)*pts_per_dec + 1))
 
     # Call the kernel
+    kernel._profile_count('lambdas', ilambd.size)
+    kernel._profile_count('kernel_size_max', ilambd.size*depth.size,
+                          maximum=True)
+    t0 = kernel._profile_start()
     PJ0, PJ1, PJ0b = kernel.wavenumber(zsrc, zrec, lsrc, lrec, depth,
                                        etaH[None, :], etaV[None, :],
                                        zetaH[None, :], zetaV[None, :],
                                        np.atleast_2d(ilambd), ab, xdirect,
                                        msrc, mrec)
+    kernel._profile_stop('kernel', t0)
 
     # Check which kernels have information
     k_used = [True, True, True]
@@ -392,11 +574,17 @@ def hankel_qwe(zsrc, zrec, lsrc, lrec, off, ang_fact, depth, ab, etaH, etaV,
             iB = i*nquad + np.arange(nquad)
 
             # PJ0 and PJ1 for this interval
+            kernel._profile_count('lambdas', np.size(inpoff)*nquad)
+            kernel._profile_count('kernel_size_max',
+                                  np.size(inpoff)*nquad*depth.size,
+                                  maximum=True)
+            t0 = kernel._profile_start()
             PJ0, PJ1, PJ0b = kernel.wavenumber(zsrc, zrec, lsrc, lrec, depth,
                                                etaH[None, :], etaV[None, :],
                                                zetaH[None, :], zetaV[None, :],
                                                np.atleast_2d(inplambd)[:, iB],
                                                ab, xdirect, msrc, mrec)
+            kernel._profile_stop('kernel', t0)
 
             # Carry out and return the Hankel transform for this interval
             gEM = np.zeros_like(inpoff, dtype=np.complex128)
@@ -455,10 +643,15 @@ def hankel_quad(zsrc, zrec, lsrc, lrec, off, ang_fact, depth, ab, etaH, etaV,
     ilambd = np.logspace(la, lb, int((lb-la)*htarg['pts_per_dec'] + 1))
 
     # Call the kernel
+    kernel._profile_count('lambdas', etaH.shape[0]*ilambd.size)
+    kernel._profile_count('kernel_size_max',
+                          etaH.shape[0]*ilambd.size*depth.size, maximum=True)
+    t0 = kernel._profile_start()
     PJ0, PJ1, PJ0b = kernel.wavenumber(zsrc, zrec, lsrc, lrec, depth, etaH,
                                        etaV, zetaH, zetaV,
                                        np.atleast_2d(ilambd), ab, xdirect,
                                        msrc, mrec)
+    kernel._profile_stop('kernel', t0)
 
     # Interpolation in wavenumber domain: Has to be done separately on each PJ,
     # in order to work with multiple offsets which have different angles.
@@ -845,7 +1038,7 @@ def fourier_fft(fEM, time, freq, ftarg):
 # 3. Utilities
 
 def dlf(signal, points, out_pts, filt, pts_per_dec, kind=None, ang_fact=None,
-        ab=None, int_pts=None):
+        ab=None, int_pts=None, plan=None):
     r"""Digital Linear Filter method.
 
     This is the kernel of the DLF method, used for the Hankel
@@ -867,7 +1060,12 @@ def dlf(signal, points, out_pts, filt, pts_per_dec, kind=None, ang_fact=None,
     The Fourier DLF requires one additional parameter, `kind`, which will be
     'cos' or 'sin'.
 
+    For the Hankel transform, a :class:`HankelPlan` can be provided as `plan`,
+    which supplies the filter weights and lagged-convolution indices.
+
     """
+    t0 = kernel._profile_start()
+
     # 0. HANKEL/FOURIER-DEPENDING SETTINGS
     if isinstance(signal, tuple):
         # Hankel transform: 3 complex signals; respects `ang_fact` and `ab`
@@ -916,15 +1114,29 @@ def dlf(signal, points, out_pts, filt, pts_per_dec, kind=None, ang_fact=None,
 
         k_used = [True, ]
 
+    # Filter weights in the precision of the signal (double or single)
+    ftype = signal[inp_index if hankel else 0].real.dtype
+    if hankel and plan is not None:
+        j0, j1 = plan.weights(ftype)
+    elif hankel:
+        j0 = filt.j0.astype(ftype, copy=False)
+        j1 = filt.j1.astype(ftype, copy=False)
+    else:
+        fourier = getattr(filt, kind).astype(ftype, copy=False)
+
     # 1. PREPARE SIGNALS
 
     # Interpolation function
     def spline(values, points, int_pts):
-        r"""Return `values` at `points` interpolated in log at `int_pts`."""
-        out = iuSpline(np.log(points), values.real)(np.log(int_pts))
-        if values.dtype == np.complex128:
-            out = out+1j*iuSpline(np.log(points), values.imag)(np.log(int_pts))
-        return out
+        r"""Return `values` at `points` interpolated in log at `int_pts`.
+
+        The interpolation is carried out along the last axis of `values`, for
+        all its leading axes (e.g., frequencies) at once.
+        """
+        if values.ndim > 1:
+            values = values.reshape(-1, values.shape[-1])
+        out = bSpline(np.log(points).ravel(), values, k=3, axis=-1)
+        return out(np.log(int_pts))
 
     # Re-arranging and interpolation before DLF
     if pts_per_dec < 0:  # Lagged Convolution DLF: interp. in output domain
@@ -934,13 +1146,17 @@ def dlf(signal, points, out_pts, filt, pts_per_dec, kind=None, ang_fact=None,
         if int_pts is None:
             _, int_pts = get_dlf_points(filt, out_pts, pts_per_dec)
 
-        # Re-arrange signal
+        # Re-arrange signal: row i contains the values i:i+filt.base.size,
+        # for all leading axes (e.g., frequencies) at once.
+        if plan is not None:
+            lag = plan.lag(int_pts.size)
+        else:
+            lag = np.arange(int_pts.size)[:, None] + np.arange(filt.base.size)
         for i, val in enumerate(signal):
             if k_used[i]:  # Only if kernel contains info
-                tmp_sig = np.concatenate((np.tile(val, int_pts.size).squeeze(),
-                                         np.zeros(int_pts.size)))
-                signal[i] = tmp_sig.reshape(int_pts.size, -1)[:,
-                                                              :filt.base.size]
+                if val.ndim > 1:
+                    val = val.reshape(-1, val.shape[-1])
+                signal[i] = val[..., lag]
 
     elif pts_per_dec > 0:  # Splined DLF: interpolate in input domain
         # Splined DLF; interpolate in input domain
@@ -972,10 +1188,10 @@ def dlf(signal, points, out_pts, filt, pts_per_dec, kind=None, ang_fact=None,
 
             # Do transform for the used kernels
             if k_used[0]:  # J0
-                np.dot(inp_PJ0, filt.j0, out=out_noang)
+                np.dot(inp_PJ0, j0, out=out_noang)
 
             if k_used[1]:  # J1
-                np.dot(inp_PJ1, filt.j1, out=out_angle)
+                np.dot(inp_PJ1, j1, out=out_angle)
                 if ab in [11, 12, 21, 22, 14, 24, 15, 25]:  # Because of J2
                     # J2(kr) = 2/(kr)*J1(kr) - J0(kr)
                     if pts_per_dec < 0:  # Lagged Convolution
@@ -984,7 +1200,7 @@ def dlf(signal, points, out_pts, filt, pts_per_dec, kind=None, ang_fact=None,
                         out_angle /= out_pts
 
             if k_used[2]:  # J0b
-                out_angle += np.dot(inp_PJ0b, filt.j0)
+                out_angle += np.dot(inp_PJ0b, j0)
 
             if pts_per_dec > 0:
                 # If splined we can add them here, as the interpolation
@@ -1002,7 +1218,7 @@ def dlf(signal, points, out_pts, filt, pts_per_dec, kind=None, ang_fact=None,
 
             # Do transform for the used kernels
             if k_used[1]:  # J1
-                np.dot(inp_PJ1, filt.j1, out=out_signal)
+                np.dot(inp_PJ1, j1, out=out_signal)
                 if ab in [11, 12, 21, 22, 14, 24, 15, 25]:  # Because of J2
                     # J2(kr) = 2/(kr)*J1(kr) - J0(kr)
                     if pts_per_dec < 0:  # Lagged Convolution
@@ -1011,17 +1227,17 @@ def dlf(signal, points, out_pts, filt, pts_per_dec, kind=None, ang_fact=None,
                         out_signal /= out_pts
 
             if k_used[2]:  # J0b
-                out_signal += np.dot(inp_PJ0b, filt.j0)
+                out_signal += np.dot(inp_PJ0b, j0)
 
             # Angle dependency
             if has_angle_factors:
                 out_signal *= ang_fact
 
             if k_used[0]:  # J0
-                out_signal += np.dot(inp_PJ0, filt.j0)
+                out_signal += np.dot(inp_PJ0, j0)
 
     else:  # Fourier transform
-        out_signal = np.dot(signal[0], getattr(filt, kind))
+        out_signal = np.dot(signal[0], fourier)
 
     # 3. IF LAGGED CONVOLUTION, INTERPOLATE NOW TO OUTPUT DOMAIN POINTS
     if pts_per_dec < 0:
@@ -1030,20 +1246,23 @@ def dlf(signal, points, out_pts, filt, pts_per_dec, kind=None, ang_fact=None,
 
             # J1 or J2 are always used except for ab=33; however ab=33 is
             # angle-independent, so we don't have to check here.
-            out_signal = spline(out_angle[::-1], int_pts[::-1], out_pts)
+            out_signal = spline(out_angle[..., ::-1], int_pts[::-1], out_pts)
 
             # Angle dependency
             if has_angle_factors:
                 out_signal *= ang_fact
 
             if k_used[0]:  # Only if kernel contains info
-                out_signal += spline(out_noang[::-1], int_pts[::-1], out_pts)
+                out_signal += spline(
+                        out_noang[..., ::-1], int_pts[::-1], out_pts)
 
         else:  # If only one angle or Fourier
-            out_signal = spline(out_signal[::-1], int_pts[::-1], out_pts)
+            out_signal = spline(out_signal[..., ::-1], int_pts[::-1], out_pts)
 
     # Return the signal in the output domain
-    return out_signal/out_pts
+    out_signal = out_signal/out_pts.astype(ftype, copy=False)
+    kernel._profile_stop('dlf', t0)
+    return out_signal
 
 
 def qwe(rtol, atol, maxint, inp, intervals, lambd=None, off=None,
@@ -1076,6 +1295,7 @@ def qwe(rtol, atol, maxint, inp, intervals, lambd=None, off=None,
     relErr = np.zeros((EM0.size, maxint))                   # Relative error
     extrap = np.zeros((EM0.size, maxint), dtype=EM0.dtype)  # extrap. result
     kcount = 1  # Initialize kernel count (only important for Hankel)
+    nint = np.ones(EM0.size, dtype=int)  # Number of intervals (profile)
 
     # 3. The extrapolation transformation loop
     for i in range(1, maxint):
@@ -1086,6 +1306,7 @@ def qwe(rtol, atol, maxint, inp, intervals, lambd=None, off=None,
         else:                         # Fourier or Hankel with spline
             EMi = inp[om, i]
         EMi *= getweights(i, intervals[om, :])
+        nint[om] = i+1
 
         # 3.b Compute Shanks transformation
         # Using the epsilon algorithm: structured after [Weni89]_, p26.
@@ -1130,6 +1351,9 @@ def qwe(rtol, atol, maxint, inp, intervals, lambd=None, off=None,
     # Set np.finfo(np.double).max to 0
     EM.real[EM.real == np.finfo(np.double).max] = 0
 
+    # Intervals and convergence per offset (profile)
+    kernel._profile_qwe(nint, ~om)
+
     return EM, kcount, conv
 
 
@@ -1257,6 +1481,265 @@ def get_dlf_points(filt, inp, nr_per_dec):
     return np.atleast_2d(out), new_inp
 
 
+def get_dlf_unique(lambd, rtol=1e-12):
+    r"""Return unique DLF lambdas and the indices to reconstruct them.
+
+    Lambdas which are within a relative tolerance `rtol` of each other are
+    considered the same.
+
+
+    Parameters
+    ----------
+    lambd : ndarray
+        Lambdas, as returned from :func:`get_dlf_points`.
+
+    rtol : float, default: 1e-12
+        Relative tolerance.
+
+
+    Returns
+    -------
+    ulambd : ndarray
+        Sorted unique lambdas.
+
+    ilambd : ndarray
+        Indices such that ``ulambd[ilambd]`` is ``lambd.ravel()``.
+
+    """
+    # Sort the lambdas
+    flambd = lambd.ravel()
+    isort = np.argsort(flambd)
+    slambd = flambd[isort]
+
+    # Start a new unique lambda where the gap is bigger than the tolerance
+    new = np.r_[True, np.diff(slambd) > rtol*slambd[1:]]
+
+    # Indices to reconstruct the original lambdas
+    ilambd = np.empty(flambd.size, dtype=int)
+    ilambd[isort] = np.cumsum(new) - 1
+
+    return slambd[new], ilambd
+
+
+def get_dlf_pruned(lambd, zsrc, zrec, lsrc, lrec, depth, etaH, etaV, zetaH,
+                   zetaV, xdirect, tol):
+    r"""Return a mask of the DLF lambdas with a non-negligible kernel.
+
+    The decay of the wavenumber-domain kernel towards large wavenumbers is
+    estimated from the attenuation along the shortest path from the source to
+    the receiver,
+
+    .. math::
+
+        A(\lambda) = \sum_n \Re(\Gamma_n) d_n \ ,
+
+    where :math:`d_n` is the distance travelled in layer n, and
+    :math:`\Gamma_n` the smaller one of TM and TE. If source and receiver are
+    in the same layer, the path is the direct one (if the direct field is
+    computed in the wavenumber domain), else the reflection at the closer
+    interface of the layer; otherwise it is the straight path through all
+    layers in between. The magnitude of the kernel is estimated as
+    :math:`\lambda^2\exp(-A)`, normalized by its maximum for each frequency.
+
+    Lambdas larger than the one of this maximum, with an estimated magnitude
+    below `tol` for all frequencies, are negligible.
+
+
+    Parameters
+    ----------
+    lambd : ndarray
+        Lambdas, 1D.
+
+    zsrc, zrec, lsrc, lrec, depth, etaH, etaV, zetaH, zetaV, xdirect : settings
+        See :func:`empymod.kernel.wavenumber`.
+
+    tol : float
+        Relative tolerance.
+
+
+    Returns
+    -------
+    keep : ndarray
+        Boolean mask of the lambdas which are not negligible.
+
+    """
+    # Distance travelled in each layer along the shortest path
+    dist = np.zeros(depth.size)
+    if lsrc == lrec:
+        if not xdirect:  # Direct field in the wavenumber domain
+            dist[lsrc] = abs(zsrc - zrec)
+        else:                 # Reflection at the closer interface
+            paths = []
+            if lsrc > 0:
+                paths.append(zsrc + zrec - 2*depth[lsrc])
+            if lsrc < depth.size-1:
+                paths.append(2*depth[lsrc+1] - zsrc - zrec)
+            if not paths:  # Fullspace: there is nothing to prune
+                return np.ones(lambd.size, dtype=bool)
+            dist[lsrc] = min(paths)
+    else:
+        ltop, lbot = min(lsrc, lrec), max(lsrc, lrec)
+        ztop, zbot = (zsrc, zrec) if lsrc < lrec else (zrec, zsrc)
+        dist[ltop] = depth[ltop+1] - ztop
+        dist[ltop+1:lbot] = np.diff(depth[ltop+1:lbot+1])
+        dist[lbot] = zbot - depth[lbot]
+
+    # Attenuation along the path (the smaller one of TM and TE)
+    l2 = lambd[None, :]**2
+    atten = np.zeros((etaH.shape[0], lambd.size))
+    for n in np.nonzero(dist)[0]:
+        h_times_h = (zetaH[:, n]*etaH[:, n])[:, None]
+        GamTM = np.sqrt((etaH[:, n]/etaV[:, n])[:, None]*l2 + h_times_h)
+        GamTE = np.sqrt((zetaH[:, n]/zetaV[:, n])[:, None]*l2 + h_times_h)
+        atten += np.minimum(GamTM.real, GamTE.real)*dist[n]
+
+    # Estimated magnitude (log), normalized by its maximum per frequency
+    logmag = 2*np.log(lambd[None, :]) - atten
+    imax = np.argmax(logmag, axis=1)
+    logmag -= logmag[np.arange(imax.size), imax][:, None]
+
+    # Negligible: beyond the maximum and below the tolerance
+    negligible = logmag < np.log(tol)
+    negligible &= np.arange(lambd.size)[None, :] > imax[:, None]
+
+    return ~np.all(negligible, axis=0)
+
+
+def _dlf_points(htarg, off):
+    r"""Return lambdas, interpolation points, and kernel lambdas of the DLF.
+
+    Returns `lambd` and `int_pts` of :func:`get_dlf_points`, and the lambdas
+    `klambd` for which the kernel is computed, with the indices `ilambd` to
+    gather them per offset (None if ``klambd is lambd``).
+    """
+    lambd, int_pts = get_dlf_points(htarg['dlf'], off, htarg['pts_per_dec'])
+
+    # Standard DLF: the kernel depends only on lambda, not on offset; compute
+    # it only for the unique lambdas (repeated offsets, or offsets related by
+    # the filter spacing factor), and gather them afterwards per offset.
+    # (With pruning, the unique lambdas are always used, as negligible lambdas
+    # are skipped column-wise.)
+    klambd = lambd
+    ilambd = None
+    if htarg['pts_per_dec'] == 0 and lambd.shape[0] > 1:
+        ulambd, iulambd = get_dlf_unique(lambd)
+        if ulambd.size < lambd.size or htarg.get('prune', 0) > 0:
+            klambd = ulambd[None, :]
+            ilambd = iulambd
+
+    return lambd, int_pts, klambd, ilambd
+
+
+class HankelPlan:
+    r"""Precomputed DLF quantities for repeated calls with the same geometry.
+
+    In, e.g., an inversion the survey geometry, the frequencies, and the
+    filter stay the same, while the model changes. A plan checks the DLF
+    arguments once, at its creation, and stores for each geometry with which
+    it is used (offsets, angles) the lambdas and interpolation points
+    (:func:`get_dlf_points`), the unique lambdas (:func:`get_dlf_unique`), the
+    lagged-convolution indices, the filter weights in the required precision,
+    and the angle factors (:func:`empymod.kernel.angle_factor`); subsequent
+    calls with the same geometry skip all of that.
+
+    It is used with the DLF through ``htarg={'plan': plan}`` (possibly
+    together with ``'cache'``, see :class:`empymod.kernel.ReflectionCache`),
+    in the modelling routines, :func:`empymod.model.fem`, and
+    :func:`hankel_dlf`.
+
+
+    Parameters
+    ----------
+    htarg : dict, default: None
+        DLF arguments, see :func:`empymod.model.bipole` (except ``'cache'``).
+
+    off : ndarray, default: None
+        Offsets (m) for which the points are computed at creation; otherwise
+        they are computed on first use.
+
+    verb : {0, 1, 2, 3, 4}, default: 0
+        Level of verbosity of the check of `htarg`.
+
+
+    Examples
+    --------
+
+    .. ipython::
+
+       In [1]: import empymod
+          ...: import numpy as np
+          ...: plan = empymod.transform.HankelPlan({'pts_per_dec': -1})
+          ...: inp = {'src': [0, 0, 100], 'rec': [1000, 0, 200],
+          ...:        'depth': [0, 300], 'freqtime': 1, 'verb': 1,
+          ...:        'htarg': {'plan': plan}}
+          ...: for res in [1, 2, 3]:
+          ...:     EM = empymod.dipole(res=[2e14, res, 10], **inp)
+          ...: plan
+       Out[1]: HankelPlan: key_201_2009, lagged convolution; 1 geometries
+
+    """
+
+    def __init__(self, htarg=None, off=None, verb=0):
+        from empymod.utils import check_hankel  # (utils imports transform)
+
+        htarg = {} if htarg is None else htarg
+        if 'cache' in htarg or 'plan' in htarg:
+            raise ValueError("<htarg> of a HankelPlan cannot contain 'cache' "
+                             "or 'plan'; provide the cache in the <htarg> of "
+                             "the call, together with the plan.")
+        _, self.htarg = check_hankel('dlf', htarg, verb)
+
+        self._points = {}
+        self._angles = {}
+        self._lags = {}
+        self._weights = {}
+
+        if off is not None:
+            self.points(np.asarray(off, dtype=np.float64))
+
+    def __repr__(self):
+        pts_per_dec = self.htarg['pts_per_dec']
+        if pts_per_dec < 0:
+            kind = "lagged convolution"
+        elif pts_per_dec > 0:
+            kind = f"splined, {pts_per_dec} pts/dec"
+        else:
+            kind = "standard"
+        return (f"{self.__class__.__name__}: {self.htarg['dlf'].name}, "
+                f"{kind}; {len(self._points)} geometries")
+
+    def points(self, off):
+        r"""Return `lambd`, `int_pts`, `klambd`, and `ilambd` for offsets."""
+        key = (off.shape, off.tobytes())
+        if key not in self._points:
+            self._points[key] = _dlf_points(self.htarg, off)
+        return self._points[key]
+
+    def angle_factor(self, angle, ab, msrc, mrec):
+        r"""Return the angle factor, see :func:`empymod.kernel.angle_factor`.
+        """
+        key = (angle.shape, angle.tobytes(), ab, msrc, mrec)
+        if key not in self._angles:
+            self._angles[key] = kernel.angle_factor(angle, ab, msrc, mrec)
+        return self._angles[key]
+
+    def lag(self, nint):
+        r"""Return the indices of the lagged convolution (`nint` points)."""
+        if nint not in self._lags:
+            nbase = self.htarg['dlf'].base.size
+            self._lags[nint] = np.arange(nint)[:, None] + np.arange(nbase)
+        return self._lags[nint]
+
+    def weights(self, ftype):
+        r"""Return the filter weights `j0`, `j1` in precision `ftype`."""
+        ftype = np.dtype(ftype)
+        if ftype not in self._weights:
+            filt = self.htarg['dlf']
+            self._weights[ftype] = (filt.j0.astype(ftype, copy=False),
+                                    filt.j1.astype(ftype, copy=False))
+        return self._weights[ftype]
+
+
 def get_fftlog_input(rmin, rmax, n, q, mu):
     r"""Return parameters required for FFTLog."""
     # Central point log10(r_c) of periodic interval
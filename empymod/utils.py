@@ -30,30 +30,18 @@ import copy
 import numpy as np
 import scipy as sp
 from timeit import default_timer
-from datetime import timedelta, datetime
+from datetime import timedelta
 
 # Relative imports
-from empymod import filters, transform
-from scooby import Report as ScoobyReport
-
-# Version: We take care of it here instead of in __init__, so we can use it
-# within the package itself (logs).
-try:
-    # - Released versions just tags:       1.10.0
-    # - GitHub commits add .dev#+hash:     1.10.1.dev3+g973038c
-    # - Uncommitted changes add timestamp: 1.10.1.dev3+g973038c.d20191022
-    from empymod.version import version as __version__
-except ImportError:
-    # If it was not installed, then we don't know the version. We could throw a
-    # warning here, but this case *should* be rare. empymod should be installed
-    # properly!
-    __version__ = 'unknown-'+datetime.today().strftime('%Y%m%d')
+from empymod import __version__, filters, kernel, transform
 
 
+# (Report is created on first use, see __getattr__)
 __all__ = ['EMArray', 'check_time_only', 'check_time', 'check_model',
            'check_frequency', 'check_hankel', 'check_loop', 'check_dipole',
-           'check_bipole', 'check_ab', 'check_solution', 'get_abs',
-           'get_geo_fact', 'get_azm_dip', 'get_off_ang', 'get_layer_nr',
+           'check_bipole', 'check_ab', 'check_precision', 'check_solution',
+           'get_abs', 'get_geo_fact', 'get_azm_dip', 'get_depth_groups',
+           'get_nlayer_truncated', 'get_off_ang', 'get_layer_nr',
            'printstartfinish', 'conv_warning', 'set_minimum', 'get_minimum',
            'Report']
 
@@ -71,6 +59,14 @@ def __dir__():
     return __all__
 
 
+def __getattr__(name):
+    """Create `Report` on first use (see :func:`_report`)."""
+    if name == 'Report':
+        globals()['Report'] = _report()
+        return globals()['Report']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 # 1. Class EMArray
 
 class EMArray(np.ndarray):
@@ -156,8 +152,8 @@ def check_ab(ab, verb):
 
     Parameters
     ----------
-    ab : int
-        Source-receiver configuration.
+    ab : int or 'all'
+        Source-receiver configuration; 'all' for the full tensor.
 
     verb : {0, 1, 2, 3, 4}
         Level of verbosity.
@@ -165,14 +161,24 @@ def check_ab(ab, verb):
 
     Returns
     -------
-    ab_calc : int
-        Adjusted source-receiver configuration using reciprocity.
+    ab_calc : int or ndarray
+        Adjusted source-receiver configuration using reciprocity. If
+        `ab='all'`, it is an array of shape (6, 6) (receiver, source).
 
-    msrc, mrec : bool
-        If True, src/rec is magnetic; if False, src/rec is electric.
+    msrc, mrec : bool or ndarray
+        If True, src/rec is magnetic; if False, src/rec is electric. If
+        `ab='all'`, they are arrays of shape (6, 6) (receiver, source).
 
     """
 
+    # Full tensor: check each configuration
+    if isinstance(ab, str) and ab == 'all':
+        if verb > 2:
+            print("   Input ab        :  all (full tensor)")
+        out = [check_ab(10*a+b, 0) for a in range(1, 7) for b in range(1, 7)]
+        ab_calc, msrc, mrec = (np.array(o).reshape(6, 6) for o in zip(*out))
+        return ab_calc, msrc, mrec
+
     # Try to cast ab into an integer
     try:
         ab = int(ab)
@@ -409,6 +415,9 @@ def check_frequency(freq, res, aniso, epermH, epermV, mpermH, mpermV, verb):
     res : array_like
         Horizontal resistivities rho_h (Ohm.m); #res = #depth + 1.
 
+        For an ensemble of models (see :func:`check_model`), res and the other
+        parameters can have a leading model dimension.
+
     aniso : array_like
         Anisotropies lambda = sqrt(rho_v/rho_h) (-); #aniso = #res.
 
@@ -431,10 +440,12 @@ def check_frequency(freq, res, aniso, epermH, epermV, mpermH, mpermV, verb):
         Frequency, checked for size and assured min_freq.
 
     etaH, etaV : array
-        Parameters etaH/etaV, same size as provided resistivity.
+        Parameters etaH/etaV, (nfreq, nlayer); (nmodel, nfreq, nlayer) for an
+        ensemble of models.
 
     zetaH, zetaV : array
-        Parameters zetaH/zetaV, same size as provided resistivity.
+        Parameters zetaH/zetaV, (nfreq, nlayer); (nmodel, nfreq, nlayer) for
+        an ensemble of models.
 
     """
     global _min_freq
@@ -475,10 +486,18 @@ def check_frequency(freq, res, aniso, epermH, epermV, mpermH, mpermV, verb):
     mu_0 = 4e-7*np.pi          # Magn. permeability of free space [H/m]
     epsilon_0 = 1./(mu_0*c*c)  # Elec. permittivity of free space [F/m]
 
-    etaH = 1/res + np.outer(sval, epermH*epsilon_0)
-    etaV = 1/(res*aniso*aniso) + np.outer(sval, epermV*epsilon_0)
-    zetaH = np.outer(sval, mpermH*mu_0)
-    zetaV = np.outer(sval, mpermV*mu_0)
+    # (The parameters of an ensemble of models have a leading model dimension)
+    sval = sval[:, None]
+    etaH = 1/res[..., None, :] + sval*(epermH*epsilon_0)[..., None, :]
+    etaV = (1/(res*aniso*aniso)[..., None, :] +
+            sval*(epermV*epsilon_0)[..., None, :])
+    zetaH = sval*(mpermH*mu_0)[..., None, :]
+    zetaV = sval*(mpermV*mu_0)[..., None, :]
+
+    # Ensemble: broadcast all to (nmodel, nfreq, nlayer)
+    if max(etaH.ndim, etaV.ndim, zetaH.ndim, zetaV.ndim) > 2:
+        etaH, etaV, zetaH, zetaV = [
+            np.array(v) for v in np.broadcast_arrays(etaH, etaV, zetaH, zetaV)]
 
     return freq, etaH, etaV, zetaH, zetaV
 
@@ -514,7 +533,26 @@ def check_hankel(ht, htarg, verb):
 
     # Initiate output dict
     targ = {}
-    args = copy.deepcopy(htarg)
+    plan = htarg.get('plan', None)
+    if plan is not None:  # Arguments are checked at creation of the plan
+        if ht != 'dlf':
+            raise ValueError("<htarg['plan']> is only implemented for "
+                             f"<ht='dlf'>; <ht> provided: {ht}.")
+        if not isinstance(plan, transform.HankelPlan):
+            raise TypeError(
+                "<htarg['plan']> must be an instance of "
+                "empymod.transform.HankelPlan; <htarg['plan']> "
+                f"provided: {type(plan)}.")
+        if set(htarg) - {'plan', 'cache'}:
+            raise ValueError(
+                "<htarg> can only contain 'cache' in addition to 'plan'; "
+                f"<htarg> provided: {list(htarg)}.")
+        args = {**plan.htarg, 'cache': htarg.get('cache', None),
+                'plan': plan}
+    else:
+        args = copy.deepcopy({k: v for k, v in htarg.items() if k != 'cache'})
+        if 'cache' in htarg:  # Stateful, not copied
+            args['cache'] = htarg['cache']
 
     if ht == 'dlf':     # DLF
 
@@ -538,6 +576,32 @@ def check_hankel(ht, htarg, verb):
                 args.pop('pts_per_dec', 0.0), float, 0, 'dlf: pts_per_dec',
                 ())
 
+        # Wavenumber-domain kernel: 'default' or 'fused' (low memory)
+        targ['kernel'] = args.pop('kernel', 'default')
+        if targ['kernel'] not in ['default', 'fused']:
+            raise ValueError("<htarg['kernel']> must be one of: "
+                             "['default', 'fused']; <htarg['kernel']> "
+                             f"provided: {targ['kernel']}.")
+
+        # Pruning tolerance of negligible lambdas (0: no pruning)
+        targ['prune'] = _check_var(
+                args.pop('prune', 0.0), float, 0, 'dlf: prune', ())
+
+        # Incremental reflections (None: no cache)
+        targ['cache'] = args.pop('cache', None)
+        if targ['cache'] is not None:
+            if not isinstance(targ['cache'], transform.kernel.ReflectionCache):
+                raise TypeError(
+                    "<htarg['cache']> must be an instance of "
+                    "empymod.kernel.ReflectionCache; <htarg['cache']> "
+                    f"provided: {type(targ['cache'])}.")
+            if targ['kernel'] == 'fused':
+                raise ValueError("<htarg['cache']> is only implemented for "
+                                 "<htarg['kernel']='default'>.")
+
+        # Precomputed plan (None: no plan)
+        targ['plan'] = args.pop('plan', None)
+
         # If verbose, print Hankel transform information
         if verb > 2:
             print("   Hankel          :  DLF (Fast Hankel Transform)")
@@ -549,6 +613,14 @@ def check_hankel(ht, htarg, verb):
                 print(f"{pstr}Splined, {targ['pts_per_dec']} pts/dec")
             else:
                 print(f"{pstr}Standard")
+            if targ['kernel'] == 'fused':
+                print("     > Kernel      :  Fused (low memory)")
+            if targ['prune'] > 0:
+                print(f"     > Pruning     :  {targ['prune']}")
+            if targ['cache'] is not None:
+                print("     > Reflections :  Incremental (cache)")
+            if targ['plan'] is not None:
+                print("     > Plan        :  Precomputed (HankelPlan)")
 
     elif ht == 'qwe':   # QWE
 
@@ -658,7 +730,7 @@ def check_hankel(ht, htarg, verb):
 
 
 def check_model(depth, res, aniso, epermH, epermV, mpermH, mpermV, xdirect,
-                verb):
+                verb, merge=False, zkeep=None, ensemble=False):
     r"""Check the model: depth and corresponding layer parameters.
 
     This check-function is called from one of the modelling routines in
@@ -694,6 +766,22 @@ def check_model(depth, res, aniso, epermH, epermV, mpermH, mpermV, xdirect,
     verb : {0, 1, 2, 3, 4}
         Level of verbosity.
 
+    merge : bool, default: False
+        If True, adjacent layers with identical `res`, `aniso`, `epermH`,
+        `epermV`, `mpermH`, and `mpermV` are merged into one layer, except for
+        layers which contain any of the depths `zkeep`. This is not done for
+        user-provided models (`res` is a dict).
+
+    zkeep : list, default: None
+        Source and receiver depths (m), a list of array_likes; only used if
+        `merge=True`.
+
+    ensemble : bool, default: False
+        If True, `res` can be of shape (nmodel, #depth + 1), an ensemble of
+        models with the same depths; the other parameters can then be of
+        shape (#res, ) or of the same shape as `res`. Not possible for
+        user-provided models (`res` is a dict).
+
 
     Returns
     -------
@@ -701,7 +789,7 @@ def check_model(depth, res, aniso, epermH, epermV, mpermH, mpermV, xdirect,
         Depths of layer interfaces, adds -inf at beginning if not present.
 
     res : array
-        As input, checked for size.
+        As input, checked for size; (nmodel, #depth + 1) for an ensemble.
 
     aniso : array
         As input, checked for size. If None, defaults to an array of ones.
@@ -714,7 +802,8 @@ def check_model(depth, res, aniso, epermH, epermV, mpermH, mpermV, xdirect,
 
     isfullspace : bool
         If True, the model is a fullspace (res, aniso, epermH, epermV, mpermM,
-        and mpermV are in all layers the same).
+        and mpermV are in all layers the same); for an ensemble, if all
+        models are fullspaces.
 
     """
     global _min_res
@@ -754,8 +843,14 @@ def check_model(depth, res, aniso, epermH, epermV, mpermH, mpermV, xdirect,
     else:
         res_dict = False
 
+    # Ensemble of models: parameters can have a leading model dimension
+    if ensemble and not res_dict and np.ndim(res) == 2:
+        shape2 = (np.shape(res)[0], depth.size)
+    else:
+        shape2 = None
+
     # Cast and check resistivity
-    res = _check_var(res, float, 1, 'res', depth.shape)
+    res = _check_var(res, float, 1, 'res', shape2 or depth.shape)
     # => min_res can be set with utils.set_min
     res = _check_min(res, _min_res, 'Resistivities', 'Ohm.m', verb)
 
@@ -766,7 +861,7 @@ def check_model(depth, res, aniso, epermH, epermV, mpermH, mpermV, xdirect,
         if var is None:
             return np.ones(depth.size)
         else:
-            param = _check_var(var, float, 1, name, depth.shape)
+            param = _check_var(var, float, 1, name, depth.shape, shape2)
             if name == 'aniso':  # Convert aniso into vertical resistivity
                 param = param**2*res
             param = _check_min(param, min_val, 'Parameter ' + name, '', verb)
@@ -790,30 +885,47 @@ def check_model(depth, res, aniso, epermH, epermV, mpermH, mpermV, xdirect,
         mpermV = check_inp(mpermV, 'mpermV', 0.0)
 
     # Swap parameters if depths were given in reverse.
-    res = res[::swap]
-    aniso = aniso[::swap]
-    epermH = epermH[::swap]
-    epermV = epermV[::swap]
-    mpermH = mpermH[::swap]
-    mpermV = mpermV[::swap]
-
-    # Print model parameters
+    res = res[..., ::swap]
+    aniso = aniso[..., ::swap]
+    epermH = epermH[..., ::swap]
+    epermV = epermV[..., ::swap]
+    mpermH = mpermH[..., ::swap]
+    mpermV = mpermV[..., ::swap]
+
+    # Merge identical adjacent layers, except the ones with sources/receivers
+    if merge and not res_dict and depth.size > 1:
+        out = _merge_layers(depth, (res, aniso, epermH, epermV, mpermH,
+                                    mpermV), [] if zkeep is None else zkeep)
+        if verb > 2:
+            print(f"   Merged layers   :  {depth.size} -> {out[0].size}")
+        depth, (res, aniso, epermH, epermV, mpermH, mpermV) = out
+
+    # Print model parameters (min/max of ensemble parameters)
     if verb > 2:
+        if shape2:
+            print(f"   Ensemble        :  {shape2[0]} models")
         print(f"   depth       [m] :  {_strvar(depth[1:])}")
-        print(f"   res     [Ohm.m] :  {_strvar(res)}")
-        print(f"   aniso       [-] :  {_strvar(aniso)}")
-        print(f"   epermH      [-] :  {_strvar(epermH)}")
-        print(f"   epermV      [-] :  {_strvar(epermV)}")
-        print(f"   mpermH      [-] :  {_strvar(mpermH)}")
-        print(f"   mpermV      [-] :  {_strvar(mpermV)}")
+        for var, text in [(res, "res     [Ohm.m]"), (aniso, "aniso       [-]"),
+                          (epermH, "epermH      [-]"),
+                          (epermV, "epermV      [-]"),
+                          (mpermH, "mpermH      [-]"),
+                          (mpermV, "mpermV      [-]")]:
+            if var.ndim > 1:
+                _prnt_min_max_val(var, f"   {text} : ", verb)
+            else:
+                print(f"   {text} :  {_strvar(var)}")
 
     # Check if medium is a homogeneous full-space. If that is the case, the
     # EM-field is computed analytically directly in the frequency-domain.
     # Note: Also a stack of layers with the same material parameters is treated
     #       as a homogeneous full-space.
-    isores = (res - res[0] == 0).all()*(aniso - aniso[0] == 0).all()
-    isoep = (epermH - epermH[0] == 0).all()*(epermV - epermV[0] == 0).all()
-    isomp = (mpermH - mpermH[0] == 0).all()*(mpermV - mpermV[0] == 0).all()
+    def iso(var):
+        r"""True if var is the same in all layers (of each model)."""
+        return (var - var[..., :1] == 0).all()
+
+    isores = iso(res)*iso(aniso)
+    isoep = iso(epermH)*iso(epermV)
+    isomp = iso(mpermH)*iso(mpermV)
     isfullspace = isores*isoep*isomp
 
     # Check parameters of user-provided parameters
@@ -884,13 +996,10 @@ def check_loop(loop, ht, htarg, verb):
 
     """
 
-    # Define if to loop over frequencies or over offsets
-    lagged_splined_dlf = False
-    if ht == 'dlf':
-        if htarg['pts_per_dec'] != 0:
-            lagged_splined_dlf = True
-
-    if ht in ['qwe', 'quad'] or lagged_splined_dlf:
+    # Define if to loop over frequencies or over offsets; QWE and QUAD always
+    # loop over frequencies. (The lagged convolution and splined DLF are
+    # vectorized over frequencies, as they use the same wavenumbers for all.)
+    if ht in ['qwe', 'quad']:
         loop_freq = True
         loop_off = False
     else:
@@ -910,6 +1019,56 @@ def check_loop(loop, ht, htarg, verb):
     return loop_freq, loop_off
 
 
+def check_precision(precision, etaH, etaV, zetaH, zetaV, verb):
+    r"""Check precision and cast eta/zeta accordingly.
+
+    This check-function is called from one of the modelling routines in
+    :mod:`empymod.model`. Consult these modelling routines for a detailed
+    description of the input parameters.
+
+    The wavenumber-domain kernel and the DLF carry out their computations in
+    the precision of eta/zeta. In single precision, eta/zeta are complex64
+    (float32 for Laplace-domain computations), which halves the memory and
+    memory traffic of the wavenumber-domain arrays.
+
+    Parameters
+    ----------
+    precision : {'double', 'single'}
+        Floating-point precision of the computation.
+
+    etaH, etaV, zetaH, zetaV : array
+        Parameters etaH/etaV/zetaH/zetaV, as returned from
+        :func:`check_frequency`.
+
+    verb : {0, 1, 2, 3, 4}
+        Level of verbosity.
+
+
+    Returns
+    -------
+    etaH, etaV, zetaH, zetaV : array
+        Parameters etaH/etaV/zetaH/zetaV in the chosen precision.
+
+    """
+
+    # Check precision
+    if precision not in ['double', 'single']:
+        raise ValueError("<precision> must be one of: ['double', 'single']; "
+                         f"<precision> provided: {precision}.")
+
+    # Cast to single precision: complex64, or float32 in the Laplace domain
+    if precision == 'single':
+        etaH, etaV, zetaH, zetaV = [
+            v.astype(np.complex64 if np.iscomplexobj(v) else np.float32)
+            for v in (etaH, etaV, zetaH, zetaV)]
+
+    # If verbose, print precision
+    if verb > 2:
+        print(f"   Precision       :  {precision.capitalize()}")
+
+    return etaH, etaV, zetaH, zetaV
+
+
 def check_time(time, signal, ft, ftarg, verb):
     r"""Check time domain specific input parameters.
 
@@ -1564,8 +1723,9 @@ def get_azm_dip(inp, iz, ninpz, intpts, isdipole, strength, name, verb):
         - [x0, x1, y0, y1, z0, z1] (bipole of finite length)
         - [x, y, z, azimuth, dip]  (dipole, infinitesimal small)
 
-    iz : int
-        Index of current di-/bipole depth (-).
+    iz : int or array of int
+        Index or indices of current di-/bipole(s) (-); several indices must
+        share the same depth(s), see :func:`get_depth_groups`.
 
     ninpz : int
         Total number of di-/bipole depths (ninpz = 1 or npinz = nsrc) (-).
@@ -1617,7 +1777,7 @@ def get_azm_dip(inp, iz, ninpz, intpts, isdipole, strength, name, verb):
     # Get this di-/bipole
     if ninpz == 1:  # If there is only one distinct depth, all at once
         tinp = inp
-    else:  # If there are several depths, we take the current one
+    else:  # If there are several depths, we take the current one(s)
         if isdipole:
             tinp = [np.atleast_1d(inp[0][iz]), np.atleast_1d(inp[1][iz]),
                     np.atleast_1d(inp[2][iz]), np.atleast_1d(inp[3][iz]),
@@ -1659,8 +1819,7 @@ def get_azm_dip(inp, iz, ninpz, intpts, isdipole, strength, name, verb):
         dz = np.squeeze(tinp[5] - tinp[4])
 
         # Length of bipole
-        dl = np.atleast_1d(np.linalg.norm(
-            np.array([dx, dy, dz], dtype=object), axis=0))
+        dl = np.atleast_1d(np.sqrt(dx**2 + dy**2 + dz**2))
 
         # Horizontal deviation from x-axis
         azm = np.atleast_1d(np.arctan2(dy, dx))
@@ -1684,9 +1843,8 @@ def get_azm_dip(inp, iz, ninpz, intpts, isdipole, strength, name, verb):
             yinp = tinp[2] + dy/2 + g_x*np.cos(dip)*np.sin(azm)
             zinp = tinp[4] + dz/2 + g_x*np.sin(dip)
 
-            # Reduce zinp to one, if ninpz is 1 (as they are all the same then)
-            if ninpz == 1:
-                zinp = zinp[:, 0]
+            # Reduce zinp to one (as they are all the same)
+            zinp = zinp[:, 0]
 
         else:  # If intpts < 3: Calculate bipole at tinp-centre for dip/azm
 
@@ -1755,6 +1913,117 @@ def get_azm_dip(inp, iz, ninpz, intpts, isdipole, strength, name, verb):
     return tout, azm, dip, g_w, intpts, inp_w
 
 
+def get_depth_groups(inp, ninpz, isdipole):
+    r"""Get groups of di-/bipoles which share the same depth(s).
+
+    This check-function is called from one of the modelling routines in
+    :mod:`empymod.model`. Consult these modelling routines for a detailed
+    description of the input parameters.
+
+    All di-/bipoles of a group can be computed in one kernel call, hence the
+    number of kernel calls scales with the number of distinct depths and not
+    with the number of di-/bipoles.
+
+    Parameters
+    ----------
+    inp : list of floats or arrays
+        Pole coordinates (m), as returned from :func:`check_bipole`.
+
+    ninpz : int
+        Number of di-/bipole depths (ninpz = 1 or npinz = ninp) (-).
+
+    isdipole : bool
+        Boolean if inp is a dipole.
+
+
+    Returns
+    -------
+    groups : list of arrays
+        Indices of the di-/bipoles of each group.
+
+    """
+
+    # If there is only one distinct depth, all in one group
+    if ninpz == 1:
+        return [np.arange(inp[0].size)]
+
+    # Depth of dipoles; depths of both poles of bipoles
+    if isdipole:
+        zinp = inp[2][:, None]
+    else:
+        zinp = np.column_stack([inp[4], inp[5]])
+
+    # Group by unique depth(s)
+    _, igroup = np.unique(zinp, axis=0, return_inverse=True)
+    igroup = igroup.ravel()
+
+    return [np.nonzero(igroup == i)[0] for i in range(igroup.max()+1)]
+
+
+def get_nlayer_truncated(depth, zsrc, zrec, etaH, zetaH, truncate):
+    r"""Get the number of layers per frequency after skin-depth truncation.
+
+    Layers many skin depths below both sources and receivers do not change the
+    result. This function returns for each frequency the number of layers
+    `nlayer` to keep, such that the interface `depth[nlayer]` and all deeper
+    interfaces are removed, and layer `nlayer-1` acts as a terminating
+    half-space.
+
+    The interface `depth[k]` is removed if the two-way attenuation from the
+    deepest source or receiver down to it is below `truncate`,
+
+    .. math::
+
+        \exp\left(-2\sum_i \Re(\sqrt{\eta_{H,i}\zeta_{H,i}})\,
+        h_i\right) < \texttt{truncate} \ ,
+
+    where :math:`h_i` is the thickness of layer :math:`i` between the deepest
+    source or receiver and `depth[k]`. This is the attenuation of the
+    reflection at `depth[k]` for zero wavenumber; the attenuation at larger
+    wavenumbers is stronger (:math:`\Re(\Gamma)` increases with the
+    wavenumber).
+
+    This function is called from :func:`empymod.model.fem`, and from
+    :func:`empymod.model.dipole` for verbose output.
+
+    Parameters
+    ----------
+    depth : array
+        Depths of layer interfaces, as returned from :func:`check_model`.
+
+    zsrc, zrec : float or array
+        Source and receiver depths (m).
+
+    etaH, zetaH : array
+        Horizontal eta and zeta, as returned from :func:`check_frequency`.
+
+    truncate : float
+        Attenuation threshold (-); no truncation if 0.
+
+
+    Returns
+    -------
+    nlayer : array of int
+        Number of layers to keep for each frequency.
+
+    """
+    nfreq, nlayer = etaH.shape
+    if truncate <= 0 or nlayer == 1:
+        return np.full(nfreq, nlayer)
+
+    # Thickness of each layer below the deepest source or receiver
+    zmax = max(np.max(zsrc), np.max(zrec))
+    thick = np.clip(depth[1:], zmax, None) - np.clip(depth[:-1], zmax, None)
+
+    # Two-way attenuation (log) down to each interface depth[1:]
+    att = np.sqrt(etaH[:, :-1]*zetaH[:, :-1]).real
+    logatt = 2*np.cumsum(att*thick, axis=1)
+
+    # Keep the layers above the first interface with negligible reflections
+    cut = logatt > -np.log(truncate)
+    return np.where(cut.any(axis=1), cut.argmax(axis=1)+1, nlayer)
+
+
 def get_kwargs(names, defaults, kwargs):
     """Return wanted parameters, check remaining.
 
@@ -1774,6 +2043,7 @@ def get_kwargs(names, defaults, kwargs):
     - ONLY analytical: solution
     - ONLY bipole, loop: mrec, recpts, strength
     - ONLY bipole, dipole, loop, gpr: ht, htarg, ft, ftarg, xdirect, loop
+    - ONLY bipole, dipole, loop: merge, truncate
     - ONLY bipole, dipole, loop, analytical: signal, squeeze
     - ONLY dipole, analytical, gpr, dipole_k: ab
     - ONLY bipole, dipole, loop, gpr, dipole_k: depth
@@ -1800,7 +2070,8 @@ def get_kwargs(names, defaults, kwargs):
     known_keys = set([
             'depth', 'ht', 'htarg', 'ft', 'ftarg', 'xdirect', 'loop', 'signal',
             'ab', 'freqtime', 'freq', 'wavenumber', 'solution', 'cf', 'gain',
-            'msrc', 'srcpts', 'mrec', 'recpts', 'strength', 'squeeze'
+            'msrc', 'srcpts', 'mrec', 'recpts', 'strength', 'squeeze',
+            'precision', 'merge', 'truncate'
     ])
 
     # Loop over wanted parameters.
@@ -1826,8 +2097,14 @@ def get_kwargs(names, defaults, kwargs):
 
 
 def printstartfinish(verb, inp=None, kcount=None):
-    r"""Print start and finish with time measure and kernel count."""
+    r"""Print start and finish with time measure and kernel count.
+
+    At the finish, the runtime ('total') and kernel count are also recorded in
+    the active :func:`empymod.kernel.profile`.
+    """
     if inp:
+        kernel._profile_stop('total', inp)
+        kernel._profile_count('kernel_calls', kcount or 0)
         if verb > 1:
             ttxt = str(timedelta(seconds=default_timer() - inp))
             ktxt = ' '
@@ -1926,6 +2203,30 @@ def get_minimum():
 
 # 4. Internal utilities
 
+def _merge_layers(depth, params, zkeep):
+    r"""Merge identical adjacent layers, except layers containing `zkeep`.
+
+    Interface `depth[i]` is removed if all `params` are the same in layers
+    `i-1` and `i`, and none of the depths in the list `zkeep` (of array_likes
+    of any size) is within these two layers (including their interfaces).
+
+    """
+    # Layers which contain a source or receiver (or have it on an interface)
+    zkeep = np.concatenate([[]] + [np.ravel(z) for z in zkeep]).astype(float)
+    bottom = np.r_[depth[1:], np.inf]
+    occupied = np.any((zkeep[:, None] >= depth) &
+                      (zkeep[:, None] <= bottom), axis=0)
+
+    # Remove the interfaces between identical, unoccupied layers (identical
+    # in all models of an ensemble)
+    params = np.array(np.broadcast_arrays(*params))
+    same = np.all(params[..., 1:] == params[..., :-1],
+                  axis=tuple(range(params.ndim-1)))
+    keep = np.r_[True, ~(same & ~occupied[1:] & ~occupied[:-1])]
+
+    return depth[keep], tuple(params[..., keep])
+
+
 def _check_shape(var, name, shape, shape2=None):
     r"""Check that <var> has shape <shape>; if false raise ValueError(name)"""
     varshape = np.shape(var)
@@ -1982,63 +2283,70 @@ def _check_min(par, minval, name, unit, verb):
 
 
 # 5. Report
-class Report(ScoobyReport):
-    r"""Print date, time, and version information.
+def _report():
+    """Return `Report`; defined on first use, as it imports scooby."""
+    from scooby import Report as ScoobyReport
 
-    Use `scooby` to print date, time, and package version information in any
-    environment (Jupyter notebook, IPython console, Python console, QT
-    console), either as html-table (notebook) or as plain text (anywhere).
+    class Report(ScoobyReport):
+        r"""Print date, time, and version information.
 
-    Always shown are the OS, number of CPU(s), `numpy`, `scipy`, `numba`,
-    `empymod`, `sys.version`, and time/date.
+        Use `scooby` to print date, time, and package version information in
+        any environment (Jupyter notebook, IPython console, Python console, QT
+        console), either as html-table (notebook) or as plain text (anywhere).
 
-    Additionally shown are, if they can be imported, `IPython`, and
-    `matplotlib`. It also shows MKL information, if available.
+        Always shown are the OS, number of CPU(s), `numpy`, `scipy`, `numba`,
+        `empymod`, `sys.version`, and time/date.
 
-    All modules provided in `add_pckg` are also shown.
+        Additionally shown are, if they can be imported, `IPython`, and
+        `matplotlib`. It also shows MKL information, if available.
 
-    .. note::
+        All modules provided in `add_pckg` are also shown.
 
-        The package `scooby` has to be installed in order to use `Report`:
-        ``pip install scooby``.
+        .. note::
 
+            The package `scooby` has to be installed in order to use `Report`:
+            ``pip install scooby``.
 
-    Parameters
-    ----------
-    add_pckg : packages, optional
-        Package or list of packages to add to output information (must be
-        imported beforehand).
 
-    ncol : int, optional
-        Number of package-columns in html table (no effect in text-version);
-        Defaults to 3.
+        Parameters
+        ----------
+        add_pckg : packages, optional
+            Package or list of packages to add to output information (must be
+            imported beforehand).
 
-    text_width : int, optional
-        The text width for non-HTML display modes
+        ncol : int, optional
+            Number of package-columns in html table (no effect in
+            text-version); Defaults to 3.
 
-    sort : bool, optional
-        Sort the packages when the report is shown
+        text_width : int, optional
+            The text width for non-HTML display modes
 
+        sort : bool, optional
+            Sort the packages when the report is shown
 
-    Examples
-    --------
-    >>> import pytest
-    >>> import dateutil
-    >>> from empymod import Report
-    >>> Report()                            # Default values
-    >>> Report(pytest)                      # Provide additional package
-    >>> Report([pytest, dateutil], ncol=5)  # Set nr of columns
 
-    """
+        Examples
+        --------
+        >>> import pytest
+        >>> import dateutil
+        >>> from empymod import Report
+        >>> Report()                            # Default values
+        >>> Report(pytest)                      # Provide additional package
+        >>> Report([pytest, dateutil], ncol=5)  # Set nr of columns
+
+        """
+
+        def __init__(self, add_pckg=None, ncol=3, text_width=80, sort=False):
+            """Initiate a scooby.Report instance."""
 
-    def __init__(self, add_pckg=None, ncol=3, text_width=80, sort=False):
-        """Initiate a scooby.Report instance."""
+            # Mandatory packages.
+            core = ['numpy', 'scipy', 'numba', 'empymod', 'libdlf']
 
-        # Mandatory packages.
-        core = ['numpy', 'scipy', 'numba', 'empymod', 'libdlf']
+            # Optional packages.
+            optional = ['IPython', 'matplotlib']
 
-        # Optional packages.
-        optional = ['IPython', 'matplotlib']
+            super().__init__(additional=add_pckg, core=core, optional=optional,
+                             ncol=ncol, text_width=text_width, sort=sort)
 
-        super().__init__(additional=add_pckg, core=core, optional=optional,
-                         ncol=ncol, text_width=text_width, sort=sort)
+    Report.__qualname__ = 'Report'
+    return Report
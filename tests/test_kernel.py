@@ -1,10 +1,14 @@
+import os
+import sys
+import subprocess
+
 import pytest
 import numpy as np
 from os.path import join, dirname
 from numpy.testing import assert_allclose
 
 from empymod import kernel
-from empymod import bipole
+from empymod import bipole, dipole
 
 # No input checks are carried out in kernel, by design. Input checks are
 # carried out in model/utils, not in the core functions kernel/transform.
@@ -48,6 +52,139 @@ def test_wavenumber(njit):                                      # 1. wavenumber
             assert out[2] is None
 
 
+def test_wavenumber_multi():
+    # Several ab's at once must be the same as one-by-one
+    dat = DATAKERNEL['wave'][()]
+    for _, val in dat.items():
+        ab_calc = [val[0], 11, 33, 16] if val[1] else [val[0], 11, 33, 13]
+        out = kernel.wavenumber_multi(ab_calc=ab_calc, msrc=val[1],
+                                      mrec=val[2], **val[3])
+        assert len(out) == len(ab_calc)
+        for iab, iout in zip(ab_calc, out):
+            res = kernel.wavenumber(ab=iab, msrc=val[1], mrec=val[2],
+                                    **val[3])
+            for i in range(3):
+                if res[i] is None:
+                    assert iout[i] is None
+                else:
+                    assert_allclose(iout[i], res[i], rtol=1e-14, atol=1e-100)
+
+
+def test_wavenumber_pairs():
+    # Several depth pairs at once must be the same as one-by-one
+    dat = DATAKERNEL['wave'][()]
+    zsrc = np.array([10., 50., 100., 149.])  # All in layer 1
+    zrec = np.array([510., 650., 599., 1000.])  # All in layer 5
+    for _, val in dat.items():
+        inp = {**val[3], 'zsrc': zsrc, 'zrec': zrec}
+        ab_calc = [val[0], 11] if val[1] else [val[0], 13]
+        out = kernel.wavenumber_pairs(ab_calc=ab_calc, msrc=val[1],
+                                      mrec=val[2], **inp)
+        assert len(out) == zsrc.size
+        for zs, zr, iout in zip(zsrc, zrec, out):
+            inp = {**val[3], 'zsrc': zs, 'zrec': zr}
+            res = kernel.wavenumber_multi(ab_calc=ab_calc, msrc=val[1],
+                                          mrec=val[2], **inp)
+            for ires, iiout in zip(res, iout):
+                for i in range(3):
+                    if ires[i] is None:
+                        assert iiout[i] is None
+                    else:
+                        assert_allclose(iiout[i], ires[i], rtol=1e-14,
+                                        atol=1e-100)
+
+
+def test_wavenumber_fused():
+    # Low-memory kernel must be the same as the default kernel
+    dat = DATAKERNEL['wave'][()]
+    for _, val in dat.items():
+        out = kernel.wavenumber_fused(ab=val[0], msrc=val[1], mrec=val[2],
+                                      **val[3])
+        res = kernel.wavenumber(ab=val[0], msrc=val[1], mrec=val[2], **val[3])
+        for i in range(3):
+            if res[i] is None:
+                assert out[i] is None
+            else:
+                assert_allclose(out[i], res[i], rtol=1e-12, atol=1e-100)
+
+    # A single row of many wavenumbers (unique lambdas) is computed in blocks
+    inp = {**dat[0][3], 'lambd': np.logspace(-6, 0, 601)[None, :]}
+    for ab in [11, 33]:
+        out = kernel.wavenumber_fused(ab=ab, msrc=False, mrec=False, **inp)
+        res = kernel.wavenumber(ab=ab, msrc=False, mrec=False, **inp)
+        assert out[1 if ab == 11 else 0].shape == (3, 1, 601)
+        for i in range(3):
+            if res[i] is not None:
+                assert_allclose(out[i], res[i], rtol=1e-12, atol=1e-100)
+
+
+def test_wavenumber_jacobian():
+    # Response must be the same as the default kernel
+    dat = DATAKERNEL['wave'][()]
+    for _, val in dat.items():
+        inp = val[3].copy()
+        dinp = {'d'+k: -inp[k] for k in ['etaH', 'etaV', 'zetaH', 'zetaV']}
+        out = kernel.wavenumber_jacobian(ab=val[0], msrc=val[1], mrec=val[2],
+                                         **inp, **dinp)
+        res = kernel.wavenumber(ab=val[0], msrc=val[1], mrec=val[2], **inp)
+        for i in range(3):
+            if res[i] is None:
+                assert out[i] is None
+            else:
+                assert_allclose(out[i][0], res[i], rtol=1e-12,
+                                atol=1e-12*np.abs(res[i]).max())
+
+    # Derivatives must agree with finite differences; w.r.t. resistivities
+    # (with anisotropy) and interfaces; src/rec in the same and in different
+    # layers, including the first and the last one.
+    depth = np.array([-np.inf, 0., 150., 300., 500.])
+    res = np.array([1e3, 0.3, 10., 2., 100.])
+    aniso = np.array([1., 1., 1.5, 2., 1.2])
+    lambd = np.logspace(-4, -1, 7)[None, :]
+    sval = 2j*np.pi*np.array([0.5, 3.])
+
+    def eta(res, depth):
+        etaH = 1/res + np.outer(sval, np.ones(5)*8.85e-12)
+        etaV = 1/(res*aniso**2) + np.outer(sval, np.ones(5)*8.85e-12)
+        zeta = np.outer(sval, np.ones(5)*4e-7*np.pi)
+        return {'depth': depth, 'etaH': etaH, 'etaV': etaV, 'zetaH': zeta,
+                'zetaV': zeta}
+
+    dinp = {'detaH': np.ones((2, 5))*(-1/res**2)+0j,
+            'detaV': np.ones((2, 5))*(-1/(res*aniso)**2)+0j,
+            'dzetaH': np.zeros((2, 5), dtype=complex),
+            'dzetaV': np.zeros((2, 5), dtype=complex)}
+
+    for ab, msrc, mrec in [[11, False, False], [13, True, True],
+                           [16, False, True], [31, False, False],
+                           [33, True, True], [35, False, True]]:
+        for zsrc, zrec, lsrc, lrec in [[50, 60, 1, 1], [200, 50, 2, 1],
+                                       [-10, 400, 0, 3], [600, -30, 4, 0],
+                                       [600, 650, 4, 4]]:
+            inp = {'zsrc': zsrc, 'zrec': zrec, 'lsrc': lsrc, 'lrec': lrec,
+                   'lambd': lambd, 'ab': ab, 'xdirect': False, 'msrc': msrc,
+                   'mrec': mrec}
+            out = kernel.wavenumber_jacobian(**inp, **eta(res, depth), **dinp)
+            for ip in range(9):
+                if ip < 5:  # Resistivities
+                    h = res[ip]*1e-4
+                    dres = np.eye(5)[ip]*h
+                    pos = eta(res+dres, depth)
+                    neg = eta(res-dres, depth)
+                else:       # Interfaces
+                    h = 1e-3
+                    ddepth = np.eye(5)[ip-4]*h
+                    pos = eta(res, depth+ddepth)
+                    neg = eta(res, depth-ddepth)
+                pos = kernel.wavenumber(**inp, **pos)
+                neg = kernel.wavenumber(**inp, **neg)
+                for i in range(3):
+                    if pos[i] is not None:
+                        assert_allclose(
+                            out[i][ip+1], (pos[i]-neg[i])/(2*h), rtol=1e-4,
+                            atol=1e-6*np.abs(out[i][ip+1]).max())
+
+
 @pytest.mark.parametrize("njit", [True, False])
 def test_greenfct(njit):                                          # 2. greenfct
     if njit:
@@ -66,6 +203,28 @@ def test_greenfct(njit):                                          # 2. greenfct
             assert_allclose(out[1], val[i+1][1])
 
 
+def test_shared_gamma():
+    # Gamma is shared between TM and TE if isotropic and non-magnetic
+    dat = DATAKERNEL['wave'][()]
+    inp = dat[0][3].copy()
+    etaH = inp['etaH']
+    zetaH = inp['zetaH']
+    assert kernel._shared_gamma(etaH, etaH.copy(), zetaH, zetaH.copy())
+    assert not kernel._shared_gamma(etaH, 2*etaH, zetaH, zetaH)
+    assert not kernel._shared_gamma(etaH, etaH, zetaH, 2*zetaH)
+
+    # Result must be the same as if not shared (etaV slightly perturbed)
+    inp['etaV'] = etaH.copy()
+    inp['zetaV'] = zetaH.copy()
+    for ab in [11, 12, 14, 16, 33]:
+        shared = kernel.wavenumber(ab=ab, msrc=False, mrec=False, **inp)
+        inp2 = {**inp, 'etaV': etaH*(1+1e-14)}
+        not_shared = kernel.wavenumber(ab=ab, msrc=False, mrec=False, **inp2)
+        for i in range(3):
+            if shared[i] is not None:
+                assert_allclose(shared[i], not_shared[i], rtol=1e-10)
+
+
 @pytest.mark.parametrize("njit", [True, False])
 def test_reflections(njit):                                    # 3. reflections
     if njit:
@@ -80,6 +239,54 @@ def test_reflections(njit):                                    # 3. reflections
         assert_allclose(Rm, val[2])
 
 
+def test_reflection_cache():                              # 3b. ReflectionCache
+    rng = np.random.default_rng(13)
+    nlayer = 8
+    depth = np.r_[-np.inf, np.arange(nlayer-1)*50.]
+    lambd = np.logspace(-4, 0, 11)[None, :]*np.ones((3, 1))
+    for lsrc, lrec in [(0, 0), (2, 5), (5, 2), (3, 3), (0, nlayer-1),
+                       (nlayer-1, 0), (nlayer-1, nlayer-1)]:
+        cache = kernel.ReflectionCache()
+        nsteps = 0
+        res = np.ones(nlayer)
+        tdepth = depth.copy()
+        for change in ['new', 'none', 'layer', 'layer', 'depth', 'all']:
+            if change == 'layer':
+                res[rng.integers(nlayer)] *= 2
+            elif change == 'depth':
+                tdepth[rng.integers(1, nlayer)] += 10
+            elif change == 'all':
+                res = rng.uniform(1, 10, nlayer)
+            etaH = 1/res + np.zeros((2, nlayer))*1j
+            etaH += 2j*np.pi*np.array([[1.], [10.]])*8.85e-12
+            etaV = etaH/np.linspace(1, 2, nlayer)
+            zetaH = 2j*np.pi*np.array([[1.], [10.]])*4e-7*np.pi*np.ones(
+                    (1, nlayer))
+            Gam = kernel._gamma(etaH, etaV, zetaH, lambd)
+            Rp, Rm = kernel.reflections(tdepth, etaH, Gam, lrec, lsrc)
+            cGam, cRp, cRm = cache.reflections(
+                    tdepth, etaH, etaV, zetaH, lambd, lrec, lsrc)
+            assert_allclose(cGam, Gam, rtol=1e-14, atol=0)
+            assert_allclose(cRp, Rp, rtol=1e-14, atol=0)
+            assert_allclose(cRm, Rm, rtol=1e-14, atol=0)
+
+            # The steps of a new entry are the ones of reflections
+            if change == 'new':
+                nsteps = cache.nsteps[0]
+                assert nsteps == nlayer-1-min(lsrc, lrec) + max(lsrc, lrec)
+            elif change == 'none':
+                assert cache.nsteps[-1] == 0
+            else:
+                assert cache.nsteps[-1] <= nsteps
+
+        # Different key or wavenumbers, new entry
+        cache.reflections(tdepth, etaH, etaV, zetaH, lambd, lrec, lsrc, 'TE')
+        assert cache.nsteps[-1] == nsteps
+        cache.reflections(tdepth, etaH, etaV, zetaH, 2*lambd, lrec, lsrc)
+        assert cache.nsteps[-1] == nsteps
+        assert '3 entries' in repr(cache)
+
+
 @pytest.mark.parametrize("njit", [True, False])
 def test_fields(njit):                                              # 4. fields
     if njit:
@@ -172,5 +379,153 @@ def test_halfspace():                                            # 7. halfspace
     assert_allclose(direct, hs_res, atol=1e-2)
 
 
+def test_num_threads():                                        # 8. num_threads
+    # Default, set, and context manager
+    assert kernel.get_num_threads() == 1
+    kernel.set_num_threads(2)
+    assert kernel.get_num_threads() == 2
+    with kernel.num_threads(3):
+        assert kernel.get_num_threads() == 3
+    assert kernel.get_num_threads() == 2
+    kernel.set_num_threads(1)
+
+    # Wrong input
+    with pytest.raises(ValueError, match="<n> must be a positive integer"):
+        kernel.set_num_threads(0)
+    with pytest.raises(ValueError, match="<n> must be a positive integer"):
+        kernel.set_num_threads(1.5)
+
+    # Threaded kernels must be the same as the single-threaded ones
+    dat = DATAKERNEL['wave'][()]
+    for _, val in dat.items():
+        inp = val[3]
+        args = (inp['zsrc'], inp['zrec'], inp['lsrc'], inp['lrec'],
+                inp['depth'], inp['etaH'], inp['etaV'], inp['zetaH'],
+                inp['zetaV'], inp['lambd'], val[0], inp['xdirect'], val[1],
+                val[2])
+        res = kernel.wavenumber(*args)
+        with kernel.num_threads(2):
+            out = kernel.call_threaded(kernel.wavenumber, *args)
+            outf = kernel.call_threaded(kernel.wavenumber_fused, *args)
+            outm = kernel.call_threaded(kernel.wavenumber_multi, *args[:10],
+                                        [val[0], val[0]], *args[11:])
+            outp = kernel.call_threaded(
+                    kernel.wavenumber_pairs, np.r_[args[0], args[0]],
+                    np.r_[args[1], args[1]], *args[2:10], [val[0]],
+                    *args[11:])
+        for i in range(3):
+            for tout in [out, outf, outm[0], outm[1], outp[0][0], outp[1][0]]:
+                if res[i] is None:
+                    assert tout[i] is None
+                else:
+                    atol = 1e-13*abs(res[i]).max()
+                    assert_allclose(tout[i], res[i], rtol=1e-12, atol=atol)
+
+
+def test_num_threads_fresh_cache(tmp_path):
+    # The multi-threaded fused kernel must compile and run with an empty
+    # numba cache, and again when the serial kernels are loaded from it.
+    script = """if True:
+        import numpy as np
+        import empymod
+        inp = {'src': [0, 0, 100], 'rec': [np.arange(1, 41)*100, 0, 150],
+               'depth': [0, 200], 'res': [2e14, 1, 10], 'freqtime': 1,
+               'verb': 1}
+        for ab in [11, 13, 33]:
+            res = empymod.dipole(ab=ab, **inp)
+            with empymod.num_threads(2):
+                out = empymod.dipole(ab=ab, htarg={'kernel': 'fused'}, **inp)
+            np.testing.assert_allclose(out, res, rtol=1e-10)
+    """
+    env = {**os.environ, 'NUMBA_CACHE_DIR': str(tmp_path)}
+    for _ in range(2):  # Cold and warm cache
+        out = subprocess.run([sys.executable, '-c', script], env=env,
+                             capture_output=True)
+        assert out.returncode == 0, out.stderr.decode()
+
+
+def test_profile():
+    inp = {'src': [0, 0, 100], 'rec': [np.arange(1, 6)*500, np.zeros(5), 200],
+           'depth': [0, 300], 'res': [2e14, 1, 10], 'verb': 1}
+
+    # Without context nothing is recorded
+    assert getattr(kernel._local_profile, 'prof', None) is None
+
+    # DLF, frequency and time domain
+    with kernel.profile() as prof:
+        dipole(freqtime=[0.1, 1], **inp)
+        dipole(freqtime=[1, 2], signal=0, **inp)
+    assert getattr(kernel._local_profile, 'prof', None) is None
+    for stage in ['total', 'check', 'fem', 'kernel', 'dlf', 'fourier']:
+        assert prof.times[stage] > 0
+    assert prof.calls['total'] == 2
+    assert prof.calls['fourier'] == 1
+    assert prof.times['total'] >= prof.times['fem'] + prof.times['check']
+    assert prof.counts['kernel_calls'] == prof.calls['kernel']
+    assert prof.counts['splines'] == prof.calls['spline']
+    assert prof.counts['lambdas'] > 0
+    assert prof.qwe == []
+
+    # QWE: intervals and convergence per offset and frequency
+    with kernel.profile() as prof:
+        with kernel.profile() as inner:  # Nested: inner one records
+            dipole(freqtime=[0.1, 1, 10], ht='qwe', **inp)
+        assert 'total' not in prof.times
+        dipole(freqtime=[0.1, 1, 10], ht='qwe', **inp)
+    for p in [prof, inner]:
+        assert len(p.qwe) == 3
+        assert p.qwe[0]['intervals'].shape == (5, )
+        assert p.qwe[0]['converged'].all()
+        assert p.counts['qwe_intervals'] == sum(
+                q['intervals'].sum() for q in p.qwe)
+        assert p.counts['kernel_calls'] == p.calls['kernel'] - 3
+
+    # Structured output
+    out = prof.to_dict()
+    assert out['times'] == prof.times
+    assert out['qwe'][0]['intervals'] == prof.qwe[0]['intervals'].tolist()
+    assert 'kernel_size_max' in repr(prof)
+
+
+def test_precompile(tmp_path):
+    # Cold: compiles into the provided cache directory; warm: loads all
+    # signatures from it; in both cases typical calls compile nothing more.
+    script = f"""if True:
+        import numba as nb
+        import numpy as np
+        import empymod
+        from empymod.scripts import tmtemod
+        nsig = empymod.kernel.precompile({str(tmp_path)!r}, 'double')
+        disp = {{f for m in [vars(empymod.kernel), vars(tmtemod)]
+                 for f in m.values()
+                 if isinstance(f, nb.core.dispatcher.Dispatcher)}}
+        assert sum(len(f.signatures) for f in disp) == nsig
+        inp = {{'src': [0, 0, 200], 'rec': [np.arange(1, 21)*100, 0, 250],
+               'depth': [0, 300, 500], 'res': [2e14, 1, 10, 100],
+               'freqtime': [0.1, 1, 10], 'verb': 1}}
+        empymod.dipole(**inp)
+        empymod.dipole(ab='all', **inp)
+        empymod.dipole(htarg={{'kernel': 'fused'}}, **inp)
+        empymod.bipole(**{{**inp, 'src': [0, 0, 0, 0, 200, 210],
+                          'rec': [np.arange(1, 21)*100, 0, 250, 0, 0]}})
+        assert sum(len(f.signatures) for f in disp) == nsig
+        print(nsig, sum(f.stats.cache_hits.total() for f in disp),
+              sum(f.stats.cache_misses.total() for f in disp))
+    """
+    env = {k: v for k, v in os.environ.items() if k != 'NUMBA_CACHE_DIR'}
+    out = []
+    for _ in range(2):  # Cold and warm cache
+        res = subprocess.run([sys.executable, '-c', script], env=env,
+                             capture_output=True)
+        assert res.returncode == 0, res.stderr.decode()
+        out.append([int(i) for i in res.stdout.split()])
+    assert len(list(tmp_path.rglob('*.nbi'))) > 0
+    # (Warm, only the functions called from Python are loaded, not their
+    # callees, which are part of the cached functions.)
+    assert out[0][0] > out[1][0] > 0
+    assert out[1][1] == out[1][0]  # All loaded from the cache
+    assert out[1][2] == 0
+
+
 def test_all_dir():
     assert set(kernel.__all__) == set(dir(kernel))
@@ -6,7 +6,7 @@ from numpy.testing import assert_allclose
 
 # Import main modelling routines from empymod directly to ensure they are in
 # the __init__.py-file.
-from empymod import model
+from empymod import model, kernel, transform
 from empymod import bipole, dipole, analytical, loop
 # Import rest from model
 from empymod.model import gpr, dipole_k, fem, tem
@@ -288,16 +288,29 @@ class TestBipole:
         out, _ = capsys.readouterr()
         assert "Hankel          :  DLF (Fast Hankel Transform)" in out
         assert "  > DLF type    :  Lagged Convolution" in out
-        assert "Loop over       :  Frequencies" in out
+        assert "Loop over       :  None" in out
         assert_allclose(dlf, dlf2, rtol=1e-4)
 
+        # Vectorized lagged convolution equals looping over frequencies
+        dlf2f = bipole(ht='dlf', htarg={'pts_per_dec': -1}, loop='freq', **inp)
+        assert_allclose(dlf2, dlf2f, rtol=1e-10)
+
+        # Low-memory kernel equals the default kernel (rotated: several ab)
+        rinp = {**inp, 'src': [0, 0, 0, 20, 30]}
+        dlff = bipole(ht='dlf', htarg={'kernel': 'fused'}, **rinp)
+        assert_allclose(dlff, bipole(ht='dlf', **rinp), rtol=1e-12)
+
         dlf3 = bipole(ht='dlf', htarg={'pts_per_dec': 40}, verb=3, **inp)
         out, _ = capsys.readouterr()
         assert "Hankel          :  DLF (Fast Hankel Transform)" in out
         assert "  > DLF type    :  Splined, 40.0 pts/dec" in out
-        assert "Loop over       :  Frequencies" in out
+        assert "Loop over       :  None" in out
         assert_allclose(dlf, dlf3, rtol=1e-3)
 
+        # Vectorized splined DLF equals looping over frequencies
+        dlf3f = bipole(ht='dlf', htarg={'pts_per_dec': 40}, loop='freq', **inp)
+        assert_allclose(dlf3, dlf3f, rtol=1e-10)
+
         qwe = bipole(ht='qwe', htarg={'pts_per_dec': 0}, verb=3, **inp)
         out, _ = capsys.readouterr()
         assert "Hankel          :  Quadrature-with-Extrapolation" in out
@@ -501,6 +514,112 @@ class TestBipole:
         assert_allclose(out0f, out1f)
         assert_allclose(out0t, out1t)
 
+    def test_depth_groups(self):
+        # Many sources and receivers at a few depths, computed per depth
+        # group; compare to computing each src-rec pair on its own.
+        model = {
+            'depth': [0, 100, 300],
+            'res': [2e14, 1, 10, 3],
+            'freqtime': [0.1, 1.0],
+            'verb': 1}
+        src = [[0, 10, 0], [0, 5, 7], [50, 350, 350], 0, 30]
+        x = np.arange(6)*100+500.
+        z = np.repeat([120., 160.], 3)
+        rec = [x, x+50, np.zeros(6), np.ones(6)*20, z, z+[0, 0, 0, 5, 5, 5]]
+
+        out = bipole(src=src, rec=rec, recpts=3, **model)
+        for i in range(6):
+            for ii in range(3):
+                tsrc = [src[0][ii], src[1][ii], src[2][ii], 0, 30]
+                trec = [rec[j][i] for j in range(6)]
+                tout = bipole(src=tsrc, rec=trec, recpts=3, **model)
+                assert_allclose(out[:, i, ii], tout, rtol=1e-12)
+
+    def test_depth_pairs(self, capsys):
+        # Receivers at several depths of the same position, and the
+        # integration points of a vertical source bipole, share the offsets;
+        # the depth pairs in the same layers are computed at once.
+        model = {
+            'depth': [0, 100, 300],
+            'res': [2e14, 1, 10, 3],
+            'freqtime': [0.1, 1.0],
+            'verb': 2}
+        src = [0, 0, 0, 0, 120, 180]
+        z = np.array([110., 150., 200., 250., 350., 400.])
+        rec = [np.ones(6)*500, np.ones(6)*100, z, 30, 10]
+
+        _, _ = capsys.readouterr()
+        out = bipole(src=src, rec=rec, srcpts=3, **model)
+        outstr, _ = capsys.readouterr()
+        assert "2 kernel call(s)" in outstr
+
+        # The fused kernel computes each depth pair on its own
+        fused = bipole(src=src, rec=rec, srcpts=3, htarg={'kernel': 'fused'},
+                       **model)
+        assert_allclose(out, fused, rtol=1e-12)
+
+    def test_reflection_cache(self):
+        # Successive calls with changing layers, with and without the
+        # incremental reflections; rotated bipoles (several ab's and depth
+        # pairs) and a single dipole (one ab).
+        model = {
+            'depth': np.arange(10)*50.,
+            'freqtime': [0.1, 1.0],
+            'verb': 1}
+        inp = [{'src': [0, 0, 120, 160, 30, 10], 'srcpts': 3,
+                'rec': [[500, 600], [100, 0], [220, 230], 30, 10]},
+               {'src': [0, 0, 120, 0, 0],
+                'rec': [[500, 600], [100, 0], 320, 0, 0]}]
+        for tinp in inp:
+            cache = kernel.ReflectionCache()
+            res = np.ones(11)
+            for change in [None, None, 10, 4, 1]:
+                if change is not None:
+                    res[change] *= 2
+                nsteps = len(cache.nsteps)
+                out = bipole(res=res, htarg={'cache': cache}, **tinp, **model)
+                orig = bipole(res=res, **tinp, **model)
+                assert_allclose(out, orig, rtol=1e-12)
+
+                # Nothing changed in the second call
+                if nsteps > 0 and change is None:
+                    assert sum(cache.nsteps[nsteps:]) == 0
+
+    def test_hankel_plan(self):
+        # Successive calls with changing layers with a plan, for the standard,
+        # lagged convolution, and splined DLF; rotated bipoles (several ab's
+        # and depth pairs), and a dipole together with a cache.
+        model = {
+            'depth': np.arange(5)*50.,
+            'freqtime': [0.1, 1.0],
+            'verb': 1}
+        src = [0, 0, 120, 160, 30, 10]
+        rec = [[500, 600, 0], [100, 0, 700], [220, 230, 240], 30, 10]
+        drec = [[500, 600, 0], [100, 0, 700], 240]
+        for pts_per_dec in [0, -1, 10]:
+            htarg = {'pts_per_dec': pts_per_dec}
+            plan = transform.HankelPlan(htarg)
+            cache = kernel.ReflectionCache()
+            for fact in [1, 2, 3]:
+                res = np.r_[2e14, np.arange(1, 6)*fact]
+                out = bipole(src=src, rec=rec, srcpts=3, res=res,
+                             htarg={'plan': plan}, **model)
+                orig = bipole(src=src, rec=rec, srcpts=3, res=res,
+                              htarg=htarg, **model)
+                assert_allclose(out, orig, rtol=1e-12)
+                out = dipole(src=src[:3], rec=drec, res=res, ab=13,
+                             htarg={'plan': plan, 'cache': cache}, **model)
+                orig = dipole(src=src[:3], rec=drec, res=res, ab=13,
+                              htarg=htarg, **model)
+                assert_allclose(out, orig, rtol=1e-12)
+
+            # The geometries are stored once, independent of the model
+            ngeom = len(plan._points)
+            assert f"{ngeom} geometries" in repr(plan)
+            bipole(src=src, rec=rec, srcpts=3, res=res*2,
+                   htarg={'plan': plan}, **model)
+            assert len(plan._points) == ngeom
+
     def test_cole_cole(self):
         # Check user-hook for eta/zeta
 
@@ -611,7 +730,7 @@ class TestBipole:
         assert "* WARNING :: `etaH != etaV` at receiver level, " in out
 
 
-def test_dipole():
+def test_dipole(capsys):
     # As this is a subset of bipole, just run two tests to ensure
     # it is equivalent to bipole.
 
@@ -682,6 +801,30 @@ def test_dipole():
     outzeta = dipole(res=zeta, signal=0, mpermH=fact, mpermV=fact, **model)
     assert_allclose(standard, outzeta)
 
+    # 4. Full tensor
+    model = {'src': [[0, 100], [0, 50], 150], 'depth': [0, 300, 1000],
+             'rec': [[500, 1000, 1500], [0, 100, 200], 200], 'verb': 0,
+             'res': [1e20, 0.3, 1, 50], 'aniso': [1, 1, 2, 1]}
+    for inp in [{'freqtime': [0.1, 1]}, {'freqtime': 1, 'signal': 0}]:
+        tensor = dipole(ab='all', **inp, **model)
+        assert tensor.shape[:2] == (6, 6)
+        for a in range(1, 7):
+            for b in range(1, 7):
+                single = dipole(ab=10*a+b, **inp, **model)
+                assert_allclose(tensor[a-1, b-1], single, rtol=1e-14)
+
+    # 5. Pruning of negligible lambdas: same result, report skipped lambdas
+    model = {'src': [0, 0, 0.001], 'rec': [np.arange(1, 11)/4, 0, 0.5],
+             'depth': [0, 1], 'res': [2e14, 200, 20], 'epermH': [1, 9, 15],
+             'epermV': [1, 9, 15], 'freqtime': [1e8, 1e9], 'verb': 3}
+    standard = dipole(**model)
+    _, _ = capsys.readouterr()
+    pruned = dipole(htarg={'prune': 1e-10}, **model)
+    out, _ = capsys.readouterr()
+    assert "   Pruned lambdas  :  " in out
+    assert " 0 of " not in out
+    assert_allclose(pruned, standard, rtol=0, atol=1e-8*abs(standard).max())
+
 
 def test_all_depths():
     # Test RHS/LHS low-to-high/high-to-low
@@ -723,6 +866,114 @@ def test_all_depths():
     assert_allclose(lhs_l2h, rhs_h2l)
 
 
+def test_merge(capsys):
+    # Blocky model of many thin layers; merging identical adjacent layers must
+    # not change the result.
+    depth = np.r_[0, np.arange(1, 40)*10.]
+    res = np.r_[2e14, np.repeat([1., 10., 3., 100.], 10)]
+    aniso = np.r_[1, np.repeat([1., 1., 2., 1.], 10)]
+    model = {'depth': depth, 'res': res, 'aniso': aniso,
+             'freqtime': [0.1, 10.], 'verb': 3}
+
+    # Dipole; receivers in merged layers, and on an interface
+    inp = {'src': [0, 0, 125], 'rec': [[500, 800, 1000], [0, 0, 0], 255],
+           'ab': 13, **model}
+    orig = dipole(**inp)
+    _, _ = capsys.readouterr()
+    merged = dipole(merge=True, **inp)
+    out, _ = capsys.readouterr()
+    assert "   Merged layers   :  41 -> 9" in out
+    assert_allclose(merged, orig, rtol=1e-12)
+
+    # Finite bipoles over several layers, source and receiver in the same
+    # layer (direct field in the frequency domain)
+    for xdirect in [True, False]:
+        inp = {'src': [0, 0, 0, 0, 112, 157],
+               'rec': [[500, 800], [900, 1000], [0, 0], [100, 0], 114, 116],
+               'srcpts': 5, 'xdirect': xdirect, **model}
+        orig = bipole(**inp)
+        merged = bipole(merge=True, **inp)
+        assert_allclose(merged, orig, rtol=1e-12)
+
+    # Loop
+    inp = {'src': [0, 0, 45, 0, 90], 'rec': [500, 0, 355, 0, 90], **model}
+    assert_allclose(loop(merge=True, **inp), loop(**inp), rtol=1e-12)
+
+
+def test_truncate(capsys):
+    # Skin-depth truncation of deep layers; compare to the full model
+    depth = np.r_[0, np.arange(1, 60)*10.]
+    res = np.r_[2e14, np.resize([1., 10., 3., 100.], 60)]
+    model = {'depth': depth, 'res': res, 'freqtime': np.logspace(-1, 5, 7),
+             'verb': 3}
+
+    # Dipole; several frequency groups with different number of layers
+    inp = {'src': [0, 0, 5], 'rec': [[300, 600], [0, 0], 15], **model}
+    orig = dipole(**inp)
+    _, _ = capsys.readouterr()
+    trunc = dipole(truncate=1e-15, **inp)
+    out, _ = capsys.readouterr()
+    assert "   Truncated model :  " in out
+    assert "of 61 layers [min-max]" in out
+    assert_allclose(trunc, orig, rtol=1e-10, atol=1e-10*abs(orig).max())
+
+    # Looping over frequencies and offsets, and all ab's at once
+    for tloop in ['freq', 'off']:
+        trunc = dipole(truncate=1e-15, loop=tloop, **inp)
+        assert_allclose(trunc, orig, rtol=1e-10, atol=1e-10*abs(orig).max())
+    inp['verb'] = 1
+    orig = dipole(ab='all', **inp)
+    trunc = dipole(ab='all', truncate=1e-15, **inp)
+    assert_allclose(trunc, orig, rtol=1e-10, atol=1e-10*abs(orig).max())
+
+    # Bipole and loop
+    inp = {'src': [0, 0, 0, 100, 5, 6], 'rec': [500, 0, 7, 30, 10], **model,
+           'verb': 1}
+    orig = bipole(**inp)
+    trunc = bipole(truncate=1e-15, **inp)
+    assert_allclose(trunc, orig, rtol=1e-10, atol=1e-10*abs(orig).max())
+    inp['src'] = [0, 0, 5, 0, 90]
+    orig = loop(**inp)
+    trunc = loop(truncate=1e-15, **inp)
+    assert_allclose(trunc, orig, rtol=1e-10, atol=1e-10*abs(orig).max())
+
+
+def test_ensemble(capsys, monkeypatch):
+    # Ensemble of models; compare to one model at a time
+    rng = np.random.default_rng(1)
+    res = np.c_[np.full(5, 2e14), 10**rng.uniform(-1, 2, (5, 3))]
+    aniso = 10**rng.uniform(0, 0.3, (5, 4))
+    inp = {'src': [0, 0, 100], 'rec': [[500, 800, 1000], [0, 0, 0], 200],
+           'depth': [0, 150, 400], 'verb': 1}
+    for kwargs in [{'freqtime': [0.1, 1., 10.]},
+                   {'freqtime': [0.1, 1.], 'ab': 'all'},
+                   {'freqtime': [1., 3.], 'signal': 1, 'aniso': aniso},
+                   {'freqtime': 1., 'ht': 'qwe', 'ab': 33}]:
+        ani = kwargs.pop('aniso', np.ones((5, 4)))
+        orig = np.array([dipole(res=r, aniso=a, **kwargs, **inp)
+                         for r, a in zip(res, ani)])
+        ens = dipole(res=res, aniso=ani, **kwargs, **inp)
+        assert ens.shape == orig.shape
+        assert_allclose(ens, orig, rtol=1e-12)
+
+    # Chunks of two models
+    orig = np.array([dipole(res=r, freqtime=[0.1, 1., 10.], **inp)
+                     for r in res])
+    monkeypatch.setattr(model, '_ensemble_memory', 1e6)
+    ens = dipole(res=res, freqtime=[0.1, 1., 10.], **{**inp, 'verb': 3})
+    out, _ = capsys.readouterr()
+    assert "   Ensemble        :  5 models" in out
+    assert "   Ensemble chunks :  3 of up to 2 models" in out
+    assert_allclose(ens, orig, rtol=1e-12)
+
+    # The model dimension is not squeezed
+    assert dipole(res=res[:1], freqtime=1, **inp).shape == (1, 3)
+
+    # Only dipole takes an ensemble
+    with pytest.raises(ValueError, match='Parameter res has wrong shape'):
+        bipole(res=res, freqtime=1, **inp)
+
+
 def test_coordinate_systems():
     srcLHS = (0, 0, -10)
     srcRHS = (0, 0, +10)
@@ -847,6 +1098,17 @@ class TestLoop:
         assert '* WARNING :: `mpermH != mpermV` at source level, ' in out
         assert '* WARNING :: `mpermH != mpermV` at receiver level, ' in out
 
+        # 1.e: msrc-mrec; sources in different layers, nsrc==nsrcz; the loop
+        # factor is the one of the layer of each source.
+        rec = [100, 0, 250, 23, -50]
+        src = [[0, 0], [0, 0], [100, 300], 45, 33]
+        mpermH = [1, 2, 3]
+        loo = loop(src, rec, depth, res, freq, mpermH=mpermH, mpermV=mpermH)
+        bip = bipole(src, rec, depth, res, freq, msrc=True, mrec=True,
+                     mpermH=mpermH, mpermV=mpermH)
+        bip *= 2j*np.pi*freq[:, None]*4e-7*np.pi*np.array([2, 3])
+        assert_allclose(bip, loo, rtol=1e-4, atol=1e-18)
+
     def test_iso_fs(self):
         # 2. Test with isotropic full-space solution, Ward and Hohmann, 1988.
         # => em with ab=24; Eq. 2.58, Ward and Hohmann, 1988.
@@ -1073,6 +1335,69 @@ def test_dipole_k():
     assert_allclose(w_res1, np.zeros(res['PJ1'].shape, dtype=np.complex128))
 
 
+def test_dipole_jacobian():
+    inp = {'src': [0, 0, 250],
+           'rec': [[1000, 2000, 4000], [0, 500, 1000], 300],
+           'depth': [0, 200, 500, 800], 'res': [2e2, 1, 3, 50, 2],
+           'aniso': [1, 1, 1.5, 2, 1], 'freqtime': [0.1, 1.], 'verb': 1}
+
+    def check(inp):
+        # Response must be the same as dipole, derivatives as FD.
+        EM, dres, ddepth = model.dipole_jacobian(**inp)
+        assert_allclose(EM, dipole(**inp), rtol=1e-10)
+        res = np.array(inp['res'], dtype=float)
+        depth = np.array(inp['depth'], dtype=float)
+        for i in range(res.size):
+            h = res[i]*1e-4
+            dres_i = np.eye(res.size)[i]*h
+            fd = dipole(**{**inp, 'res': res+dres_i})
+            fd -= dipole(**{**inp, 'res': res-dres_i})
+            assert_allclose(dres[i], fd/(2*h), rtol=1e-6)
+        for i in range(depth.size):
+            ddepth_i = np.eye(depth.size)[i]*1e-2
+            fd = dipole(**{**inp, 'depth': depth+ddepth_i})
+            fd -= dipole(**{**inp, 'depth': depth-ddepth_i})
+            assert_allclose(ddepth[i], fd/2e-2, rtol=1e-6)
+
+    # Various ab's, src/rec configurations, DLF types, and time domain
+    check({**inp, 'ab': 13})
+    check({**inp, 'ab': 62, 'src': [0, 0, 900], 'rec': [4000, 500, -10]})
+    check({**inp, 'ab': 11, 'htarg': {'pts_per_dec': -1}})
+    check({**inp, 'ab': 44, 'htarg': {'pts_per_dec': 10}})
+    check({**inp, 'ab': 11, 'freqtime': [1., 2.], 'signal': 1,
+           'ftarg': {'pts_per_dec': -1}})
+    check({**inp, 'ab': 11, 'xdirect': None})  # Only reflected fields
+
+    # Reversed depths: derivatives in the order of the input
+    EM, dres, ddepth = model.dipole_jacobian(**inp)
+    rev = {**inp, 'depth': inp['depth'][::-1], 'res': inp['res'][::-1],
+           'aniso': inp['aniso'][::-1]}
+    EM2, dres2, ddepth2 = model.dipole_jacobian(**rev)
+    assert_allclose(EM2, EM)
+    assert_allclose(dres2, dres[::-1])
+    assert_allclose(ddepth2, ddepth[::-1])
+
+    # Shapes: no squeeze, fullspace
+    out = model.dipole_jacobian(**inp, squeeze=False)
+    assert out[0].shape == (2, 3, 1)
+    assert out[1].shape == (5, 2, 3, 1)
+    assert out[2].shape == (4, 2, 3, 1)
+    out = model.dipole_jacobian(**{**inp, 'depth': [], 'res': 3,
+                                   'aniso': None})
+    assert out[1].shape == (1, 2, 3)
+    assert out[2].shape == (0, 2, 3)
+
+    # Not implemented
+    with pytest.raises(ValueError, match="only implemented for ht='dlf'"):
+        model.dipole_jacobian(**inp, ht='qwe')
+    with pytest.raises(ValueError, match="analytical direct field"):
+        model.dipole_jacobian(**inp, xdirect=True)
+    with pytest.raises(ValueError, match="cannot be a dict"):
+        model.dipole_jacobian(**{**inp, 'res': {'res': inp['res']}})
+    with pytest.raises(ValueError, match="ab>='all'"):
+        model.dipole_jacobian(**inp, ab='all')
+
+
 def test_ip_and_q(capsys):
     # Very simple tests; the function is only a wrapper, so we just test
     # the functionality.
@@ -1182,6 +1507,43 @@ def test_regres():
         assert_allclose(res, val[1], 3e-2, 1e-17, True)
 
 
+def test_precision():
+    # Single precision against the regression data: the error relative to
+    # the maximum amplitude is below 1e-4 for 90 % of the cases.
+    dat = REGRES['res'][()]
+    error = []
+    for key in list(dat)[::12]:  # Subset, to keep it fast
+        inp, ref = dat[key]
+        res = dipole(precision='single', **inp)
+        assert res.dtype == np.complex64
+        if np.any(ref != 0):
+            error.append(np.max(abs(res-ref))/np.max(abs(ref)))
+    assert np.percentile(error, 90) < 1e-4
+
+    # Time domain, other Hankel DLF's, and bipole/loop
+    inp = {'src': [0, 0, 250],
+           'rec': [np.arange(1, 11)*500, np.zeros(10), 300],
+           'depth': [0, 300, 1000, 1050], 'res': [1e20, .3, 1, 50, 1],
+           'freqtime': [0.1, 1, 10], 'verb': 0}
+    for kwargs in [{'signal': 0}, {'signal': 1, 'ftarg': {'pts_per_dec': -1}},
+                   {'htarg': {'pts_per_dec': -1}},
+                   {'htarg': {'pts_per_dec': 10}},
+                   {'htarg': {'kernel': 'fused'}}]:
+        double = dipole(**inp, **kwargs)
+        single = dipole(**inp, **kwargs, precision='single')
+        dtype = np.float32 if 'signal' in kwargs else np.complex64
+        assert single.dtype == dtype
+        assert_allclose(single, double, rtol=1e-4, atol=1e-5*abs(double).max())
+
+    inp['rec'] = [*inp['rec'], 0, 0]
+    for func, src in [(bipole, [0, 0, 250, 0, 0]), (loop, [0, 0, 250, 0, 90])]:
+        double = func(**{**inp, 'src': src})
+        single = func(**{**inp, 'src': src}, precision='single')
+        assert isinstance(single, model.EMArray)
+        assert single.dtype == np.complex64
+        assert_allclose(single, double, rtol=1e-4, atol=1e-5*abs(double).max())
+
+
 class TestSqueeze:
 
     def test_bipole(self):
@@ -51,13 +51,32 @@ def test_dipole():
             # Check
             assert_allclose(out, TM + TE, rtol=1e-5, atol=1e-50)
 
-    # Check the 3 errors
+    # Several frequencies at once, and looping over frequencies or offsets
+    inp = {'src': [0, 0, 90], 'rec': [[1000, 2000, 4000], [0, 500, 0], 110],
+           'depth': depth[1:-1], 'res': res, 'freqtime': [0.1, 1, 10],
+           'aniso': aniso, 'verb': 0}
+    TM, TE = tmtemod.dipole(**inp)
+    assert TM[0].shape == TE[4].shape == (3, 3)
+    out = dipole(xdirect=False, **inp)
+    assert_allclose(out, np.sum(TM, axis=0) + np.sum(TE, axis=0), rtol=1e-5)
+    for f in range(3):
+        TMf, TEf = tmtemod.dipole(**{**inp, 'freqtime': inp['freqtime'][f]})
+        assert_allclose(np.array(TMf), np.array(TM)[:, f], rtol=1e-12)
+        assert_allclose(np.array(TEf), np.array(TE)[:, f], rtol=1e-12)
+    for loop in ['freq', 'off']:
+        TMl, TEl = tmtemod.dipole(loop=loop, **inp)
+        assert_allclose(TMl, TM, rtol=1e-12)
+        assert_allclose(TEl, TE, rtol=1e-12)
+
+    # Lagged convolution DLF
+    TMl, TEl = tmtemod.dipole(htarg={'pts_per_dec': -1}, **inp)
+    assert_allclose(TMl, TM, rtol=1e-3, atol=1e-4*abs(np.array(TM)).max())
+    assert_allclose(TEl, TE, rtol=1e-3, atol=1e-4*abs(np.array(TE)).max())
+
+    # Check the 2 errors
     with pytest.raises(ValueError, match='src and rec must be in the same l'):
         tmtemod.dipole([0, 0, 90], [4000, 0, 180], depth[1:-1], res, 1)
 
-    with pytest.raises(ValueError, match='only one frequency permitted'):
-        tmtemod.dipole([0, 0, 90], [4000, 0, 110], depth[1:-1], res, [1, 10])
-
     with pytest.raises(ValueError, match='model must have more than one lay'):
         tmtemod.dipole([0, 0, 90], [4000, 0, 110], [], 10, 1)
 
@@ -84,6 +103,23 @@ def test_greenfct():
         assert_allclose(out2, TE)
 
 
+def test_wavenumber():
+    # Compiled version against the NumPy version of the split Green's fct
+    for lay in [0, 1, 5]:  # src/rec in first, second, and last layer
+        inp = {'depth': depth[:-1], 'lambd': lambd,
+               'etaH': etaH, 'etaV': etaV,
+               'zetaH': zeta, 'zetaV': zeta,
+               'lrec': lay, 'lsrc': lay,
+               'zsrc': depth[lay+1]-50, 'zrec': depth[lay+1]-10}
+        PJ0, PJ1, PJ0b = tmtemod.wavenumber(**inp)
+        TM, TE = tmtemod.greenfct(**inp)
+        for i, val in enumerate(TM + TE):
+            assert_allclose(PJ1[i], -val/(4*np.pi), atol=1e-100)
+            assert_allclose(PJ0b[i], val*lambd/(8*np.pi), atol=1e-100)
+            sign = 1 if i < 5 else -1
+            assert_allclose(PJ0[i], sign*PJ0b[i], atol=1e-100)
+
+
 def test_fields():
     Gam = np.sqrt((etaH/etaV)[:, None, :, None] *
                   (lambd**2)[None, :, None, :] + (zeta**2)[:, None, :, None])
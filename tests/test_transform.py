@@ -1,3 +1,6 @@
+import sys
+import subprocess
+
 import pytest
 import numpy as np
 from os.path import join, dirname
@@ -288,6 +291,154 @@ def test_get_dlf_points():                                  # 9. get_dlf_points
     assert_allclose(out, ffilt.base/inp[:, None])
 
 
+def test_get_dlf_unique():                                  # get_dlf_unique
+    # Offsets: repeated, related by the filter spacing factor, and arbitrary
+    filt = filters.Hankel().key_201_2009
+    off = np.array([100, 100, 100*np.squeeze(filt.factor)**3, 123.4])
+    lambd, _ = transform.get_dlf_points(filt, off, 0)
+    ulambd, ilambd = transform.get_dlf_unique(lambd)
+
+    # Sorted, and reconstructs the lambdas
+    assert np.all(np.diff(ulambd) > 0)
+    assert_allclose(ulambd[ilambd].reshape(lambd.shape), lambd, rtol=1e-12)
+
+    # 201 for the first, 3 more for the third, and 201 for the last offset
+    assert ulambd.size == 201 + 3 + 201
+
+    # The DLF result is unchanged
+    depth = np.array([-np.inf, 0, 200])
+    eta = np.array([[1/2e14, 1, 1/10]], dtype=complex)
+    zeta = np.ones((1, 3))*2j*np.pi*4e-7*np.pi
+    model = (eta, eta, zeta, zeta, False, {'dlf': filt, 'pts_per_dec': 0},
+             False, False)
+    fEM = transform.hankel_dlf(50., 150., 1, 1, off, np.zeros(4), depth, 11,
+                               *model)[0]
+    for i in range(4):
+        tfEM = transform.hankel_dlf(50., 150., 1, 1, off[i:i+1], np.zeros(1),
+                                    depth, 11, *model)[0]
+        assert_allclose(fEM[:, i], tfEM[:, 0], rtol=1e-10)
+
+
+def test_get_dlf_unique_fused():
+    # The fused kernel on the single row of unique lambdas (one repeated
+    # offset) must not allocate (nlayer, all unique lambdas) arrays: 300
+    # layers and ~60'000 lambdas would need > 250 MB for Gamma alone.
+    script = """if True:
+        import resource
+        import numpy as np
+        from empymod import transform, filters
+
+        def run(nlayer, noff):
+            off = np.r_[100, np.linspace(100, 10000, noff)]
+            depth = np.r_[-np.inf, np.arange(nlayer-1)*10.]
+            eta = 1/np.linspace(1, 100, nlayer)[None, :]+0j
+            zeta = np.ones((1, nlayer))*2j*np.pi*4e-7
+            htarg = {'dlf': filters.Hankel().key_201_2009,
+                     'pts_per_dec': 0, 'kernel': 'fused'}
+            return transform.hankel_dlf(
+                    5., 15., 1, 1, off, np.ones(noff+1), depth, 11, eta,
+                    eta, zeta, zeta, False, htarg, False, False)[0]
+
+        run(3, 2)  # Warm-up (numba compilation)
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        run(300, 300)
+        print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss)
+    """
+    out = subprocess.run([sys.executable, '-c', script], capture_output=True)
+    assert out.returncode == 0, out.stderr.decode()
+    assert int(out.stdout) < 100_000  # Peak growth < 100 MB (in kB)
+
+
+def test_get_dlf_pruned():                                  # get_dlf_pruned
+    filt = filters.Hankel().key_201_2009
+    off = np.array([0.5, 1, 2, 4])
+    lambd, _ = transform.get_dlf_points(filt, off, 0)
+    ulambd = transform.get_dlf_unique(lambd)[0]
+
+    # GPR-type model: air, 1 m of 200 Ohm.m, 20 Ohm.m
+    depth = np.array([-np.inf, 0, 1])
+    freq = np.array([1e8, 1e9])[:, None]
+    eta = 1/np.array([2e14, 200, 20]) + 2j*np.pi*freq*np.array([1, 9, 15])*(
+            1/(4e-7*np.pi*299792458**2))
+    zeta = 2j*np.pi*freq*np.ones(3)*4e-7*np.pi
+    model = (depth, eta, eta, zeta, zeta)
+
+    # Src at the surface, rec at 0.5 m: the large lambdas are skipped
+    keep = transform.get_dlf_pruned(ulambd, 1e-3, 0.5, 1, 1, *model, False,
+                                    1e-10)
+    assert 0 < keep.sum() < keep.size
+    assert np.all(keep[:np.argmin(keep)])   # Only the tail is skipped
+    assert not np.any(keep[np.argmin(keep):])
+
+    # Larger tolerance => more skipped; same depth => nothing to skip
+    keep2 = transform.get_dlf_pruned(ulambd, 1e-3, 0.5, 1, 1, *model, False,
+                                     1e-4)
+    assert keep2.sum() < keep.sum()
+    keep3 = transform.get_dlf_pruned(ulambd, 0.5, 0.5, 1, 1, *model, False,
+                                     1e-4)
+    assert keep3.all()
+
+    # Without direct field the reflections are pruned; different layers
+    keep4 = transform.get_dlf_pruned(ulambd, 0.5, 0.5, 1, 1, *model, True,
+                                     1e-10)
+    assert keep4.sum() < keep4.size
+    keep5 = transform.get_dlf_pruned(ulambd, -0.5, 1.5, 0, 2, *model, False,
+                                     1e-10)
+    assert keep5.sum() < keep.sum()
+
+    # The DLF result is unchanged within the tolerance
+    for pts_per_dec in [0, -1, 10]:
+        htarg = {'dlf': filt, 'pts_per_dec': pts_per_dec}
+        inp = (1e-3, 0.5, 1, 1, off, np.ones(4), depth, 11, eta, eta, zeta,
+               zeta, False)
+        fEM = transform.hankel_dlf(*inp, htarg, False, False)[0]
+        pfEM = transform.hankel_dlf(*inp, {**htarg, 'prune': 1e-10}, False,
+                                    False)[0]
+        assert_allclose(pfEM, fEM, rtol=0, atol=1e-8*abs(fEM).max())
+
+
+def test_hankel_plan():                                          # HankelPlan
+    off = np.array([0.5, 1, 2, 4, 1])
+    angle = np.array([0, 1, 2, 3, 0.])
+    ang_fact = kernel.angle_factor(angle, 13, False, False)
+    depth = np.array([-np.inf, 0, 1])
+    eta = np.array([[1/2e14, 1/200, 1/20]])*(1+0j)
+    zeta = 2j*np.pi*np.ones((1, 3))*4e-7*np.pi
+    inp = (0.2, 0.5, 1, 1, off, ang_fact, depth, 13, eta, eta, zeta, zeta,
+           False)
+
+    for pts_per_dec in [0, -1, 10]:
+        htarg = {'pts_per_dec': pts_per_dec}
+        _, chtarg = utils.check_hankel('dlf', htarg, 0)
+        fEM = transform.hankel_dlf(*inp, chtarg, False, False)[0]
+
+        # Points computed at creation are reused
+        plan = transform.HankelPlan(htarg, off=off)
+        points = plan.points(off)
+        assert plan.points(off.copy()) is points
+        _, phtarg = utils.check_hankel('dlf', {'plan': plan}, 0)
+        for _ in range(2):
+            pfEM = transform.hankel_dlf(*inp, phtarg, False, False)[0]
+            assert_allclose(pfEM, fEM, rtol=1e-14)
+        assert plan.points(off) is points
+
+        # Single precision: weights stored in single precision too
+        sinp = [x.astype(np.complex64) for x in inp[8:12]]
+        pfEM = transform.hankel_dlf(*inp[:8], *sinp, False, phtarg, False,
+                                    False)[0]
+        assert_allclose(pfEM, fEM, rtol=1e-4, atol=1e-4*abs(fEM).max())
+        assert set(plan._weights) == {np.dtype('f8'), np.dtype('f4')}
+
+    # Angle factors
+    out = plan.angle_factor(angle, 13, False, False)
+    assert_allclose(out, ang_fact)
+    assert plan.angle_factor(angle.copy(), 13, False, False) is out
+    assert 'splined, 10.0 pts/dec; 1 geometries' in repr(plan)
+
+    with pytest.raises(ValueError, match="of a HankelPlan cannot contain"):
+        transform.HankelPlan({'cache': kernel.ReflectionCache()})
+
+
 def test_get_fftlog_input():                             # 10. get_fftlog_input
     # Check one example
     freq, tcalc, dlnr, kr, rk = transform.get_fftlog_input(-1, 2, 60, 0, 0.5)
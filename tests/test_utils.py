@@ -5,7 +5,7 @@ import subprocess
 import numpy as np
 from numpy.testing import assert_allclose
 
-from empymod import utils, filters
+from empymod import utils, filters, kernel, transform
 
 
 def test_emarray():
@@ -49,6 +49,14 @@ def test_check_ab(capsys):
         assert msrc == omsrc[i]
         assert mrec == omrec[i]
 
+    # Full tensor
+    ab, msrc, mrec = utils.check_ab('all', 3)
+    out, _ = capsys.readouterr()
+    assert out == "   Input ab        :  all (full tensor)\n"
+    assert_allclose(ab.ravel(), oab)
+    assert_allclose(msrc.ravel(), omsrc)
+    assert_allclose(mrec.ravel(), omrec)
+
     utils.check_ab(36, 3)
     out, _ = capsys.readouterr()
     outstr = "   Input ab        :  36\n\n>  <ab> IS 36 WHICH IS ZERO; "
@@ -266,6 +274,42 @@ def test_check_frequency(capsys):
     freq, etaH, etaV, zetaH, zetaV = output
     assert_allclose(freq, rfreq)
 
+    # Ensemble of models: (nmodel, nfreq, nlayer)
+    output = utils.check_frequency(np.array([0, 1, 1e6]),
+                                   np.array([[20, .02], [20, .02]]),
+                                   np.array([1, 3]), np.array([10, 5]),
+                                   np.array([20, 50]), np.array([1, 1]),
+                                   np.array([10, 5]), 0)
+    for val, ref in zip(output[1:], [retaH, retaV, rzetaH, rzetaV]):
+        assert val.shape == (2, 3, 2)
+        assert_allclose(val, [ref, ref])
+
+
+def test_check_precision(capsys):
+    etaH = np.array([[1+1j, 2+2j]])
+    zetaH = np.array([[1e-6j, 2e-6j]])
+    eta = np.array([[1., 2.]])
+
+    # Double: unchanged
+    out = utils.check_precision('double', etaH, etaH, zetaH, zetaH, 3)
+    outstr, _ = capsys.readouterr()
+    assert "   Precision       :  Double" in outstr
+    assert out[0] is etaH
+    assert out[2] is zetaH
+
+    # Single: complex64, and float32 in the Laplace domain
+    out = utils.check_precision('single', etaH, etaH, zetaH, zetaH, 3)
+    outstr, _ = capsys.readouterr()
+    assert "   Precision       :  Single" in outstr
+    assert all(v.dtype == np.complex64 for v in out)
+    assert_allclose(out[0], etaH)
+    assert_allclose(out[3], zetaH)
+    out = utils.check_precision('single', eta, eta, eta, eta, 0)
+    assert all(v.dtype == np.float32 for v in out)
+
+    with pytest.raises(ValueError, match="<precision> must be one of"):
+        utils.check_precision('half', etaH, etaH, zetaH, zetaH, 0)
+
 
 def test_check_hankel(capsys):
     # # DLF # #
@@ -306,6 +350,57 @@ def test_check_hankel(capsys):
     assert htarg['dlf'].name == filters.Hankel().key_201_2009.name
     assert htarg['pts_per_dec'] == 20
 
+    # provide kernel
+    _, htarg = utils.check_hankel('dlf', {}, 0)
+    assert htarg['kernel'] == 'default'
+    _, htarg = utils.check_hankel('dlf', {'kernel': 'fused'}, 3)
+    out, _ = capsys.readouterr()
+    assert "     > Kernel      :  Fused (low memory)" in out
+    assert htarg['kernel'] == 'fused'
+    with pytest.raises(ValueError, match=r"<htarg\['kernel'\]> must be one"):
+        utils.check_hankel('dlf', {'kernel': 'abc'}, 0)
+
+    # provide prune
+    _, htarg = utils.check_hankel('dlf', {}, 3)
+    out, _ = capsys.readouterr()
+    assert htarg['prune'] == 0
+    assert "Pruning" not in out
+    _, htarg = utils.check_hankel('dlf', {'prune': 1e-8}, 3)
+    out, _ = capsys.readouterr()
+    assert "     > Pruning     :  1e-08" in out
+    assert htarg['prune'] == 1e-8
+
+    # provide cache
+    _, htarg = utils.check_hankel('dlf', {}, 0)
+    assert htarg['cache'] is None
+    cache = kernel.ReflectionCache()
+    _, htarg = utils.check_hankel('dlf', {'cache': cache}, 3)
+    out, _ = capsys.readouterr()
+    assert "     > Reflections :  Incremental (cache)" in out
+    assert htarg['cache'] is cache  # Not copied
+    with pytest.raises(TypeError, match=r"<htarg\['cache'\]> must be an"):
+        utils.check_hankel('dlf', {'cache': {}}, 0)
+    with pytest.raises(ValueError, match=r"<htarg\['cache'\]> is only"):
+        utils.check_hankel('dlf', {'cache': cache, 'kernel': 'fused'}, 0)
+
+    # provide plan
+    _, htarg = utils.check_hankel('dlf', {}, 0)
+    assert htarg['plan'] is None
+    plan = transform.HankelPlan({'pts_per_dec': -1})
+    _, htarg = utils.check_hankel('dlf', {'plan': plan, 'cache': cache}, 3)
+    out, _ = capsys.readouterr()
+    assert "     > DLF type    :  Lagged Convolution" in out
+    assert "     > Plan        :  Precomputed (HankelPlan)" in out
+    assert htarg['plan'] is plan
+    assert htarg['cache'] is cache
+    assert htarg['dlf'] is plan.htarg['dlf']  # Not copied
+    with pytest.raises(TypeError, match=r"<htarg\['plan'\]> must be an"):
+        utils.check_hankel('dlf', {'plan': {}}, 0)
+    with pytest.raises(ValueError, match=r"<htarg\['plan'\]> is only"):
+        utils.check_hankel('qwe', {'plan': plan}, 0)
+    with pytest.raises(ValueError, match="can only contain 'cache' in"):
+        utils.check_hankel('dlf', {'plan': plan, 'pts_per_dec': 0}, 0)
+
     # Assert it can be called repetitively
     _, _ = capsys.readouterr()
     ht, htarg = utils.check_hankel('dlf', {}, 1)
@@ -484,6 +579,49 @@ def test_check_model(capsys):
         utils.check_model(
                 0, 1, [2, 2], [10, 10], [1, 1], [2, 2], [3, 3], True, 1)
 
+    # Merge identical adjacent layers, keep the ones with src/rec
+    depth = [0, 10, 20, 30, 40, 50, 60]
+    res = [1e20, 1, 1, 1, 5, 5, 5, 5]
+    aniso = [1, 1, 1, 1, 1, 1, 2, 2]
+    out = utils.check_model(depth, res, aniso, None, None, None, None, True,
+                            3, True, [[0, 0], 45, []])
+    out1, _ = capsys.readouterr()
+    assert "   Merged layers   :  8 -> 6" in out1
+    assert_allclose(out[0], [-np.inf, 0, 10, 30, 40, 50])
+    assert_allclose(out[1], [1e20, 1, 1, 5, 5, 5])
+    assert_allclose(out[2], [1, 1, 1, 1, 1, 2])
+
+    # No merging with merge=False, nor for user-provided models
+    out = utils.check_model(depth, res, aniso, None, None, None, None, True,
+                            3, False)
+    assert_allclose(out[0], np.r_[-np.inf, depth])
+    out = utils.check_model(depth, {'res': res}, aniso, None, None, None,
+                            None, True, 3, True, [])
+    assert_allclose(out[0], np.r_[-np.inf, depth])
+    out2, _ = capsys.readouterr()
+    assert "Merged layers" not in out2
+
+    # Ensemble of models; merge only layers identical in all models
+    res = np.array([[1e20, 1, 1, 2], [1e20, 3, 3, 3]])
+    with pytest.raises(ValueError, match='Parameter res has wrong shape'):
+        utils.check_model([0, 10, 20], res, None, None, None, None, None,
+                          True, 1)
+    out = utils.check_model([20, 10, 0], res[:, ::-1], [[1, 1, 1, 1]]*2,
+                            None, None, None, None, True, 3, True, [-5], True)
+    out1, _ = capsys.readouterr()
+    assert "   Ensemble        :  2 models" in out1
+    assert "   Merged layers   :  4 -> 3" in out1
+    assert "   res     [Ohm.m] :  1 - 1E+20 : 6  [min-max; #]" in out1
+    assert_allclose(out[0], [-np.inf, 0, 20])
+    assert_allclose(out[1], [[1e20, 1, 2], [1e20, 3, 3]])
+    assert_allclose(out[2], np.ones((2, 3)))
+    assert not out[7]
+
+    # Ensemble of fullspaces
+    out = utils.check_model(0, [[1, 1], [2, 2]], None, None, None, None, None,
+                            True, 1, ensemble=True)
+    assert out[7]
+
 
 def test_check_all_depths():
     depth = np.array([-50, 0, 100, 2000])
@@ -1036,6 +1174,64 @@ def test_get_azm_dip(capsys):
     assert outstr[:47] == "   Receiver(s)     :  1 bipole(s)\n     > intpts"
 
 
+def test_get_depth_groups():
+    # Dipoles, one depth
+    inp = [np.arange(4.), np.zeros(4), np.array([100.]), 0, 0]
+    out = utils.get_depth_groups(inp, 1, True)
+    assert len(out) == 1
+    assert_allclose(out[0], [0, 1, 2, 3])
+
+    # Dipoles, two depths
+    inp = [np.arange(4.), np.zeros(4), np.array([100., 200, 100, 200]),
+           np.zeros(4), np.zeros(4)]
+    out = utils.get_depth_groups(inp, 4, True)
+    assert len(out) == 2
+    assert_allclose(out[0], [0, 2])
+    assert_allclose(out[1], [1, 3])
+
+    # Bipoles, grouped by the depths of both poles
+    inp = [np.arange(4.), np.arange(4.)+10, np.zeros(4), np.zeros(4),
+           np.array([100., 100, 100, 200]), np.array([100., 110, 100, 200])]
+    out = utils.get_depth_groups(inp, 4, False)
+    assert len(out) == 3
+    assert_allclose(out[0], [0, 2])
+    assert_allclose(out[1], [1])
+    assert_allclose(out[2], [3])
+
+    # Dipoles of a group are taken at once by get_azm_dip
+    inp = [np.arange(4.), np.zeros(4), np.array([100., 200, 100, 200]),
+           np.array([0., 10, 20, 30]), np.zeros(4)]
+    out = utils.get_azm_dip(inp, np.array([1, 3]), 4, 1, True, 0, 'src', 0)
+    assert_allclose(out[0][0], [1, 3])
+    assert_allclose(out[0][2], [200, 200])
+    assert_allclose(out[1], np.deg2rad([10, 30]))
+
+
+def test_get_nlayer_truncated():
+    # Layers of 10 m of 1 Ohm.m; attenuation 2*Re(sqrt(i*w*mu/rho))*10 each
+    depth = np.r_[-np.inf, np.arange(10)*10.]
+    freq = np.array([1e-3, 1e4, 1e6])
+    etaH = np.ones((3, 11)) + 0j
+    zetaH = 2j*np.pi*freq[:, None]*np.ones((3, 11))*4e-7*np.pi
+    att = 20*np.sqrt(etaH[:, 0]*zetaH[:, 0]).real
+    out = utils.get_nlayer_truncated(depth, 15, 5, etaH, zetaH, 1e-8)
+
+    # Interfaces below 15 m are at 5 m, 15 m, 25 m, ... distance; keep the
+    # ones with an attenuation above the threshold
+    nkeep = np.ceil((-np.log(1e-8)/att - 0.5)).astype(int)
+    assert_allclose(out, np.minimum(11, 3 + nkeep))
+    assert out[0] == 11  # No truncation at low frequencies
+    assert out[2] < out[1] < 11
+
+    # The layers of sources and receivers are always kept (65 m: layer 7)
+    out = utils.get_nlayer_truncated(depth, [15, 65], 5, etaH, zetaH, 0.999)
+    assert_allclose(out, [9, 8, 8])
+
+    # No truncation
+    out = utils.get_nlayer_truncated(depth, 15, 5, etaH, zetaH, 0)
+    assert_allclose(out, [11, 11, 11])
+
+
 def test_get_kwargs(capsys):
     kwargs1 = {'ft': 'sin', 'depth': []}
     ft, ht = utils.get_kwargs(['ft', 'ht'], ['dlf', 'dlf'], kwargs1)
@@ -1230,5 +1426,35 @@ def test_import_time():
     assert float(out.stderr.decode("utf-8")[:-1]) < 1.2
 
 
+def test_lazy_import():
+    # `import empymod` imports no heavy dependencies; modules, functions, and
+    # the scooby-based Report are imported on first use.
+    script = """if True:
+        import sys
+        import empymod
+        heavy = ['numpy', 'scipy', 'numba', 'libdlf', 'scooby']
+        assert not any(m in sys.modules for m in heavy), sys.modules.keys()
+        assert empymod.__version__ == empymod.utils.__version__
+        assert 'scooby' not in sys.modules
+        assert empymod.Report.__name__ == 'Report'
+        assert 'scooby' in sys.modules
+        assert empymod.dipole is empymod.model.dipole
+        assert empymod.tmtemod is empymod.scripts.tmtemod
+        assert set(empymod.__all__) < set(dir(empymod))
+        for name in dir(empymod):
+            getattr(empymod, name)
+    """
+    out = subprocess.run([sys.executable, '-c', script], capture_output=True)
+    assert out.returncode == 0, out.stderr.decode()
+
+    import empymod
+    with pytest.raises(AttributeError, match="has no attribute 'foo'"):
+        empymod.foo
+    with pytest.raises(AttributeError, match="has no attribute 'foo'"):
+        empymod.scripts.foo
+    with pytest.raises(AttributeError, match="has no attribute 'foo'"):
+        utils.foo
+
+
 def test_all_dir():
     assert set(utils.__all__) == set(dir(utils))